@@ -0,0 +1,374 @@
+"""
+비디오의 프레임별 NMS 전 네트워크 출력(박스, objectness, 클래스 확률)을 저장하고
+저장된 출력으로 thresh, hier_thresh, nms 조합을 추론 없이 다시 계산하여
+정답(ground truth) 어노테이션과 비교한다.
+
+저장 형식 (비디오 하나당 디렉토리 하나) :
+    archive.json : 열 수, 저장 임계값 하한, 클래스 이름, 비디오 정보
+    chunk_00000.npy : (행 수, 5 + 클래스 수) float32 출력
+                      (cx, cy, w, h, objectness, prob_0, ..., prob_n), 프레임 좌표
+    chunk_00000.index.npy : (프레임 수, 3) int64 (frame, 시작 행, 행 수)
+    청크는 chunk_frames 프레임마다 기록되며 읽을 때는 memory-map으로 연다.
+
+정답 어노테이션 형식 (utils.writeAnnotations와 같음) :
+    <gt_dir>/<프레임 번호>.txt, 한 줄에 "클래스 cx cy w h" (0~1로 정규화)
+    클래스는 이름 또는 class_id, 프레임 번호는 0부터 시작
+
+사용법 :
+    python archive.py record video.mp4 out_dir --cfg ... --weights ... --data ...
+    python archive.py sweep out_dir gt_dir --thresh 0.1 0.25 --nms 0.3 0.45
+"""
+
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import cache
+from utils import boxIOUMatrix, nonMaxSuppression
+
+
+META_FILE = 'archive.json'
+
+
+class RawArchiveWriter:
+    """
+    프레임별 NMS 전 출력을 청크 단위로 기록하는 클래스
+    """
+    def __init__(self, path, columns, meta=None, chunk_frames=256):
+        '''
+        저장 디렉토리, 열 수(5 + 클래스 수), 부가 정보, 청크당 프레임 수를 입력받아
+        디렉토리를 만들고 정보 파일을 기록
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.columns = columns
+        self.chunk_frames = chunk_frames
+        self.meta = dict(meta or {})
+        self.meta.update({'columns': columns, 'chunk_frames': chunk_frames,
+                          'frames': 0})
+        # 같은 디렉토리에 다시 기록하면 이전 청크를 지움
+        for old in glob.glob(os.path.join(path, 'chunk_*.npy')):
+            os.remove(old)
+        self.chunk = 0
+        self.frames = 0
+
+        self.rows = []
+        self.index = []
+        self.writeMeta()
+
+    def writeMeta(self):
+        '''
+        정보 파일 기록
+        '''
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def put(self, frame, raw):
+        '''
+        프레임의 (cx, cy, w, h, objectness, prob...) 배열 추가
+        '''
+        raw = np.asarray(raw, dtype=np.float32).reshape(-1, self.columns)
+        start = sum(len(rows) for rows in self.rows)
+        self.rows.append(raw)
+        self.index.append((frame, start, len(raw)))
+        if len(self.index) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        '''
+        모아둔 프레임을 청크 파일로 기록
+        '''
+        if not self.index:
+            return
+        name = os.path.join(self.path, 'chunk_%05d' % self.chunk)
+        np.save(name + '.npy', np.concatenate(self.rows))
+        # 출력이 모두 기록된 뒤에 색인을 기록하여 중단시 불완전한 청크를 무시
+        np.save(name + '.index.npy', np.array(self.index, dtype=np.int64))
+        self.chunk += 1
+        self.frames += len(self.index)
+        self.rows = []
+        self.index = []
+        self.meta['frames'] = self.frames
+        self.writeMeta()
+
+    def close(self):
+        '''
+        남은 프레임을 기록
+        '''
+        self.flush()
+
+
+class RawArchive:
+    """
+    RawArchiveWriter로 기록한 출력을 memory-map으로 읽는 클래스
+    """
+    def __init__(self, path):
+        '''
+        저장 디렉토리를 입력받아 정보 파일과 청크 색인을 읽음
+        '''
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            raise ValueError("Invalid raw archive `" + path + "`")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.columns = self.meta['columns']
+
+        self.chunks = []
+        # frame -> (청크 번호, 시작 행, 행 수)
+        self.index = {}
+        for index_path in sorted(glob.glob(
+                os.path.join(path, 'chunk_*.index.npy'))):
+            rows = np.load(index_path[:-len('.index.npy')] + '.npy',
+                           mmap_mode='r')
+            for frame, start, count in np.load(index_path).tolist():
+                self.index[frame] = (len(self.chunks), start, count)
+            self.chunks.append(rows)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, frame):
+        return frame in self.index
+
+    def frames(self):
+        '''
+        저장된 프레임 번호 리스트
+        '''
+        return sorted(self.index)
+
+    def get(self, frame):
+        '''
+        프레임의 출력 배열 반환, 없으면 None
+        '''
+        if frame not in self.index:
+            return None
+        chunk, start, count = self.index[frame]
+        return self.chunks[chunk][start:start + count]
+
+
+def replayRaw(raw, thresh=.25, nms=.45):
+    '''
+    NMS 전 출력에 darknet get_network_boxes와 do_nms_sort의 필터링을 다시 적용하여
+    (class_id, score, cx, cy, w, h) 배열 반환
+    objectness가 thresh보다 큰 박스에서 thresh보다 큰 클래스 확률만 남김
+    thresh는 저장할 때 사용한 하한 이상이어야 같은 결과를 얻음
+    hier_thresh는 계층(tree) 출력에서만 쓰이며 yolo 레이어 출력에는 영향이 없음
+    '''
+    raw = raw[raw[:, 4] > thresh]
+    rows, cols = np.nonzero(raw[:, 5:] > thresh)
+    scores = raw[rows, 5 + cols]
+    order = np.argsort(-scores, kind="stable")
+    detections = np.empty((len(order), 6), dtype=np.float32)
+    detections[:, 0] = cols[order]
+    detections[:, 1] = scores[order]
+    detections[:, 2:] = raw[rows[order], :4]
+    if nms:
+        detections = nonMaxSuppression(detections, nms)
+    return detections
+
+
+def recordVideo(video_path, det, path, thresh=.05, hier_thresh=.5,
+                chunk_frames=256, max_frames=None):
+    '''
+    비디오의 모든 프레임을 검출기의 배치 크기 단위로 추론하여
+    NMS 전 출력을 path에 기록하고 기록한 프레임 수 반환
+    '''
+    cap = cv2.VideoCapture(video_path)
+    det.ensureLoaded()
+    names = [name.decode() for name in det.backend.names]
+    writer = RawArchiveWriter(path, 5 + len(names), {
+        'video': os.path.abspath(video_path),
+        'video_hash': cache.videoHash(video_path),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'names': names, 'thresh': thresh, 'hier_thresh': hier_thresh,
+    }, chunk_frames)
+
+    frame_num = 0
+    begin = time.perf_counter()
+    while max_frames is None or frame_num < max_frames:
+        frames = []
+        while len(frames) < det.batch_size and \
+                (max_frames is None or frame_num + len(frames) < max_frames):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        if not frames:
+            break
+        for raw in det.inferRaw(frames, thresh, hier_thresh):
+            writer.put(frame_num, raw)
+            frame_num += 1
+    writer.close()
+    cap.release()
+
+    elapsed = time.perf_counter() - begin
+    print('recorded %d frames in %.1fs (%.1f fps)' %
+          (frame_num, elapsed, frame_num / elapsed if elapsed > 0 else 0))
+    return frame_num
+
+
+def loadGroundTruth(gt_dir, names, width, height):
+    '''
+    정답 어노테이션 디렉토리를 읽어
+    {frame: (class_id, cx, cy, w, h) 배열 (프레임 좌표)} 반환
+    '''
+    ground_truth = {}
+    for path in glob.glob(os.path.join(gt_dir, '*.txt')):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if not stem.isdigit():
+            continue
+        boxes = []
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 5:
+                    continue
+                label = fields[0]
+                class_id = int(label) if label.isdigit() else \
+                    names.index(label)
+                x, y, w, h = [float(v) for v in fields[-4:]]
+                boxes.append((class_id, x * width, y * height,
+                              w * width, h * height))
+        ground_truth[int(stem)] = np.array(boxes, dtype=np.float32) \
+            .reshape(-1, 5)
+    return ground_truth
+
+
+def matchDetections(detections, ground_truth, iou_thresh=.5):
+    '''
+    한 프레임의 검출 결과와 정답을 신뢰도 순으로 같은 클래스끼리 매칭하여
+    (TP, FP, FN) 반환
+    '''
+    if len(detections) == 0 or len(ground_truth) == 0:
+        return 0, len(detections), len(ground_truth)
+    ious = boxIOUMatrix(detections[:, 2:], ground_truth[:, 1:])
+    ious[detections[:, None, 0] != ground_truth[None, :, 0]] = 0
+    matched = np.zeros(len(ground_truth), dtype=bool)
+    tp = 0
+    for i in np.argsort(-detections[:, 1], kind="stable"):
+        candidates = np.where(matched, 0, ious[i])
+        j = int(np.argmax(candidates))
+        if candidates[j] >= iou_thresh:
+            matched[j] = True
+            tp += 1
+    return tp, len(detections) - tp, len(ground_truth) - tp
+
+
+def sweep(archive, ground_truth, threshs, hier_threshs=(.5,), nmses=(.45,),
+          iou_thresh=.5):
+    '''
+    저장된 출력으로 (thresh, hier_thresh, nms) 조합마다 검출 결과를 다시 계산하여
+    정답이 있는 프레임에 대한 precision, recall, f1 리스트 반환
+    hier_thresh는 yolo 레이어 출력에 영향이 없으므로 같은 thresh, nms의 결과를 공유
+    '''
+    floor = archive.meta.get('thresh', 0)
+    frames = [frame for frame in sorted(ground_truth) if frame in archive]
+    counts = {}
+    results = []
+    for thresh, hier_thresh, nms in itertools.product(threshs, hier_threshs,
+                                                     nmses):
+        if thresh < floor:
+            print('thresh %.3f is below the archive floor %.3f, skipped' %
+                  (thresh, floor))
+            continue
+        if (thresh, nms) not in counts:
+            tp, fp, fn = 0, 0, 0
+            for frame in frames:
+                detections = replayRaw(archive.get(frame), thresh, nms)
+                t, p, n = matchDetections(detections, ground_truth[frame],
+                                          iou_thresh)
+                tp, fp, fn = tp + t, fp + p, fn + n
+            counts[(thresh, nms)] = (tp, fp, fn)
+        tp, fp, fn = counts[(thresh, nms)]
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        results.append({
+            'thresh': thresh, 'hier_thresh': hier_thresh, 'nms': nms,
+            'frames': len(frames), 'tp': tp, 'fp': fp, 'fn': fn,
+            'precision': precision, 'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall)
+                  if precision + recall else 0.0,
+        })
+    return results
+
+
+def record(args):
+    '''
+    record 명령 : 비디오의 NMS 전 출력을 기록
+    '''
+    import detector
+    det = detector.Detector(args.backend)
+    det.initialize(args.cfg, args.weights, args.data, args.batch)
+    recordVideo(args.video, det, args.out, args.thresh, args.hier_thresh,
+                args.chunk, args.max_frames)
+
+
+def sweepCommand(args):
+    '''
+    sweep 명령 : 기록된 출력으로 파라미터 조합을 평가
+    '''
+    archive = RawArchive(args.archive)
+    ground_truth = loadGroundTruth(args.gt, archive.meta['names'],
+                                   archive.meta['width'],
+                                   archive.meta['height'])
+    results = sweep(archive, ground_truth, args.thresh, args.hier_thresh,
+                    args.nms, args.iou)
+    print('thresh hier_thresh   nms  precision recall     f1')
+    for result in sorted(results, key=lambda r: -r['f1']):
+        print('%6.3f %11.3f %5.3f %10.3f %6.3f %6.3f' % (
+            result['thresh'], result['hier_thresh'], result['nms'],
+            result['precision'], result['recall'], result['f1']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_record = commands.add_parser('record')
+    parser_record.add_argument('video')
+    parser_record.add_argument('out')
+    parser_record.add_argument('--cfg')
+    parser_record.add_argument('--weights')
+    parser_record.add_argument('--data')
+    parser_record.add_argument('--backend', default='darknet')
+    parser_record.add_argument('--batch', type=int, default=1)
+    parser_record.add_argument('--thresh', type=float, default=.05,
+                               help='lowest thresh the sweep can replay')
+    parser_record.add_argument('--hier-thresh', type=float, default=.5)
+    parser_record.add_argument('--chunk', type=int, default=256,
+                               help='frames per chunk file')
+    parser_record.add_argument('--max-frames', type=int)
+    parser_record.set_defaults(func=record)
+
+    parser_sweep = commands.add_parser('sweep')
+    parser_sweep.add_argument('archive')
+    parser_sweep.add_argument('gt')
+    parser_sweep.add_argument('--thresh', type=float, nargs='+',
+                              default=[.1, .25, .5])
+    parser_sweep.add_argument('--hier-thresh', type=float, nargs='+',
+                              default=[.5])
+    parser_sweep.add_argument('--nms', type=float, nargs='+',
+                              default=[.3, .45, .6])
+    parser_sweep.add_argument('--iou', type=float, default=.5,
+                              help='IOU needed to match a ground truth box')
+    parser_sweep.add_argument('--json', help='write the results as json')
+    parser_sweep.set_defaults(func=sweepCommand)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,271 @@
+"""
+추적 객체와 검출 결과를 IOU로 짝지어 주는 할당 방법들을 제공한다.
+
+모든 방법은 IOU가 임계값 이상인 (행, 열, IOU) 쌍 목록을 입력받아
+Tracker.tracking에서 사용하는 iou_indexes 형태
+[[(추적 인덱스, 검출 인덱스), IOU], ...] 를 IOU가 큰 순서로 반환한다.
+
+greedy : IOU가 큰 쌍부터 차례로 선택, 쌍 K개에 대해 O(K log K)
+         전체 행렬에서 argmax를 반복하던 기존 방식과 같은 결과
+hungarian : IOU 합이 최대가 되는 최적 할당 (Jonker-Volgenant 최단 증가 경로)
+            서로 겹치는 쌍으로 연결된 묶음별로 따로 풀어 크기를 줄임
+"""
+
+
+import numpy as np
+
+
+def gatePairs(iou_matrix, min_iou=0.1):
+    '''
+    N×M IOU 행렬에서 min_iou 이상인 쌍의 (rows, cols, values) 배열 반환
+    행 우선 순서
+    '''
+    iou_matrix = np.asarray(iou_matrix, dtype=float)
+    if iou_matrix.ndim != 2 or iou_matrix.size == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, np.zeros(0, dtype=float)
+    rows, cols = np.nonzero(iou_matrix >= min_iou)
+    return rows, cols, iou_matrix[rows, cols]
+
+
+def toIOUIndexes(rows, cols, values):
+    '''
+    선택된 쌍을 IOU가 큰 순서의 iou_indexes 리스트로 변환
+    '''
+    order = np.argsort(-np.asarray(values), kind='stable')
+    return [[(int(rows[k]), int(cols[k])), float(values[k])] for k in order]
+
+
+def greedyAssignment(rows, cols, values):
+    '''
+    IOU가 큰 쌍부터 행과 열이 아직 사용되지 않았으면 선택
+    같은 IOU는 행 우선 순서를 따르므로 argmax 반복과 결과가 같음
+    '''
+    order = np.argsort(-np.asarray(values), kind='stable')
+    used_rows, used_cols = set(), set()
+    selected = []
+    for k in order:
+        row, col = int(rows[k]), int(cols[k])
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        selected.append([(row, col), float(values[k])])
+    return selected
+
+
+def linearAssignment(cost):
+    '''
+    n×m (n <= m) 비용 행렬의 최소 비용 할당 (Jonker-Volgenant 최단 증가 경로)
+    행을 하나씩 추가하며 열 방향 연산은 numpy로 처리, O(n^2 m)
+    반환 : 행별로 할당된 열 인덱스 배열
+    '''
+    n, m = cost.shape
+    # 1부터 시작하는 인덱스, 0번 열은 증가 경로의 시작점
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col] = True
+            current = owner[col]
+            free = ~used[1:]
+            reduced = cost[current - 1] - u[current] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col
+            candidates = np.where(free, minv[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            visited = np.nonzero(used)[0]
+            u[owner[visited]] += delta
+            v[visited] -= delta
+            minv[1:][free] -= delta
+
+            col = next_col
+            if owner[col] == 0:
+                break
+        # 증가 경로를 따라 할당 갱신
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    assignment = np.full(n, -1, dtype=int)
+    assigned = np.nonzero(owner[1:])[0]
+    assignment[owner[assigned + 1] - 1] = assigned
+    return assignment
+
+
+def components(rows, cols):
+    '''
+    쌍으로 연결된 행과 열의 묶음을 찾아 쌍 인덱스 리스트의 리스트로 반환
+    '''
+    parent = {}
+
+    def find(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for row, col in zip(rows, cols):
+        a, b = find(('r', int(row))), find(('c', int(col)))
+        if a != b:
+            parent[a] = b
+
+    groups = {}
+    for k, row in enumerate(rows):
+        groups.setdefault(find(('r', int(row))), []).append(k)
+    return list(groups.values())
+
+
+def hungarianAssignment(rows, cols, values):
+    '''
+    선택된 쌍의 IOU 합이 최대가 되도록 할당
+    쌍이 없는 조합의 비용은 1 (IOU 0) 이므로 할당되더라도 결과에서 제외
+    '''
+    rows = np.asarray(rows, dtype=int)
+    cols = np.asarray(cols, dtype=int)
+    values = np.asarray(values, dtype=float)
+
+    selected = []
+    for group in components(rows, cols):
+        if len(group) == 1:
+            selected.append(group[0])
+            continue
+        group = np.asarray(group)
+        group_rows, row_index = np.unique(rows[group], return_inverse=True)
+        group_cols, col_index = np.unique(cols[group], return_inverse=True)
+        cost = np.ones((len(group_rows), len(group_cols)))
+        cost[row_index, col_index] = 1 - values[group]
+        pair = np.full(cost.shape, -1, dtype=int)
+        pair[row_index, col_index] = group
+
+        transposed = cost.shape[0] > cost.shape[1]
+        if transposed:
+            assignment = linearAssignment(cost.T)
+            matches = [(row, col) for col, row in enumerate(assignment)]
+        else:
+            assignment = linearAssignment(cost)
+            matches = list(enumerate(assignment))
+        selected.extend(pair[row, col] for row, col in matches
+                        if row >= 0 and col >= 0 and pair[row, col] >= 0)
+
+    selected = np.asarray(selected, dtype=int)
+    return toIOUIndexes(rows[selected], cols[selected], values[selected])
+
+
+ASSIGNMENTS = {
+    'greedy': greedyAssignment,
+    'hungarian': hungarianAssignment,
+}
+
+
+class SpatialGrid:
+    """
+    박스를 격자 칸에 등록해 두고 겹칠 수 있는 박스만 찾는 공간 해시
+    양의 넓이로 겹치는 두 박스는 반드시 같은 칸을 하나 이상 공유하므로
+    후보 쌍에서 IOU가 0보다 큰 쌍이 빠지지 않는다.
+    """
+    def __init__(self, cell_size=128):
+        '''
+        cell_size : 격자 한 칸의 크기 (픽셀)
+        '''
+        self.cell_size = cell_size
+        # 칸 -> 등록된 key 집합
+        self.cells = {}
+        # key -> 등록된 칸 범위 (x0, y0, x1, y1)
+        self.spans = {}
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __contains__(self, key):
+        return key in self.spans
+
+    def span(self, box):
+        '''
+        [x0, y0, x1, y1] 박스가 걸치는 칸 범위 반환
+        '''
+        size = self.cell_size
+        return (int(box[0] // size), int(box[1] // size),
+                int(box[2] // size), int(box[3] // size))
+
+    def spanCells(self, span):
+        '''
+        칸 범위에 포함된 칸 좌표 반환
+        '''
+        x0, y0, x1, y1 = span
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def update(self, key, box):
+        '''
+        key의 박스를 등록, 걸치는 칸이 바뀐 경우에만 다시 등록
+        '''
+        span = self.span(box)
+        previous = self.spans.get(key)
+        if previous == span:
+            return
+        if previous is not None:
+            self.remove(key)
+        self.spans[key] = span
+        for cell in self.spanCells(span):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        '''
+        key의 등록 해제
+        '''
+        span = self.spans.pop(key, None)
+        if span is None:
+            return
+        for cell in self.spanCells(span):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def sync(self, keys, boxes):
+        '''
+        현재 key와 박스 목록으로 격자 갱신
+        움직인 key만 다시 등록하고 목록에 없는 key는 제거
+        '''
+        current = set(keys)
+        for key in [key for key in self.spans if key not in current]:
+            self.remove(key)
+        for key, box in zip(keys, boxes):
+            self.update(key, box)
+
+    def query(self, box):
+        '''
+        박스와 같은 칸에 등록된 key 집합 반환
+        '''
+        found = set()
+        for cell in self.spanCells(self.span(box)):
+            found.update(self.cells.get(cell, ()))
+        return found
+
+    def candidatePairs(self, keys, boxes):
+        '''
+        등록된 key 목록(행)과 질의 박스 목록(열)에서 칸을 공유하는
+        (rows, cols) 후보 쌍을 행 우선 순서로 반환
+        '''
+        index = {key: row for row, key in enumerate(keys)}
+        rows, cols = [], []
+        for col, box in enumerate(boxes):
+            for key in self.query(box):
+                row = index.get(key)
+                if row is not None:
+                    rows.append(row)
+                    cols.append(col)
+        rows = np.asarray(rows, dtype=int)
+        cols = np.asarray(cols, dtype=int)
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order]
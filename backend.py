@@ -0,0 +1,653 @@
+"""
+검출기에서 사용하는 추론 백엔드를 정의한다.
+darknet ctypes 백엔드, OpenCV DNN CPU 백엔드와
+테스트 및 벤치마크를 위한 결정적(deterministic) stub 백엔드를 제공한다.
+
+모든 백엔드는 (batch, c, h, w) float32 입력 버퍼 input_data를 가지며
+predict는 이미지마다 (class_id, score, cx, cy, w, h) 배열을
+네트워크 입력 크기 좌표로 반환한다.
+
+불러온 네트워크는 프로세스 전역 레지스트리(NETWORKS)에서
+(백엔드, cfg, weights, data) 조합마다 한번만 불러와 참조 횟수로 공유한다.
+"""
+
+
+import os
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from profiler import stage
+
+
+def checkPaths(configPath, weightPath, metaPath):
+    '''
+    cfg, weight, data 파일의 존재 여부를 확인
+    '''
+    if not os.path.exists(configPath):
+        raise ValueError("Invalid config path `" +
+                         os.path.abspath(configPath)+"`")
+    if not os.path.exists(weightPath):
+        raise ValueError("Invalid weight path `" +
+                         os.path.abspath(weightPath)+"`")
+    if not os.path.exists(metaPath):
+        raise ValueError("Invalid data file path `" +
+                         os.path.abspath(metaPath)+"`")
+
+
+def readNames(metaPath):
+    '''
+    .data 파일의 names 항목이 가리키는 파일에서 클래스 이름 목록을 읽어 반환
+    파일이 없거나 읽을 수 없으면 None 반환
+    '''
+    try:
+        with open(metaPath) as metaFH:
+            metaContents = metaFH.read()
+    except (TypeError, OSError):
+        return None
+    match = re.search("names *= *(.*)$", metaContents,
+                      re.IGNORECASE | re.MULTILINE)
+    if not match:
+        return None
+    result = match.group(1).strip()
+    if not os.path.exists(result):
+        return None
+    with open(result) as namesFH:
+        namesList = namesFH.read().strip().split("\n")
+    return [x.strip() for x in namesList]
+
+
+def readClassCount(metaPath, configPath=None):
+    '''
+    .data 파일의 classes 항목, 없으면 cfg 파일의 classes 항목에서 클래스 수를 읽어 반환
+    찾을 수 없으면 None 반환
+    '''
+    for path in (metaPath, configPath):
+        try:
+            with open(path) as fh:
+                contents = fh.read()
+        except (TypeError, OSError):
+            continue
+        match = re.search(r"^ *classes *= *(\d+)", contents,
+                          re.IGNORECASE | re.MULTILINE)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def readNetworkSize(configPath):
+    '''
+    cfg 파일의 [net] 항목에서 네트워크 입력 크기 (width, height)를 읽어 반환
+    '''
+    width, height = None, None
+    with open(configPath) as cfgFH:
+        for line in cfgFH:
+            line = line.split('#')[0].strip()
+            if line.startswith('[') and line != '[net]' and width:
+                break
+            match = re.match(r"(width|height) *= *(\d+)", line)
+            if match and match.group(1) == 'width':
+                width = int(match.group(2))
+            elif match:
+                height = int(match.group(2))
+    return width, height
+
+
+def emptyDetections():
+    '''
+    검출 결과가 없을 때 반환하는 빈 배열
+    '''
+    return np.zeros((0, 6), dtype=np.float32)
+
+
+class NetworkHandle:
+    """
+    레지스트리가 관리하는 불러온 네트워크
+    같은 네트워크를 공유하는 백엔드는 추론 중 lock을 잡아야 한다.
+    """
+    def __init__(self, key, free=None):
+        '''
+        레지스트리 키와 해제 함수를 입력받아 생성
+        '''
+        self.key = key
+        self.free = free
+        self.resources = None
+        self.error = None
+        self.refcount = 0
+        self.ready = threading.Event()
+        # 네트워크 출력 버퍼를 공유하므로 추론은 한번에 하나씩
+        self.lock = threading.Lock()
+
+
+class NetworkRegistry:
+    """
+    키마다 네트워크를 한번만 불러와 참조 횟수로 공유하는 레지스트리
+    """
+    def __init__(self):
+        '''
+        빈 레지스트리 생성
+        '''
+        self.handles = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, load, free=None):
+        '''
+        key로 불러온 네트워크가 있으면 참조 횟수를 늘려 반환하고
+        없으면 load()를 호출하여 불러옴 (load()의 반환값이 handle.resources)
+        다른 스레드가 같은 키를 불러오는 중이면 완료될 때까지 대기
+        free : 마지막 참조가 해제될 때 resources를 입력받아 호출할 함수
+        '''
+        with self.lock:
+            handle = self.handles.get(key)
+            owner = handle is None
+            if owner:
+                handle = NetworkHandle(key, free)
+                self.handles[key] = handle
+            handle.refcount += 1
+
+        if owner:
+            try:
+                handle.resources = load()
+            except Exception as e:
+                handle.error = e
+                with self.lock:
+                    # 다음 요청은 다시 불러오도록 제거
+                    if self.handles.get(key) is handle:
+                        del self.handles[key]
+            handle.ready.set()
+        else:
+            handle.ready.wait()
+
+        if handle.error is not None:
+            with self.lock:
+                handle.refcount -= 1
+            raise handle.error
+        return handle
+
+    def release(self, handle):
+        '''
+        참조 횟수를 줄이고 마지막 참조이면 네트워크를 해제
+        해제했으면 True 반환
+        '''
+        with self.lock:
+            handle.refcount -= 1
+            if handle.refcount > 0:
+                return False
+            if self.handles.get(handle.key) is handle:
+                del self.handles[handle.key]
+        # 진행 중인 추론이 끝난 뒤 해제
+        with handle.lock:
+            if handle.free is not None and handle.resources is not None:
+                handle.free(handle.resources)
+            handle.resources = None
+        return True
+
+    def __contains__(self, key):
+        return key in self.handles
+
+    def __len__(self):
+        return len(self.handles)
+
+
+# process wide network registry
+NETWORKS = NetworkRegistry()
+
+
+def networkKey(backend_name, configPath, weightPath, metaPath, *options):
+    '''
+    레지스트리 키 생성, 경로는 절대 경로로 변환
+    '''
+    return (backend_name, os.path.abspath(configPath),
+            os.path.abspath(weightPath), os.path.abspath(metaPath)) + options
+
+
+class Backend:
+    """
+    추론 백엔드의 공통 인터페이스
+    """
+    def __init__(self):
+        '''
+        백엔드 공통 멤버 변수 선언
+        '''
+        self.width = None
+        self.height = None
+        self.batch_size = 1
+
+        # class names as bytes, same as darknet METADATA.names
+        self.names = None
+
+        # network input buffer (batch, c, h, w), RGB 0.0~1.0
+        self.input_data = None
+
+        # False이면 레지스트리에서 다른 백엔드와 네트워크를 공유하지 않음
+        self.shared = True
+
+    def registryKey(self, *parts):
+        '''
+        레지스트리 키 생성, 공유하지 않는 백엔드는 자신만의 키를 사용
+        '''
+        key = networkKey(*parts)
+        if not self.shared:
+            key += (id(self),)
+        return key
+
+    def load(self, configPath, weightPath, metaPath, batch_size=1):
+        '''
+        네트워크를 불러오고 입력 버퍼를 생성하는 함수
+        '''
+        raise NotImplementedError
+
+    def predict(self, count, thresh=.5, hier_thresh=.5, nms=.45):
+        '''
+        input_data의 앞쪽 count개 이미지를 추론하여
+        이미지별 (class_id, score, cx, cy, w, h) 배열 리스트를 반환
+        '''
+        raise NotImplementedError
+
+    def predictRaw(self, count, thresh=.005, hier_thresh=.5):
+        '''
+        input_data의 앞쪽 count개 이미지를 추론하여 NMS 전 출력
+        이미지별 (cx, cy, w, h, objectness, prob_0, ..., prob_n) 배열 리스트를 반환
+        prob는 darknet과 같이 objectness * class 확률이며 thresh 이하는 0
+        '''
+        raise NotImplementedError
+
+    def release(self):
+        '''
+        백엔드가 사용하는 자원을 해제
+        '''
+        pass
+
+
+class DarknetBackend(Backend):
+    """
+    darknet 라이브러리를 ctypes로 호출하는 백엔드
+    """
+    def __init__(self):
+        '''
+        darknet 네트워크 관련 멤버 변수 선언
+        '''
+        super().__init__()
+        self.handle = None
+        self.netMain = None
+        self.metaMain = None
+        self.darknet_image = None
+
+    @staticmethod
+    def loadNetwork(configPath, weightPath, metaPath, batch_size):
+        '''
+        darknet 네트워크와 메타 정보, 클래스 이름(bytes)을 불러와 반환
+        names 파일을 읽을 수 있으면 그 이름을, 아니면 meta.names를 사용
+        '''
+        import darknet
+
+        netMain = darknet.load_net_custom(configPath.encode(
+            "ascii"), weightPath.encode("ascii"), 0, batch_size)
+        metaMain = darknet.load_meta(metaPath.encode("ascii"))
+        altNames = readNames(metaPath)
+        if altNames is not None and len(altNames) == metaMain.classes:
+            names = [name.encode() for name in altNames]
+        else:
+            names = [metaMain.names[i] for i in range(metaMain.classes)]
+        return {'net': netMain, 'meta': metaMain, 'names': names}
+
+    @staticmethod
+    def freeNetwork(resources):
+        '''
+        darknet 네트워크 해제 (라이브러리가 free_network_ptr를 제공할 때만)
+        '''
+        import darknet
+
+        if darknet.free_network_ptr is not None:
+            darknet.free_network_ptr(resources['net'])
+
+    def load(self, configPath, weightPath, metaPath, batch_size=1):
+        '''
+        레지스트리에서 darknet 네트워크와 메타 정보를 받아오고 입력 이미지를 생성
+        '''
+        import darknet
+        from ctypes import POINTER, c_float
+
+        checkPaths(configPath, weightPath, metaPath)
+
+        self.batch_size = batch_size
+        self.handle = NETWORKS.acquire(
+            self.registryKey('darknet', configPath, weightPath, metaPath,
+                             batch_size),
+            lambda: self.loadNetwork(configPath, weightPath, metaPath,
+                                     batch_size),
+            self.freeNetwork)
+        self.netMain = self.handle.resources['net']
+        self.metaMain = self.handle.resources['meta']
+        self.names = self.handle.resources['names']
+
+        self.width = darknet.network_width(self.netMain)
+        self.height = darknet.network_height(self.netMain)
+
+        if self.batch_size == 1:
+            # Create an image we reuse for each detect and view its buffer
+            self.darknet_image = darknet.make_image(self.width,
+                                                    self.height, 3)
+            self.input_data = np.ctypeslib.as_array(
+                self.darknet_image.data,
+                shape=(1, 3, self.height, self.width))
+        else:
+            # Create one contiguous input tensor for batch inference
+            self.input_data = np.zeros((self.batch_size, 3,
+                                        self.height, self.width),
+                                       dtype=np.float32)
+            self.darknet_image = darknet.IMAGE(
+                self.width, self.height, 3,
+                self.input_data.ctypes.data_as(POINTER(c_float)))
+
+    def predict(self, count, thresh=.5, hier_thresh=.5, nms=.45):
+        '''
+        darknet 네트워크로 추론
+        배치 크기가 1보다 크면 남은 슬롯을 0으로 채운 뒤 한번에 추론
+        '''
+        import darknet
+
+        with self.handle.lock:
+            if self.batch_size == 1:
+                with stage('predict_image'):
+                    darknet.predict_image(self.netMain, self.darknet_image)
+                with stage('get_network_boxes'):
+                    return [darknet.network_boxes_array(
+                        self.netMain, self.metaMain, self.darknet_image.w,
+                        self.darknet_image.h, thresh, hier_thresh, nms)]
+            self.input_data[count:] = 0
+            # network_predict_batch는 추론과 박스 계산을 한번에 수행
+            with stage('predict_batch'):
+                results = darknet.detect_batch(self.netMain, self.metaMain,
+                                               self.darknet_image,
+                                               self.batch_size, thresh,
+                                               hier_thresh, nms)
+        return results[:count]
+
+    def predictRaw(self, count, thresh=.005, hier_thresh=.5):
+        '''
+        darknet 네트워크로 추론하여 get_network_boxes 출력을 NMS 없이 반환
+        '''
+        import darknet
+
+        with self.handle.lock:
+            if self.batch_size == 1:
+                return [darknet.detect_image_raw(self.netMain, self.metaMain,
+                                                 self.darknet_image, thresh,
+                                                 hier_thresh)]
+            self.input_data[count:] = 0
+            results = darknet.detect_batch_raw(self.netMain, self.metaMain,
+                                               self.darknet_image,
+                                               self.batch_size, thresh,
+                                               hier_thresh)
+        return results[:count]
+
+    def release(self):
+        '''
+        입력 이미지를 해제하고 레지스트리에 네트워크 참조를 반환
+        '''
+        import darknet
+
+        if self.handle is None:
+            return
+        if self.batch_size == 1:
+            self.input_data = None
+            darknet.free_image(self.darknet_image)
+        self.darknet_image = None
+        NETWORKS.release(self.handle)
+        self.handle = None
+        self.netMain = None
+        self.metaMain = None
+
+
+class OpenCVBackend(Backend):
+    """
+    cv2.dnn.readNetFromDarknet을 이용하여 같은 cfg/weights를
+    멀티 스레드 CPU로 추론하는 백엔드
+    OpenCV 스레드 수(cv2.setNumThreads)는 디코딩, 크기 변환 등 프로세스의
+    모든 cv2 호출에 적용되므로 백엔드에서 바꾸지 않고 진입점에서 설정한다.
+    (batch.py, benchmark.py의 --threads)
+    """
+    def __init__(self):
+        '''
+        OpenCV 네트워크 관련 멤버 변수 선언
+        '''
+        super().__init__()
+        self.handle = None
+        self.net = None
+        self.output_names = None
+
+    def load(self, configPath, weightPath, metaPath, batch_size=1):
+        '''
+        OpenCV DNN 모듈로 darknet 네트워크를 불러옴
+        '''
+        checkPaths(configPath, weightPath, metaPath)
+
+        def loadNetwork():
+            net = cv2.dnn.readNetFromDarknet(configPath, weightPath)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            return net
+
+        self.batch_size = batch_size
+        self.handle = NETWORKS.acquire(
+            self.registryKey('opencv', configPath, weightPath, metaPath),
+            loadNetwork)
+        self.net = self.handle.resources
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+
+        names = readNames(metaPath)
+        if names is None:
+            # names 파일이 없으면 darknet과 같이 클래스 번호를 이름으로 사용
+            classes = readClassCount(metaPath, configPath)
+            if classes is None:
+                raise ValueError("Invalid names or classes in `" +
+                                 os.path.abspath(metaPath) + "`")
+            names = [str(i) for i in range(classes)]
+        self.names = [name.encode() for name in names]
+
+        self.width, self.height = readNetworkSize(configPath)
+        self.input_data = np.zeros((self.batch_size, 3,
+                                    self.height, self.width),
+                                   dtype=np.float32)
+
+    def predict(self, count, thresh=.5, hier_thresh=.5, nms=.45):
+        '''
+        OpenCV DNN으로 추론 후 클래스별 NMS를 적용
+        hier_thresh는 yolo 레이어에서 사용되지 않으므로 무시
+        '''
+        with self.handle.lock, stage('predict_image'):
+            self.net.setInput(self.input_data[:count])
+            outs = self.net.forward(self.output_names)
+
+        with stage('get_network_boxes'):
+            return self.decode(outs, count, thresh, nms)
+
+    def decode(self, outs, count, thresh, nms):
+        '''
+        yolo 출력 레이어 값을 이미지별 (class_id, score, cx, cy, w, h) 배열로 변환
+        '''
+        scale = np.array([self.width, self.height, self.width, self.height],
+                         dtype=np.float32)
+        results = []
+        for b in range(count):
+            rows = np.concatenate(
+                [out.reshape(count, -1, out.shape[-1])[b] for out in outs])
+            probs = rows[:, 5:]
+            box_idx, class_ids = np.nonzero(probs > thresh)
+            if len(box_idx) == 0:
+                results.append(emptyDetections())
+                continue
+            scores = probs[box_idx, class_ids]
+            boxes = rows[box_idx, :4] * scale
+
+            if nms:
+                # NMSBoxes는 좌상단 좌표를 사용하므로 변환 후 클래스별 적용
+                tl_boxes = boxes.copy()
+                tl_boxes[:, :2] -= tl_boxes[:, 2:] / 2
+                keep = []
+                for class_id in np.unique(class_ids):
+                    idx = np.flatnonzero(class_ids == class_id)
+                    kept = cv2.dnn.NMSBoxes(tl_boxes[idx].tolist(),
+                                            scores[idx].tolist(), thresh, nms)
+                    keep.extend(idx[np.array(kept, dtype=int).reshape(-1)])
+                keep = np.array(keep, dtype=int)
+                class_ids, scores, boxes = \
+                    class_ids[keep], scores[keep], boxes[keep]
+
+            order = np.argsort(-scores, kind="stable")
+            res = np.empty((len(order), 6), dtype=np.float32)
+            res[:, 0] = class_ids[order]
+            res[:, 1] = scores[order]
+            res[:, 2:] = boxes[order]
+            results.append(res)
+        return results
+
+    def predictRaw(self, count, thresh=.005, hier_thresh=.5):
+        '''
+        OpenCV DNN으로 추론하여 objectness가 thresh보다 큰 출력을 NMS 없이 반환
+        '''
+        with self.handle.lock:
+            self.net.setInput(self.input_data[:count])
+            outs = self.net.forward(self.output_names)
+
+        scale = np.array([self.width, self.height, self.width, self.height],
+                         dtype=np.float32)
+        results = []
+        for b in range(count):
+            rows = np.concatenate(
+                [out.reshape(count, -1, out.shape[-1])[b] for out in outs])
+            rows = rows[rows[:, 4] > thresh].astype(np.float32)
+            rows[:, :4] *= scale
+            rows[:, 5:][rows[:, 5:] <= thresh] = 0
+            results.append(rows)
+        return results
+
+    def release(self):
+        '''
+        레지스트리에 OpenCV 네트워크 참조를 반환
+        '''
+        if self.handle is None:
+            return
+        NETWORKS.release(self.handle)
+        self.handle = None
+        self.net = None
+
+
+class StubBackend(Backend):
+    """
+    라이브러리 없이 동작하는 결정적 테스트용 백엔드
+    입력 이미지에서 밝기가 level 이상인 연결 영역을 객체로 검출한다.
+    """
+    def __init__(self, width=416, height=416, level=0.9, min_area=4,
+                 latency=0.0):
+        '''
+        stub 백엔드 설정
+        width, height : cfg를 지정하지 않았을 때 사용할 입력 크기
+        level : 객체로 판단할 밝기 (0.0~1.0)
+        min_area : 객체로 판단할 최소 픽셀 수
+        latency : 추론 1회에 추가할 지연 시간(초)
+        '''
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.level = level
+        self.min_area = min_area
+        self.latency = latency
+        self.names = [b'defect']
+
+    def load(self, configPath=None, weightPath=None, metaPath=None,
+             batch_size=1):
+        '''
+        cfg와 data 파일이 있으면 입력 크기와 클래스 이름을 읽고 입력 버퍼 생성
+        weight 파일은 사용하지 않음
+        '''
+        if configPath is not None and os.path.exists(configPath):
+            self.width, self.height = readNetworkSize(configPath)
+        if metaPath is not None:
+            names = readNames(metaPath)
+            if names is not None:
+                self.names = [name.encode() for name in names]
+
+        self.batch_size = batch_size
+        self.input_data = np.zeros((self.batch_size, 3,
+                                    self.height, self.width),
+                                   dtype=np.float32)
+
+    def predict(self, count, thresh=.5, hier_thresh=.5, nms=.45):
+        '''
+        밝은 연결 영역의 외접 사각형을 검출 결과로 반환
+        신뢰도는 영역 내 평균 밝기
+        '''
+        with stage('predict_image'):
+            return self.detect(count, thresh)
+
+    def detect(self, count, thresh):
+        '''
+        밝기 기준으로 연결 영역을 찾아 검출 결과 배열 리스트 반환
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+
+        results = []
+        for b in range(count):
+            brightness = self.input_data[b].min(axis=0)
+            mask = (brightness >= self.level).astype(np.uint8)
+            num, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+            stats = stats[1:]
+            keep = stats[:, cv2.CC_STAT_AREA] >= self.min_area
+            stats = stats[keep]
+            if len(stats) == 0:
+                results.append(emptyDetections())
+                continue
+            sums = np.bincount(labels.ravel(), weights=brightness.ravel(),
+                               minlength=num)[1:][keep]
+            scores = sums / stats[:, cv2.CC_STAT_AREA]
+
+            res = np.empty((len(stats), 6), dtype=np.float32)
+            res[:, 0] = 0
+            res[:, 1] = scores
+            res[:, 2] = stats[:, cv2.CC_STAT_LEFT] + \
+                stats[:, cv2.CC_STAT_WIDTH] / 2
+            res[:, 3] = stats[:, cv2.CC_STAT_TOP] + \
+                stats[:, cv2.CC_STAT_HEIGHT] / 2
+            res[:, 4] = stats[:, cv2.CC_STAT_WIDTH]
+            res[:, 5] = stats[:, cv2.CC_STAT_HEIGHT]
+            res = res[res[:, 1] > thresh]
+            results.append(res[np.argsort(-res[:, 1], kind="stable")])
+        return results
+
+    def predictRaw(self, count, thresh=.005, hier_thresh=.5):
+        '''
+        검출 결과를 objectness와 클래스 확률이 모두 신뢰도인 NMS 전 출력 형태로 반환
+        '''
+        results = []
+        for detections in self.predict(count, thresh):
+            raw = np.zeros((len(detections), 5 + len(self.names)),
+                           dtype=np.float32)
+            raw[:, :4] = detections[:, 2:]
+            raw[:, 4] = detections[:, 1]
+            raw[np.arange(len(detections)),
+                5 + detections[:, 0].astype(int)] = detections[:, 1]
+            results.append(raw)
+        return results
+
+
+BACKENDS = {
+    'darknet': DarknetBackend,
+    'opencv': OpenCVBackend,
+    'stub': StubBackend,
+}
+
+
+def createBackend(name, **kwargs):
+    '''
+    백엔드 이름으로 백엔드 객체를 생성하여 반환
+    '''
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend `" + str(name) + "`, expected one of " +
+                         ", ".join(sorted(BACKENDS)))
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,193 @@
+"""
+GUI 없이 비디오 디렉토리(또는 glob 패턴)의 모든 비디오를 검출 및 추적하여
+utils.drawDetectionResults, drawTrackResults 형식의 결과 파일과
+utils.writeAnnotations 형식의 프레임별 어노테이션을 기록한다.
+
+출력 (비디오 이름이 video일 때) :
+    <out>/video_detections.txt
+    <out>/video_tracks.txt
+    <out>/video_annotations/<프레임 번호>.txt
+    <out>/video_metrics.json, video_metrics.prom (단계별 소요 시간)
+
+사용법 :
+    python batch.py /data/survey --cfg yolov4-tiny.cfg \\
+        --weights yolov4-tiny.weights --data yolov4-tiny.data --jobs 4
+"""
+
+
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+
+import cv2
+
+import profiler
+import utils
+
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mkv', '.mov')
+STAGES = ('decode', 'detect', 'track', 'write')
+
+
+def findVideos(inputs):
+    '''
+    디렉토리 또는 glob 패턴 목록을 입력받아 비디오 파일 경로 리스트 반환
+    '''
+    videos = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name)
+                     for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern)
+        videos.extend(path for path in sorted(paths)
+                      if path.lower().endswith(VIDEO_EXTENSIONS))
+    return videos
+
+
+def processVideo(job):
+    '''
+    비디오 하나를 검출 및 추적하여 결과 파일을 기록하는 작업 함수
+    job : (video_path, model, out_dir, thresh, annotate)
+          model은 (backend, cfg, weights, data)
+    반환 : {'video', 'frames', 'elapsed', 'stages': {단계: 누적 초}}
+    '''
+    import detector
+    import tracker
+
+    video_path, model, out_dir, thresh, annotate = job
+    backend, configPath, weightPath, metaPath = model
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    prefix = os.path.join(out_dir, name)
+
+    det = detector.Detector(backend)
+    det.initialize(configPath, weightPath, metaPath)
+    track = tracker.Tracker()
+    # 단계별 측정값은 비디오마다 따로 기록
+    profiler.PROFILER.reset()
+
+    cap = cv2.VideoCapture(video_path)
+    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    annotation_dir = prefix + '_annotations'
+    if annotate and not os.path.isdir(annotation_dir):
+        os.makedirs(annotation_dir)
+
+    stages = dict.fromkeys(STAGES, 0.0)
+    frames = 0
+    begin = time.perf_counter()
+    with open(prefix + '_detections.txt', 'w') as detection_writer, \
+            open(prefix + '_tracks.txt', 'w') as track_writer:
+        while True:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            stages['decode'] += time.perf_counter() - start
+            if not ret:
+                break
+            frames += 1
+
+            start = time.perf_counter()
+            detections = det.detector(frame, thresh)
+            stages['detect'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            detection_infos = track.convertDetection2Tracking(detections,
+                                                              frames)
+            track.tracking(detection_infos, frames)
+            stages['track'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            utils.drawDetectionResults(detection_writer, detections, frames)
+            utils.drawTrackResults(track_writer, track.track_infos, frames)
+            if annotate and detections:
+                utils.writeAnnotations(
+                    os.path.join(annotation_dir, '%05d.txt' % frames),
+                    detections, width, height, thresh)
+            stages['write'] += time.perf_counter() - start
+    elapsed = time.perf_counter() - begin
+    cap.release()
+    det.release()
+    profiler.PROFILER.writeJSON(prefix + '_metrics.json')
+    profiler.PROFILER.writePrometheus(prefix + '_metrics.prom')
+
+    return {'video': video_path, 'frames': frames, 'elapsed': elapsed,
+            'stages': stages}
+
+
+def report(result):
+    '''
+    비디오 하나의 처리 속도와 단계별 프레임당 소요 시간을 출력
+    '''
+    frames = max(result['frames'], 1)
+    fps = result['frames'] / result['elapsed'] if result['elapsed'] else 0.0
+    stages = ', '.join('%s %.1f ms' % (stage,
+                                       result['stages'][stage] * 1000 / frames)
+                       for stage in STAGES)
+    print('%s : %d frames, %.1fs, %.1f fps (%s)' % (
+        os.path.basename(result['video']), result['frames'],
+        result['elapsed'], fps, stages))
+
+
+def run(videos, model, out_dir, jobs=1, thresh=0.25, annotate=True,
+        threads=None):
+    '''
+    비디오 목록을 jobs개의 프로세스에서 처리하고 비디오별 결과를 반환
+    threads : 프로세스별 OpenCV 스레드 수 (None이면 OpenCV 기본값)
+    '''
+    if threads is not None:
+        cv2.setNumThreads(threads)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    tasks = [(video, model, out_dir, thresh, annotate) for video in videos]
+
+    results = []
+    if jobs <= 1:
+        for task in tasks:
+            results.append(processVideo(task))
+            report(results[-1])
+        return results
+
+    # darknet(CUDA) 상태를 자식 프로세스에 복사하지 않도록 spawn 사용
+    context = multiprocessing.get_context('spawn')
+    initializer = cv2.setNumThreads if threads is not None else None
+    with context.Pool(jobs, initializer, (threads,)) as pool:
+        for result in pool.imap_unordered(processVideo, tasks):
+            results.append(result)
+            report(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+',
+                        help='video directories or glob patterns')
+    parser.add_argument('--cfg')
+    parser.add_argument('--weights')
+    parser.add_argument('--data')
+    parser.add_argument('--backend', default='darknet')
+    parser.add_argument('--out', default='results')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='videos processed in parallel')
+    parser.add_argument('--thresh', type=float, default=0.25)
+    parser.add_argument('--threads', type=int,
+                        help='OpenCV threads per process (default: OpenCV)')
+    parser.add_argument('--no-annotations', dest='annotate',
+                        action='store_false',
+                        help='skip the per frame annotation files')
+    args = parser.parse_args()
+
+    videos = findVideos(args.inputs)
+    if not videos:
+        parser.error('no videos found in ' + ', '.join(args.inputs))
+    begin = time.perf_counter()
+    results = run(videos, (args.backend, args.cfg, args.weights, args.data),
+                  args.out, args.jobs, args.thresh, args.annotate,
+                  args.threads)
+    elapsed = time.perf_counter() - begin
+    frames = sum(result['frames'] for result in results)
+    print('total : %d videos, %d frames, %.1fs, %.1f fps' % (
+        len(results), frames, elapsed, frames / elapsed if elapsed else 0.0))
@@ -0,0 +1,379 @@
+"""
+검출 경로의 성능을 측정한다.
+stub 백엔드를 사용하므로 darknet 라이브러리 없이 실행할 수 있다.
+
+pipeline 벤치마크는 위치를 알고 있는 사각형들이 움직이는 합성 도로 비디오를
+생성한 뒤 디코딩, 전처리, 검출, 추적, 그리기, 결과 기록까지 프레임 경로 전체를
+실행하고 처리 속도, 단계별 소요 시간, 최대 메모리(RSS)를 측정한다.
+저장해 둔 기준 결과(--baseline)와 비교하여 tolerance 이상 느려지면 실패로 종료한다.
+
+사용법 :
+    python benchmark.py [preprocess pipeline ...]
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.15
+"""
+
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import association
+import detector
+import profiler
+import tracker
+import utils
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+def benchPreprocess(frames=200, width=1920, height=1080):
+    '''
+    프레임 전처리(크기 조정, 채널 변환, 정규화)의 속도와
+    프레임당 메모리 할당량을 측정
+    '''
+    det = detector.Detector('stub')
+    det.initialize(None, None, None)
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    out = det.backend.input_data[0]
+
+    # warm up
+    det.preprocess(frame, out)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(frames):
+        det.preprocess(frame, out)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'frames': frames,
+        'ms_per_frame': elapsed * 1000 / frames,
+        'retained_bytes_per_frame': current / frames,
+        'peak_bytes': peak,
+    }
+    print('preprocess %dx%d -> %dx%d : %.3f ms/frame, '
+          'retained %.1f B/frame, peak %d B' %
+          (width, height, det.network_width, det.network_height,
+           result['ms_per_frame'], result['retained_bytes_per_frame'],
+           result['peak_bytes']))
+    return result
+
+
+def bounce(position, span):
+    '''
+    [0, span] 구간 양 끝에서 튕기며 움직이는 위치 계산
+    '''
+    if span <= 0:
+        return 0.0
+    position = position % (2 * span)
+    return position if position <= span else 2 * span - position
+
+
+def makeRoadVideo(path, frames=300, width=1280, height=720, objects=8,
+                  fps=30, seed=0):
+    '''
+    차선마다 흰 사각형 하나가 일정한 속도로 좌우로 오가는 합성 도로 비디오 생성
+    배경은 stub 백엔드의 검출 밝기보다 어둡게 만들어 사각형만 검출되도록 함
+    반환 : {프레임 번호(1부터): [(cx, cy, w, h), ...]} 실제 박스 위치
+    '''
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps,
+                             (width, height))
+    if not writer.isOpened():
+        raise ValueError("Invalid video path `" + os.path.abspath(path) + "`")
+
+    # 아스팔트 질감과 차선
+    background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    lane = height / objects
+    for index in range(1, objects):
+        y = int(index * lane)
+        for x in range(0, width, 80):
+            cv2.line(background, (x, y), (x + 40, y), (160, 160, 160), 2)
+
+    sizes = np.stack([rng.integers(width // 30, width // 12, objects),
+                      np.full(objects, int(lane * 0.5))], axis=1)
+    starts = rng.uniform(0, width, objects)
+    speeds = rng.uniform(2, 8, objects) * rng.choice([-1, 1], objects)
+
+    truth = {}
+    for frame_num in range(1, frames + 1):
+        frame = background.copy()
+        boxes = []
+        for index in range(objects):
+            w, h = sizes[index]
+            x = bounce(starts[index] + speeds[index] * frame_num, width - w)
+            y = index * lane + (lane - h) / 2
+            xmin, ymin = int(round(x)), int(round(y))
+            cv2.rectangle(frame, (xmin, ymin), (xmin + w - 1, ymin + h - 1),
+                          (255, 255, 255), -1)
+            boxes.append((xmin + w / 2, ymin + h / 2, float(w), float(h)))
+        writer.write(frame)
+        truth[frame_num] = boxes
+    writer.release()
+    return truth
+
+
+def peakRSS():
+    '''
+    프로세스의 최대 RSS(MB) 반환, 측정할 수 없으면 None
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux는 KB, macOS는 byte 단위
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def benchPipeline(frames=300, width=1280, height=720, objects=8,
+                  thresh=0.25):
+    '''
+    합성 도로 비디오로 디코딩부터 결과 기록까지 프레임 경로 전체를 측정
+    검출 결과를 실제 박스 위치와 비교한 recall도 함께 기록하여
+    속도 변화가 결과 변화를 동반하는지 확인할 수 있도록 함
+    '''
+    # 추적 색상을 고정하여 실행마다 같은 그리기 작업을 수행
+    random.seed(0)
+    workdir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        video_path = os.path.join(workdir, 'road.avi')
+        truth = makeRoadVideo(video_path, frames, width, height, objects)
+
+        det = detector.Detector('stub')
+        det.initialize(None, None, None)
+        track = tracker.Tracker()
+        profiler.PROFILER.reset()
+
+        cap = cv2.VideoCapture(video_path)
+        frame_num = 0
+        matched = 0
+        with open(os.path.join(workdir, 'detections.txt'), 'w') \
+                as detection_writer, \
+                open(os.path.join(workdir, 'tracks.txt'), 'w') \
+                as track_writer:
+            start = time.perf_counter()
+            while True:
+                with profiler.stage('decode'):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_num += 1
+
+                with profiler.stage('detect'):
+                    detections = det.detector(frame, thresh)
+                detection_infos = track.convertDetection2Tracking(detections,
+                                                                  frame_num)
+                track.tracking(detection_infos, frame_num)
+
+                utils.cvDrawBoxes(detections, frame)
+                utils.cvDrawTracks(track.track_infos, frame)
+                utils.drawDetectionResults(detection_writer, detections,
+                                           frame_num)
+                utils.drawTrackResults(track_writer, track.track_infos,
+                                       frame_num)
+
+                if detections:
+                    ious = utils.boxIOUMatrix(
+                        truth[frame_num],
+                        [detection[2] for detection in detections])
+                    matched += int((ious.max(axis=1) >= 0.5).sum())
+            elapsed = time.perf_counter() - start
+        cap.release()
+        det.release()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = profiler.PROFILER.snapshot()
+    result = {
+        'frames': frame_num,
+        'fps': frame_num / elapsed if elapsed else 0.0,
+        'ms_per_frame': elapsed * 1000 / max(frame_num, 1),
+        'recall': matched / max(frame_num * objects, 1),
+        'peak_rss_mb': peakRSS(),
+        'stages': {name: {key: stages[name][key]
+                          for key in ('mean', 'p50', 'p95', 'p99')}
+                   for name in stages},
+    }
+    print('pipeline %dx%d, %d objects : %d frames, %.1f fps, '
+          '%.2f ms/frame, recall %.3f, peak RSS %s MB' %
+          (width, height, objects, result['frames'], result['fps'],
+           result['ms_per_frame'], result['recall'],
+           '%.1f' % result['peak_rss_mb']
+           if result['peak_rss_mb'] is not None else '-'))
+    profiler.PROFILER.report()
+    return result
+
+
+def argmaxAssignment(iou_matrix, min_iou=0.1):
+    '''
+    전체 행렬에서 argmax를 반복하던 기존 Tracker.tracking의 할당 방식 (비교용)
+    '''
+    iou_matrix = iou_matrix.copy()
+    iou_indexes = []
+    for _ in range(iou_matrix.shape[0]):
+        idx = np.unravel_index(np.argmax(iou_matrix), iou_matrix.shape)
+        value = iou_matrix[idx]
+        if value < min_iou:
+            break
+        iou_indexes.append([idx, value])
+        iou_matrix[idx[0], :] = 0
+        iou_matrix[:, idx[1]] = 0
+    return iou_indexes
+
+
+def makeScene(objects, rng, density=0.02):
+    '''
+    objects개의 추적 박스와 흔들림, 미검출, 새 객체를 포함한 검출 박스 생성
+    장면 크기는 객체 밀도가 같도록 객체 수에 맞춰 키움
+    반환 : (추적 박스, 검출 박스) (cx, cy, w, h) 배열
+    '''
+    size = np.sqrt(objects * 40 * 40 / density)
+    tracks = np.column_stack([rng.uniform(0, size, (objects, 2)),
+                              rng.uniform(20, 60, (objects, 2))])
+    detections = tracks[rng.random(objects) > 0.1].copy()
+    detections[:, :2] += rng.normal(0, 4, (len(detections), 2))
+    detections[:, 2:] *= rng.uniform(0.9, 1.1, (len(detections), 2))
+    new = max(1, objects // 10)
+    detections = np.vstack([detections, np.column_stack([
+        rng.uniform(0, size, (new, 2)), rng.uniform(20, 60, (new, 2))])])
+    return tracks, detections
+
+
+def benchAssociation(sizes=(10, 100, 1000), repeats=None):
+    '''
+    객체 수별로 기존 argmax 반복, greedy, hungarian 할당의
+    소요 시간과 할당된 쌍 수, IOU 합 비교 (IOU 행렬 계산 시간 제외)
+    '''
+    rng = np.random.default_rng(0)
+    result = {}
+    for objects in sizes:
+        tracks, detections = makeScene(objects, rng)
+        iou_matrix = utils.boxIOUMatrix(tracks, detections).astype(float)
+        runs = repeats or max(1, 2000 // objects)
+
+        methods = {'argmax': lambda: argmaxAssignment(iou_matrix)}
+        for name, assign in association.ASSIGNMENTS.items():
+            methods[name] = lambda assign=assign: assign(
+                *association.gatePairs(iou_matrix))
+
+        result[str(objects)] = {}
+        for name, method in methods.items():
+            start = time.perf_counter()
+            for _ in range(runs):
+                iou_indexes = method()
+            elapsed = (time.perf_counter() - start) * 1000 / runs
+            result[str(objects)][name] = {
+                'ms': elapsed,
+                'matches': len(iou_indexes),
+                'iou_sum': float(sum(value for _, value in iou_indexes)),
+            }
+            print('association %4d objects %-10s : %9.3f ms, '
+                  '%4d matches, IOU sum %.3f' % (
+                      objects, name, elapsed, len(iou_indexes),
+                      result[str(objects)][name]['iou_sum']))
+    return result
+
+
+# 기준 결과와 비교할 지표, True면 클수록 좋은 지표
+METRICS = {
+    'fps': True,
+    'recall': True,
+    'ms_per_frame': False,
+    'peak_rss_mb': False,
+}
+
+
+def compareBaseline(results, baseline, tolerance=0.1, min_ms=1.0):
+    '''
+    벤치마크 결과를 기준 결과와 비교하여 변화량을 출력하고
+    tolerance 비율 이상 나빠진 항목 리스트 반환
+    단계별 p50이 min_ms보다 짧은 단계는 측정 오차가 커서 비교하지 않음
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        checks = [(key, expected.get(key), result.get(key), higher)
+                  for key, higher in METRICS.items()]
+        for stage_name, summary in sorted(result.get('stages', {}).items()):
+            previous = expected.get('stages', {}).get(stage_name)
+            if previous is not None and previous['p50'] >= min_ms:
+                checks.append(('stage ' + stage_name + ' p50',
+                               previous['p50'], summary['p50'], False))
+
+        for key, before, after, higher in checks:
+            if before is None or after is None or before == 0:
+                continue
+            change = (after - before) / abs(before)
+            worse = -change if higher else change
+            regressed = worse > tolerance
+            print('%-12s %-28s %10.3f -> %10.3f  %+6.1f%%%s' % (
+                name, key, before, after, change * 100,
+                '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((name, key, before, after))
+    return regressions
+
+
+BENCHMARKS = {
+    'preprocess': benchPreprocess,
+    'pipeline': benchPipeline,
+    'association': benchAssociation,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks to run: ' + ', '.join(BENCHMARKS) +
+                        ' (default: all)')
+    parser.add_argument('--baseline',
+                        help='compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative slowdown (default: 0.1)')
+    parser.add_argument('--save', help='write results to a JSON file')
+    parser.add_argument('--threads', type=int,
+                        help='OpenCV threads (default: OpenCV)')
+    args = parser.parse_args()
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark `' + name + '`')
+        results[name] = BENCHMARKS[name]()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareBaseline(results, baseline, args.tolerance)
+        if regressions:
+            print('%d regressions against %s' % (len(regressions),
+                                                 args.baseline))
+            sys.exit(1)
@@ -0,0 +1,328 @@
+"""
+검출 결과를 디스크에 저장하여 같은 프레임을 다시 볼 때 추론을 생략한다.
+키는 (비디오 내용 해시, 프레임 번호, 모델 cfg/weights 해시, 임계값 하한)이며
+디스크에는 압축된 바이너리 형식으로 저장하고 메모리에는 LRU로 유지한다.
+
+파일 형식 :
+    헤더 b'DDC2'
+    레코드 반복 : <frame uint32><count uint32> + count * 6 float32
+                  (class_id, score, cx, cy, w, h)
+    같은 프레임이 다시 기록되면 마지막 레코드를 사용
+    형식이 다른 이전 캐시 파일(b'DDC1' 등)은 비우고 새로 기록
+
+CandidateStore는 처리한 프레임의 NMS 전 후보를 메모리의 연속 배열에 보관하여
+임계값, NMS, 클래스 필터가 바뀌어도 다시 추론하지 않고 결과를 다시 계산한다.
+"""
+
+
+import collections
+import hashlib
+import os
+import struct
+import threading
+
+import numpy as np
+
+from utils import nonMaxSuppression
+
+
+MAGIC = b'DDC2'
+RECORD_HEADER = struct.Struct('<II')
+ROW_BYTES = 6 * 4
+
+# (path, size, mtime) -> hash
+_hash_memo = {}
+
+
+def fileHash(path, sample_size=None):
+    '''
+    파일 내용의 sha1 해시 반환
+    sample_size가 주어지면 파일 크기와 앞, 가운데, 끝 sample_size 바이트만 사용
+    (긴 비디오 전체를 읽지 않기 위함)
+    '''
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime,
+                sample_size)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+
+    sha = hashlib.sha1()
+    sha.update(str(stat.st_size).encode())
+    with open(path, 'rb') as f:
+        if sample_size is None or stat.st_size <= sample_size * 3:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        else:
+            for offset in (0, (stat.st_size - sample_size) // 2,
+                           stat.st_size - sample_size):
+                f.seek(offset)
+                sha.update(f.read(sample_size))
+    _hash_memo[memo_key] = sha.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def videoHash(video_path):
+    '''
+    비디오 내용 해시 (크기와 일부 구간만 사용)
+    '''
+    return fileHash(video_path, sample_size=1 << 20)
+
+
+def modelHash(configPath, weightPath, backend_name='', settings=''):
+    '''
+    cfg, weights 파일과 백엔드 이름으로 모델 해시 계산
+    파일이 없으면(stub 백엔드 등) 경로 대신 이름만 사용
+    settings : 결과에 영향을 주는 검출 설정(관심 영역 등)의 문자열 표현
+    '''
+    sha = hashlib.sha1((backend_name + settings).encode())
+    for path in (configPath, weightPath):
+        if path is not None and os.path.exists(path):
+            sha.update(fileHash(path).encode())
+    return sha.hexdigest()
+
+
+def readMagic(path):
+    '''
+    캐시 파일의 헤더 반환, 파일이 없으면 None
+    '''
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC))
+    except OSError:
+        return None
+
+
+class DetectionCache:
+    """
+    프레임별 검출 결과를 저장하는 디스크 캐시와 메모리 LRU
+    """
+    def __init__(self, cache_dir, video_hash, model_hash, thresh_floor,
+                 capacity=1024):
+        '''
+        캐시 디렉토리, 비디오 해시, 모델 해시, 임계값 하한, LRU 크기를 입력받아
+        캐시 파일을 열고 기존 레코드의 위치를 읽음
+        thresh_floor : 저장된 결과를 검출할 때 사용한 임계값
+                       이 값 이상의 임계값 조회에만 사용할 수 있음
+        '''
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.thresh_floor = thresh_floor
+        self.capacity = capacity
+        self.path = os.path.join(cache_dir, '%s_%s_%04d.ddc' % (
+            video_hash[:16], model_hash[:16],
+            int(round(thresh_floor * 1000))))
+
+        self.lru = collections.OrderedDict()
+        self.index = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if readMagic(self.path) != MAGIC:
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC)
+        self.scanIndex()
+        self.writer = open(self.path, 'ab')
+        self.reader = open(self.path, 'rb')
+
+    def scanIndex(self):
+        '''
+        캐시 파일의 레코드를 훑어 프레임별 위치를 읽음
+        마지막 레코드가 잘려 있으면 그 앞까지만 사용
+        '''
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Invalid detection cache `" + self.path + "`")
+            offset = len(MAGIC)
+            valid = offset
+            size = os.path.getsize(self.path)
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                frame, count = RECORD_HEADER.unpack(
+                    f.read(RECORD_HEADER.size))
+                end = offset + RECORD_HEADER.size + count * ROW_BYTES
+                if end > size:
+                    break
+                self.index[frame] = offset
+                offset = valid = end
+        if valid < size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+
+    def remember(self, frame, detections):
+        '''
+        메모리 LRU에 결과 저장
+        '''
+        self.lru[frame] = detections
+        self.lru.move_to_end(frame)
+        while len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+
+    def get(self, frame, thresh=None):
+        '''
+        저장된 (class_id, score, cx, cy, w, h) 배열 반환, 없으면 None
+        thresh가 주어지면 신뢰도가 thresh 이상인 결과만 반환
+        '''
+        if thresh is not None and thresh < self.thresh_floor:
+            return None
+        with self.lock:
+            detections = self.lru.get(frame)
+            if detections is None and frame in self.index:
+                self.reader.seek(self.index[frame])
+                _, count = RECORD_HEADER.unpack(
+                    self.reader.read(RECORD_HEADER.size))
+                detections = np.frombuffer(
+                    self.reader.read(count * ROW_BYTES),
+                    dtype='<f4').reshape(count, 6).astype(np.float32)
+            if detections is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(frame, detections)
+        if thresh is not None:
+            detections = detections[detections[:, 1] >= thresh]
+        return detections.copy()
+
+    def put(self, frame, detections):
+        '''
+        프레임의 검출 결과를 디스크와 메모리에 저장
+        '''
+        detections = np.ascontiguousarray(detections, dtype='<f4')
+        with self.lock:
+            self.writer.seek(0, os.SEEK_END)
+            offset = self.writer.tell()
+            self.writer.write(RECORD_HEADER.pack(frame, len(detections)))
+            self.writer.write(detections.tobytes())
+            self.writer.flush()
+            self.index[frame] = offset
+            self.remember(frame, detections.astype(np.float32))
+
+    def __contains__(self, frame):
+        return frame in self.index
+
+    def close(self):
+        '''
+        캐시 파일을 닫음
+        '''
+        with self.lock:
+            self.writer.close()
+            self.reader.close()
+
+
+class CandidateStore:
+    """
+    프레임별 NMS 전 검출 후보를 하나의 연속 배열에 보관하는 클래스
+    """
+    def __init__(self, floor=0.05, capacity=1 << 14):
+        '''
+        floor : 후보를 검출할 때 사용한 신뢰도 임계값 (이보다 낮은 임계값은 적용 불가)
+        capacity : 처음 할당할 행 수 (부족하면 두 배씩 늘림)
+        '''
+        self.floor = floor
+        self.rows = np.zeros((capacity, 6), dtype=np.float32)
+        self.size = 0
+        # 다시 저장되어 더 이상 사용하지 않는 행 수
+        self.unused = 0
+        # frame -> (시작 행, 행 수)
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def put(self, frame, candidates):
+        '''
+        프레임의 (class_id, score, cx, cy, w, h) 후보 배열 저장
+        같은 프레임을 다시 저장하면 새 후보를 사용
+        새 후보가 기존 자리에 들어가면 덮어쓰고, 아니면 뒤에 추가한 뒤
+        사용하지 않는 행이 절반을 넘으면 배열을 압축
+        '''
+        candidates = np.asarray(candidates, dtype=np.float32).reshape(-1, 6)
+        count = len(candidates)
+        with self.lock:
+            previous = self.index.get(frame)
+            if previous is not None:
+                start, previous_count = previous
+                if count <= previous_count:
+                    self.rows[start:start + count] = candidates
+                    self.index[frame] = (start, count)
+                    self.unused += previous_count - count
+                    return
+                del self.index[frame]
+                self.unused += previous_count
+                if self.unused * 2 > self.size:
+                    self.compact()
+
+            if self.size + count > len(self.rows):
+                capacity = len(self.rows)
+                while self.size + count > capacity:
+                    capacity *= 2
+                rows = np.zeros((capacity, 6), dtype=np.float32)
+                rows[:self.size] = self.rows[:self.size]
+                self.rows = rows
+            self.rows[self.size:self.size + count] = candidates
+            self.index[frame] = (self.size, count)
+            self.size += count
+
+    def compact(self):
+        '''
+        사용하지 않는 행을 제거하여 프레임별 후보를 앞으로 모음
+        lock을 잡은 상태에서 호출
+        '''
+        rows = np.zeros_like(self.rows)
+        size = 0
+        for frame, (start, count) in self.index.items():
+            rows[size:size + count] = self.rows[start:start + count]
+            self.index[frame] = (size, count)
+            size += count
+        self.rows = rows
+        self.size = size
+        self.unused = 0
+
+    def get(self, frame):
+        '''
+        저장된 후보 배열 반환, 없으면 None
+        '''
+        with self.lock:
+            if frame not in self.index:
+                return None
+            start, count = self.index[frame]
+            return self.rows[start:start + count].copy()
+
+    def __contains__(self, frame):
+        return frame in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def filter(self, frame, thresh, nms=0.45, classes=None):
+        '''
+        프레임의 후보에 임계값, 클래스 필터, NMS를 적용한 배열 반환, 없으면 None
+        classes : 남길 class_id 목록, None이면 모든 클래스
+        '''
+        candidates = self.get(frame)
+        if candidates is None:
+            return None
+        keep = candidates[:, 1] >= thresh
+        if classes is not None:
+            keep &= np.isin(candidates[:, 0], classes)
+        candidates = candidates[keep]
+        if nms:
+            candidates = nonMaxSuppression(candidates, nms)
+        return candidates
+
+    def filterAll(self, thresh, nms=0.45, classes=None):
+        '''
+        저장된 모든 프레임에 filter()를 적용한 {frame: 배열} 반환
+        '''
+        with self.lock:
+            frames = list(self.index)
+        return {frame: self.filter(frame, thresh, nms, classes)
+                for frame in frames}
+
+    def clear(self):
+        '''
+        저장된 후보를 모두 제거
+        '''
+        with self.lock:
+            self.size = 0
+            self.unused = 0
+            self.index = {}
@@ -31,6 +31,9 @@ from ctypes import *
 import math
 import random
 import os
+import threading
+
+import numpy as np
 
 def sample(probs):
     s = sum(probs)
@@ -64,6 +67,11 @@ class DETECTION(Structure):
                 ("points", c_int)]
 
 
+class DETNUMPAIR(Structure):
+    _fields_ = [("num", c_int),
+                ("dets", POINTER(DETECTION))]
+
+
 class IMAGE(Structure):
     _fields_ = [("w", c_int),
                 ("h", c_int),
@@ -74,141 +82,196 @@ class METADATA(Structure):
     _fields_ = [("classes", c_int),
                 ("names", POINTER(c_char_p))]
 
-
-
 #lib = CDLL("/home/pjreddie/documents/darknet/libdarknet.so", RTLD_GLOBAL)
 #lib = CDLL("libdarknet.so", RTLD_GLOBAL)
+# The shared library is loaded on first use (see load_library()), so that
+# importing this module stays cheap for code paths that never run inference.
+lib = None
 hasGPU = True
-if os.name == "nt":
-    cwd = os.path.dirname(__file__)
-    os.environ['PATH'] = cwd + ';' + os.environ['PATH']
-    winGPUdll = os.path.join(cwd, "yolo_cpp_dll.dll")
-    winNoGPUdll = os.path.join(cwd, "yolo_cpp_dll_nogpu.dll")
-    envKeys = list()
-    for k, v in os.environ.items():
-        envKeys.append(k)
-    try:
+_lib_lock = threading.Lock()
+
+def _open_library():
+    global hasGPU
+    if os.name == "nt":
+        cwd = os.path.dirname(__file__)
+        os.environ['PATH'] = cwd + ';' + os.environ['PATH']
+        winGPUdll = os.path.join(cwd, "yolo_cpp_dll.dll")
+        winNoGPUdll = os.path.join(cwd, "yolo_cpp_dll_nogpu.dll")
+        envKeys = list()
+        for k, v in os.environ.items():
+            envKeys.append(k)
         try:
-            tmp = os.environ["FORCE_CPU"].lower()
-            if tmp in ["1", "true", "yes", "on"]:
-                raise ValueError("ForceCPU")
-            else:
-                print("Flag value '"+tmp+"' not forcing CPU mode")
-        except KeyError:
-            # We never set the flag
-            if 'CUDA_VISIBLE_DEVICES' in envKeys:
-                if int(os.environ['CUDA_VISIBLE_DEVICES']) < 0:
-                    raise ValueError("ForceCPU")
             try:
-                global DARKNET_FORCE_CPU
-                if DARKNET_FORCE_CPU:
+                tmp = os.environ["FORCE_CPU"].lower()
+                if tmp in ["1", "true", "yes", "on"]:
                     raise ValueError("ForceCPU")
-            except NameError:
-                pass
-            # print(os.environ.keys())
-            # print("FORCE_CPU flag undefined, proceeding with GPU")
-        if not os.path.exists(winGPUdll):
-            raise ValueError("NoDLL")
-        lib = CDLL(winGPUdll, RTLD_GLOBAL)
-    except (KeyError, ValueError):
-        hasGPU = False
-        if os.path.exists(winNoGPUdll):
-            lib = CDLL(winNoGPUdll, RTLD_GLOBAL)
-            print("Notice: CPU-only mode")
-        else:
-            # Try the other way, in case no_gpu was
-            # compile but not renamed
-            lib = CDLL(winGPUdll, RTLD_GLOBAL)
-            print("Environment variables indicated a CPU run, but we didn't find `"+winNoGPUdll+"`. Trying a GPU run anyway.")
-else:
-    lib = CDLL("./libdarknet.so", RTLD_GLOBAL)
-lib.network_width.argtypes = [c_void_p]
-lib.network_width.restype = c_int
-lib.network_height.argtypes = [c_void_p]
-lib.network_height.restype = c_int
-
-copy_image_from_bytes = lib.copy_image_from_bytes
-copy_image_from_bytes.argtypes = [IMAGE,c_char_p]
+                else:
+                    print("Flag value '"+tmp+"' not forcing CPU mode")
+            except KeyError:
+                # We never set the flag
+                if 'CUDA_VISIBLE_DEVICES' in envKeys:
+                    if int(os.environ['CUDA_VISIBLE_DEVICES']) < 0:
+                        raise ValueError("ForceCPU")
+                if globals().get("DARKNET_FORCE_CPU"):
+                    raise ValueError("ForceCPU")
+                # print(os.environ.keys())
+                # print("FORCE_CPU flag undefined, proceeding with GPU")
+            if not os.path.exists(winGPUdll):
+                raise ValueError("NoDLL")
+            return CDLL(winGPUdll, RTLD_GLOBAL)
+        except (KeyError, ValueError):
+            hasGPU = False
+            if os.path.exists(winNoGPUdll):
+                print("Notice: CPU-only mode")
+                return CDLL(winNoGPUdll, RTLD_GLOBAL)
+            else:
+                # Try the other way, in case no_gpu was
+                # compile but not renamed
+                print("Environment variables indicated a CPU run, but we didn't find `"+winNoGPUdll+"`. Trying a GPU run anyway.")
+                return CDLL(winGPUdll, RTLD_GLOBAL)
+    else:
+        return CDLL("./libdarknet.so", RTLD_GLOBAL)
 
-def network_width(net):
-    return lib.network_width(net)
+def _bind(lib):
+    b = {}
+    lib.network_width.argtypes = [c_void_p]
+    lib.network_width.restype = c_int
+    lib.network_height.argtypes = [c_void_p]
+    lib.network_height.restype = c_int
 
-def network_height(net):
-    return lib.network_height(net)
+    b["copy_image_from_bytes"] = lib.copy_image_from_bytes
+    b["copy_image_from_bytes"].argtypes = [IMAGE,c_char_p]
+
+    b["predict"] = lib.network_predict_ptr
+    b["predict"].argtypes = [c_void_p, POINTER(c_float)]
+    b["predict"].restype = POINTER(c_float)
+
+    if hasGPU:
+        b["set_gpu"] = lib.cuda_set_device
+        b["set_gpu"].argtypes = [c_int]
+
+    b["init_cpu"] = lib.init_cpu
 
-predict = lib.network_predict_ptr
-predict.argtypes = [c_void_p, POINTER(c_float)]
-predict.restype = POINTER(c_float)
+    b["make_image"] = lib.make_image
+    b["make_image"].argtypes = [c_int, c_int, c_int]
+    b["make_image"].restype = IMAGE
 
-if hasGPU:
-    set_gpu = lib.cuda_set_device
-    set_gpu.argtypes = [c_int]
+    b["get_network_boxes"] = lib.get_network_boxes
+    b["get_network_boxes"].argtypes = [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int, POINTER(c_int), c_int]
+    b["get_network_boxes"].restype = POINTER(DETECTION)
 
-init_cpu = lib.init_cpu
+    b["make_network_boxes"] = lib.make_network_boxes
+    b["make_network_boxes"].argtypes = [c_void_p]
+    b["make_network_boxes"].restype = POINTER(DETECTION)
 
-make_image = lib.make_image
-make_image.argtypes = [c_int, c_int, c_int]
-make_image.restype = IMAGE
+    b["free_detections"] = lib.free_detections
+    b["free_detections"].argtypes = [POINTER(DETECTION), c_int]
 
-get_network_boxes = lib.get_network_boxes
-get_network_boxes.argtypes = [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int, POINTER(c_int), c_int]
-get_network_boxes.restype = POINTER(DETECTION)
+    b["free_batch_detections"] = lib.free_batch_detections
+    b["free_batch_detections"].argtypes = [POINTER(DETNUMPAIR), c_int]
 
-make_network_boxes = lib.make_network_boxes
-make_network_boxes.argtypes = [c_void_p]
-make_network_boxes.restype = POINTER(DETECTION)
+    b["free_ptrs"] = lib.free_ptrs
+    b["free_ptrs"].argtypes = [POINTER(c_void_p), c_int]
 
-free_detections = lib.free_detections
-free_detections.argtypes = [POINTER(DETECTION), c_int]
+    b["network_predict"] = lib.network_predict_ptr
+    b["network_predict"].argtypes = [c_void_p, POINTER(c_float)]
 
-free_ptrs = lib.free_ptrs
-free_ptrs.argtypes = [POINTER(c_void_p), c_int]
+    b["reset_rnn"] = lib.reset_rnn
+    b["reset_rnn"].argtypes = [c_void_p]
 
-network_predict = lib.network_predict_ptr
-network_predict.argtypes = [c_void_p, POINTER(c_float)]
+    # not exported by older builds, None when missing
+    b["free_network_ptr"] = getattr(lib, "free_network_ptr", None)
+    if b["free_network_ptr"] is not None:
+        b["free_network_ptr"].argtypes = [c_void_p]
 
-reset_rnn = lib.reset_rnn
-reset_rnn.argtypes = [c_void_p]
+    b["load_net"] = lib.load_network
+    b["load_net"].argtypes = [c_char_p, c_char_p, c_int]
+    b["load_net"].restype = c_void_p
 
-load_net = lib.load_network
-load_net.argtypes = [c_char_p, c_char_p, c_int]
-load_net.restype = c_void_p
+    b["load_net_custom"] = lib.load_network_custom
+    b["load_net_custom"].argtypes = [c_char_p, c_char_p, c_int, c_int]
+    b["load_net_custom"].restype = c_void_p
 
-load_net_custom = lib.load_network_custom
-load_net_custom.argtypes = [c_char_p, c_char_p, c_int, c_int]
-load_net_custom.restype = c_void_p
+    b["do_nms_obj"] = lib.do_nms_obj
+    b["do_nms_obj"].argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
 
-do_nms_obj = lib.do_nms_obj
-do_nms_obj.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+    b["do_nms_sort"] = lib.do_nms_sort
+    b["do_nms_sort"].argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
 
-do_nms_sort = lib.do_nms_sort
-do_nms_sort.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+    b["free_image"] = lib.free_image
+    b["free_image"].argtypes = [IMAGE]
 
-free_image = lib.free_image
-free_image.argtypes = [IMAGE]
+    b["letterbox_image"] = lib.letterbox_image
+    b["letterbox_image"].argtypes = [IMAGE, c_int, c_int]
+    b["letterbox_image"].restype = IMAGE
 
-letterbox_image = lib.letterbox_image
-letterbox_image.argtypes = [IMAGE, c_int, c_int]
-letterbox_image.restype = IMAGE
+    b["load_meta"] = lib.get_metadata
+    lib.get_metadata.argtypes = [c_char_p]
+    lib.get_metadata.restype = METADATA
 
-load_meta = lib.get_metadata
-lib.get_metadata.argtypes = [c_char_p]
-lib.get_metadata.restype = METADATA
+    b["load_image"] = lib.load_image_color
+    b["load_image"].argtypes = [c_char_p, c_int, c_int]
+    b["load_image"].restype = IMAGE
 
-load_image = lib.load_image_color
-load_image.argtypes = [c_char_p, c_int, c_int]
-load_image.restype = IMAGE
+    b["rgbgr_image"] = lib.rgbgr_image
+    b["rgbgr_image"].argtypes = [IMAGE]
 
-rgbgr_image = lib.rgbgr_image
-rgbgr_image.argtypes = [IMAGE]
+    b["predict_image"] = lib.network_predict_image
+    b["predict_image"].argtypes = [c_void_p, IMAGE]
+    b["predict_image"].restype = POINTER(c_float)
 
-predict_image = lib.network_predict_image
-predict_image.argtypes = [c_void_p, IMAGE]
-predict_image.restype = POINTER(c_float)
+    b["predict_image_letterbox"] = lib.network_predict_image_letterbox
+    b["predict_image_letterbox"].argtypes = [c_void_p, IMAGE]
+    b["predict_image_letterbox"].restype = POINTER(c_float)
+
+    b["network_predict_batch"] = lib.network_predict_batch
+    b["network_predict_batch"].argtypes = [c_void_p, IMAGE, c_int, c_int, c_int,
+                                           c_float, c_float, POINTER(c_int), c_int, c_int]
+    b["network_predict_batch"].restype = POINTER(DETNUMPAIR)
+    return b
+
+_BINDINGS = ("copy_image_from_bytes", "predict", "set_gpu", "init_cpu",
+             "make_image", "get_network_boxes", "make_network_boxes",
+             "free_detections", "free_batch_detections", "free_ptrs",
+             "free_network_ptr", "network_predict", "reset_rnn", "load_net",
+             "load_net_custom", "do_nms_obj", "do_nms_sort", "free_image",
+             "letterbox_image", "load_meta", "load_image", "rgbgr_image",
+             "predict_image", "predict_image_letterbox",
+             "network_predict_batch")
+
+def load_library():
+    """
+    Loads the darknet shared library and binds its symbols on first call
+
+    Safe to call from several threads, e.g. to warm the library up in the
+    background. Returns the CDLL handle
+    """
+    global lib
+    if lib is not None:
+        return lib
+    with _lib_lock:
+        if lib is None:
+            _lib = _open_library()
+            globals().update(_bind(_lib))
+            lib = _lib
+    return lib
+
+def __getattr__(name):
+    # Module level bindings like darknet.predict_image load the library lazily
+    if name in _BINDINGS:
+        load_library()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError("module 'darknet' has no attribute '" + name + "'")
+
+def network_width(net):
+    load_library()
+    return lib.network_width(net)
+
+def network_height(net):
+    load_library()
+    return lib.network_height(net)
 
-predict_image_letterbox = lib.network_predict_image_letterbox
-predict_image_letterbox.argtypes = [c_void_p, IMAGE]
-predict_image_letterbox.restype = POINTER(c_float)
 
 def array_to_image(arr):
     import numpy as np
@@ -223,6 +286,7 @@ def array_to_image(arr):
     return im, arr
 
 def classify(net, meta, im):
+    load_library()
     out = predict_image(net, im)
     res = []
     for i in range(meta.classes):
@@ -238,6 +302,7 @@ def detect(net, meta, image, thresh=.5, hier_thresh=.5, nms=.45, debug= False):
     """
     Performs the meat of the detection
     """
+    load_library()
     #pylint: disable= C0321
     im = load_image(image, 0, 0)
     if debug: print("Loaded image")
@@ -247,6 +312,22 @@ def detect(net, meta, image, thresh=.5, hier_thresh=.5, nms=.45, debug= False):
     return ret
 
 def detect_image(net, meta, im, thresh=.5, hier_thresh=.5, nms=.45, debug= False):
+    """
+    Runs the network on `im` and returns a detection list like
+    [('obj_label', confidence, (x, y, w, h)), ...] sorted by confidence
+
+    This is a thin adapter over detect_image_array()
+    """
+    arr = detect_image_array(net, meta, im, thresh, hier_thresh, nms, debug)
+    res = array_to_detections(arr, meta)
+    if debug: print("did convert")
+    return res
+
+def detect_image_array(net, meta, im, thresh=.5, hier_thresh=.5, nms=.45, debug= False):
+    """
+    Runs the network on `im` and returns the detections as a float32 array
+    of (class_id, score, cx, cy, w, h) rows sorted by score
+    """
     #import cv2
     #custom_image_bgr = cv2.imread(image) # use: detect(,,imagePath,)
     #custom_image = cv2.cvtColor(custom_image_bgr, cv2.COLOR_BGR2RGB)
@@ -254,49 +335,154 @@ def detect_image(net, meta, im, thresh=.5, hier_thresh=.5, nms=.45, debug= False
     #import scipy.misc
     #custom_image = scipy.misc.imread(image)
     #im, arr = array_to_image(custom_image)		# you should comment line below: free_image(im)
-    num = c_int(0)
-    if debug: print("Assigned num")
-    pnum = pointer(num)
-    if debug: print("Assigned pnum")
+    load_library()
     predict_image(net, im)
     letter_box = 0
     #predict_image_letterbox(net, im)
     #letter_box = 1
     if debug: print("did prediction")
-    #dets = get_network_boxes(net, custom_image_bgr.shape[1], custom_image_bgr.shape[0], thresh, hier_thresh, None, 0, pnum, letter_box) # OpenCV
-    dets = get_network_boxes(net, im.w, im.h, thresh, hier_thresh, None, 0, pnum, letter_box)
-    if debug: print("Got dets")
+    #res = network_boxes_array(net, meta, custom_image_bgr.shape[1], custom_image_bgr.shape[0], thresh, hier_thresh, nms, letter_box) # OpenCV
+    res = network_boxes_array(net, meta, im.w, im.h, thresh, hier_thresh, nms, letter_box)
+    if debug: print("did decode "+str(len(res)))
+    return res
+
+def network_boxes_array(net, meta, w, h, thresh=.5, hier_thresh=.5, nms=.45, letter_box=0):
+    """
+    Reads the boxes of the last prediction with get_network_boxes and
+    returns them as in decode_detections()
+    """
+    load_library()
+    num = c_int(0)
+    pnum = pointer(num)
+    dets = get_network_boxes(net, w, h, thresh, hier_thresh, None, 0, pnum, letter_box)
     num = pnum[0]
-    if debug: print("got zeroth index of pnum")
+    res = decode_detections(dets, num, meta, nms)
+    free_detections(dets, num)
+    return res
+
+def detection_dtype():
+    """
+    NumPy record layout of the DETECTION fields read by decode_detections()
+    """
+    return np.dtype({"names": ["bbox", "prob", "objectness"],
+                     "formats": [(np.float32, (4,)), np.uintp, np.float32],
+                     "offsets": [DETECTION.bbox.offset, DETECTION.prob.offset,
+                                 DETECTION.objectness.offset],
+                     "itemsize": sizeof(DETECTION)})
+
+def detection_records(dets, num, classes):
+    """
+    Views a detection array as detection_dtype() records and gathers the
+    per detection prob arrays into one (num, classes) float32 matrix
+    """
+    buf = (c_char * (num * sizeof(DETECTION))).from_address(addressof(dets.contents))
+    records = np.frombuffer(buf, dtype=detection_dtype())
+    # prob arrays are allocated per detection, gather them into one matrix
+    probs = np.empty((num, classes), dtype=np.float32)
+    row_bytes = classes * sizeof(c_float)
+    dst = probs.ctypes.data
+    for j, src in enumerate(records["prob"].tolist()):
+        memmove(dst + j * row_bytes, src, row_bytes)
+    return records, probs
+
+def decode_detections(dets, num, meta, nms=.45):
+    """
+    Applies NMS to a detection array and decodes every (box, class) hit
+    with a positive probability in one vectorized pass
+
+    Returns a float32 array of (class_id, score, cx, cy, w, h) rows sorted
+    by score, highest first
+    """
+    if num == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    load_library()
     if nms:
         do_nms_sort(dets, num, meta.classes, nms)
-    if debug: print("did sort")
-    res = []
-    if debug: print("about to range")
-    for j in range(num):
-        if debug: print("Ranging on "+str(j)+" of "+str(num))
-        if debug: print("Classes: "+str(meta), meta.classes, meta.names)
-        for i in range(meta.classes):
-            if debug: print("Class-ranging on "+str(i)+" of "+str(meta.classes)+"= "+str(dets[j].prob[i]))
-            if dets[j].prob[i] > 0:
-                b = dets[j].bbox
-                if altNames is None:
-                    nameTag = meta.names[i]
-                else:
-                    nameTag = altNames[i]
-                if debug:
-                    print("Got bbox", b)
-                    print(nameTag)
-                    print(dets[j].prob[i])
-                    print((b.x, b.y, b.w, b.h))
-                res.append((nameTag, dets[j].prob[i], (b.x, b.y, b.w, b.h)))
-    if debug: print("did range")
-    res = sorted(res, key=lambda x: -x[1])
-    if debug: print("did sort")
+    records, probs = detection_records(dets, num, meta.classes)
+    rows, cols = np.nonzero(probs > 0)
+    scores = probs[rows, cols]
+    order = np.argsort(-scores, kind="stable")
+    res = np.empty((len(order), 6), dtype=np.float32)
+    res[:, 0] = cols[order]
+    res[:, 1] = scores[order]
+    res[:, 2:] = records["bbox"][rows[order]]
+    return res
+
+def decode_raw(dets, num, meta):
+    """
+    Decodes a detection array without NMS into a float32 array of
+    (cx, cy, w, h, objectness, prob_0, ..., prob_n) rows, one per box
+    """
+    if num == 0:
+        return np.zeros((0, 5 + meta.classes), dtype=np.float32)
+    load_library()
+    records, probs = detection_records(dets, num, meta.classes)
+    res = np.empty((num, 5 + meta.classes), dtype=np.float32)
+    res[:, :4] = records["bbox"]
+    res[:, 4] = records["objectness"]
+    res[:, 5:] = probs
+    return res
+
+def detect_image_raw(net, meta, im, thresh=.005, hier_thresh=.5):
+    """
+    Runs the network on `im` and returns the boxes from get_network_boxes
+    before NMS as in decode_raw()
+    """
+    load_library()
+    num = c_int(0)
+    pnum = pointer(num)
+    predict_image(net, im)
+    dets = get_network_boxes(net, im.w, im.h, thresh, hier_thresh, None, 0, pnum, 0)
+    num = pnum[0]
+    res = decode_raw(dets, num, meta)
     free_detections(dets, num)
-    if debug: print("freed detections")
     return res
 
+def detect_batch_raw(net, meta, im, batch_size, thresh=.005, hier_thresh=.5):
+    """
+    Batched detect_image_raw(), `im` is laid out as in detect_batch()
+    """
+    load_library()
+    batch_dets = network_predict_batch(net, im, batch_size, im.w, im.h,
+                                       thresh, hier_thresh, None, 0, 0)
+    res = []
+    for b in range(batch_size):
+        res.append(decode_raw(batch_dets[b].dets, batch_dets[b].num, meta))
+    free_batch_detections(batch_dets, batch_size)
+    return res
+
+def array_to_detections(arr, meta):
+    """
+    Converts a (class_id, score, cx, cy, w, h) array to the
+    [('obj_label', confidence, (x, y, w, h)), ...] tuple list
+    """
+    res = []
+    for row in arr.tolist():
+        i = int(row[0])
+        if altNames is None:
+            nameTag = meta.names[i]
+        else:
+            nameTag = altNames[i]
+        res.append((nameTag, row[1], (row[2], row[3], row[4], row[5])))
+    return res
+
+def detect_batch(net, meta, im, batch_size, thresh=.5, hier_thresh=.5, nms=.45):
+    """
+    Runs one forward pass over `batch_size` images packed into `im`
+
+    `im.data` must hold batch_size planar (c, h, w) float images of the
+    network input size laid out back to back. Returns one
+    (class_id, score, cx, cy, w, h) array per image as in detect_image_array()
+    """
+    load_library()
+    batch_dets = network_predict_batch(net, im, batch_size, im.w, im.h,
+                                       thresh, hier_thresh, None, 0, 0)
+    res = []
+    for b in range(batch_size):
+        res.append(decode_detections(batch_dets[b].dets, batch_dets[b].num,
+                                     meta, nms))
+    free_batch_detections(batch_dets, batch_size)
+    return res
 
 netMain = None
 metaMain = None
@@ -358,6 +544,7 @@ def performDetect(imagePath="data/dog.jpg", thresh= 0.25, configPath = "./cfg/yo
         raise ValueError("Invalid weight path `"+os.path.abspath(weightPath)+"`")
     if not os.path.exists(metaPath):
         raise ValueError("Invalid data file path `"+os.path.abspath(metaPath)+"`")
+    load_library()
     if netMain is None:
         netMain = load_net_custom(configPath.encode("ascii"), weightPath.encode("ascii"), 0, 1)  # batch size = 1
     if metaMain is None:
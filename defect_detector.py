@@ -1,3 +1,7 @@
+import time
+# 실행 시점부터 첫 프레임 표시까지의 시간 측정 기준
+STARTUP_TIME = time.perf_counter()
+
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtWidgets import *
@@ -11,11 +15,16 @@ import webbrowser
 
 '''
 Darknet compilation required
+detector, tracker는 창 표시 이후 load_video에서 불러옴
 '''
 import background as bg
-import detector
-import tracker
+import cache
+import frames
+import gating
+import pipeline
+import profiler
 import utils
+from profiler import stage
 
 class VideoMethod:
     def __init__(self, ui):
@@ -23,19 +32,47 @@ class VideoMethod:
         self._state = 0
         self.th = 0.1
         self.tracked_id = []
-
-    def load_video(self, file_name, cfg_path, weight_path, data_path):
+        self.load_time = None
+        self.first_frame_shown = False
+        # 검출 간격 (1이면 모든 프레임 검출, N이면 N 프레임마다 검출하고
+        # 그 사이 프레임은 추적기 예측으로 대체)
+        self.keyframe_interval = 1
+        self.keyframe_min_confidence = None
+        # 검출 후보를 저장할 임계값 하한 (th, nms, classes는 저장된 후보에 적용)
+        self.detect_thresh = 0.05
+        self.nms = 0.45
+        # 표시할 class_id 목록, None이면 모든 클래스
+        self.classes = None
+        self.cache = None
+        # 장면이 바뀌지 않으면(정지 중) 이전 검출 결과 재사용
+        self.motion_gating = True
+        # 프레임 번호 -> GPS 속도(km/h) 함수, GPS 정보가 없으면 None
+        self.speed_source = None
+        self.detector = None
+        self.detector_args = None
+        # 단계별 소요 시간을 기록할 경로 (확장자 제외), None이면 기록 안함
+        self.metrics_path = None
+        # 재생 중에는 탐색(이전/다음 프레임, 슬라이더)이 상태를 바꾸지 않도록 함
+        self.play_lock = threading.Lock()
+
+    def load_video(self, file_name, cfg_path, weight_path, data_path,
+                   backend='darknet', cache_dir=None, roi=None):
         self.enable_pause = True
 
         if not file_name:
             ui.lineEdit.settext(self.file_name)
             return
 
-        self.cap = cv2.VideoCapture(file_name)
-        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.num_of_frame = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        # 디코딩된 프레임 캐시와 탐색 색인을 가진 프레임 접근 계층
+        if getattr(self, 'reader', None) is not None:
+            self.reader.release()
+        self.reader = frames.FrameReader(file_name)
+        self.width = self.reader.width
+        self.height = self.reader.height
+        self.fps = self.reader.fps
+        self.num_of_frame = self.reader.num_of_frame
+        # 다음에 읽을 프레임 번호 (= 마지막으로 읽은 프레임 수)
+        self.frame_count = 0
         print(self.num_of_frame)
         ui.lineEdit.setText(file_name)
 
@@ -44,10 +81,49 @@ class VideoMethod:
 
         '''
         Darknet compilation required
+        네트워크는 백그라운드에서 미리 불러오고 첫 검출 시점까지 완료를 기다림
         '''
-        self.detector = detector.Detector()
-        self.detector.initialize(cfg_path, weight_path, data_path)
+        import detector
+        import tracker
+        self.load_time = time.perf_counter()
+        self.first_frame_shown = False
+        # 같은 모델이면 이미 불러온 검출기를 재사용
+        load_args = (backend, cfg_path, weight_path, data_path)
+        if self.detector is None or self.detector_args != load_args:
+            previous = self.detector
+            self.detector = detector.Detector(backend)
+            self.detector.initialize(cfg_path, weight_path, data_path,
+                                     lazy=True)
+            self.detector.warmup()
+            self.detector_args = load_args
+            if previous is not None:
+                previous.release()
+        # 관심 영역(도로)만 잘라서 검출
+        self.detector.setROI(roi)
         self.tracker = tracker.Tracker()
+        self.scheduler = gating.KeyframeScheduler(
+            self.keyframe_interval, self.keyframe_min_confidence)
+        self.motion_gate = gating.MotionGate(
+            stopped_speed=5.0 if self.speed_source is not None else None)
+
+        # 처리한 프레임의 NMS 전 후보, 임계값이 바뀌면 추론 없이 다시 필터링
+        self.candidates = cache.CandidateStore(self.detect_thresh)
+
+        if cache_dir is not None:
+            self.metrics_path = os.path.join(os.path.dirname(cache_dir),
+                                             'metrics')
+
+        # 이미 검출한 프레임은 다시 추론하지 않도록 디스크 캐시 사용
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if cache_dir is not None:
+            self.cache = cache.DetectionCache(
+                cache_dir, cache.videoHash(file_name),
+                cache.modelHash(cfg_path, weight_path, backend,
+                                'raw' + (repr(roi.points.tolist()) if roi
+                                         else '')),
+                self.detect_thresh)
 
     def play_video(self):
         self.enable_pause = False
@@ -60,90 +136,281 @@ class VideoMethod:
         사용자가 선택한 비디오로 부터 하나의 프레임을 입력받아
         BGR -> RGB로 변환하여 반환
         '''
-        if self.cap.isOpened():
-            ret, frame = self.cap.read()
-            self.frame_count = int(
-                self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-            return (ret, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if self.reader.isOpened():
+            with stage('decode'):
+                frame = self.reader.read(self.frame_count)
+            if frame is None:
+                return (False, None)
+            self.frame_count += 1
+            with stage('color'):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            return (True, frame)
+        return (False, None)
     
     def prev_frame(self):
         self.enable_pause = True
-        if self._state == 1:
-            self.frame_count -=2
-        else:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frame_count-2)
-        self.play_once()
+        with self.play_lock:
+            self.frame_count = max(0, self.frame_count - 2)
+            self.reset_state()
+            self.play_once()
     
     def next_frame(self):
         self.enable_pause = True
-        self.play_once()
+        with self.play_lock:
+            self.play_once()
         
     def pressed_video(self):
         self.prev_status = self.enable_pause
         self.enable_pause = True
 
     def moved_slider(self):
-        if self._state == 1:
-            self.frame_count = ui.videoProgress.value()-1
-        else:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, ui.videoProgress.value()-1)
-        self.play_once()
+        with self.play_lock:
+            self.frame_count = max(0, ui.videoProgress.value()-1)
+            self.reset_state()
+            self.play_once()
         self.enable_pause = self.prev_status
 
+    def reset_state(self):
+        '''
+        탐색으로 재생 위치가 바뀌었을 때 프레임 순서에 의존하는 상태 초기화
+        (키프레임 스케줄러, 움직임 게이트, 추적기)
+        '''
+        self.scheduler.reset()
+        self.motion_gate.reset()
+        self.tracker = type(self.tracker)()
+
     def play_once(self):
-        if self.cap.get(cv2.CAP_PROP_POS_FRAMES) == self.num_of_frame:
+        if self.frame_count >= self.num_of_frame:
             return
         ret, frame = self.get_frame()
+        if not ret:
+            return
+        self.show_frame(self.render_frame(
+            self.track_frame(self.detect_frame((self.frame_count, frame)))))
+
+    def read_frames(self):
+        '''
+        현재 위치부터 비디오 끝까지 (프레임 번호, RGB 프레임)을 생성
+        파이프라인의 디코딩 단계
+        '''
+        index = self.frame_count
+        while self.reader.isOpened():
+            with stage('decode'):
+                frame = self.reader.read(index)
+            if frame is None:
+                break
+            index += 1
+            with stage('color'):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            yield (index, frame)
+
+    def detect_frame(self, item):
+        '''
+        검출 단계
+        키프레임이 아닌 프레임은 검출하지 않음 (keyframe = False)
+        (프레임 번호, 프레임) -> (프레임 번호, 프레임, 검출 결과, keyframe)
+        '''
+        frame_count, frame = item
+        detections = None
+        keyframe = True
+        if ui.dt_chk.isChecked():
+            keyframe = self.scheduler.isKeyframe()
+            if keyframe:
+                self.candidates.put(frame_count,
+                                    self.detect_gated(frame_count, frame))
+                detections = self.filter_candidates(frame_count)
+                self.scheduler.update(detections)
+        return (frame_count, frame, detections, keyframe)
+
+    def detect_gated(self, frame_count, frame):
+        '''
+        장면이 마지막 검출 이후 바뀌지 않았으면 이전 후보를, 아니면 검출한 후보 반환
+        '''
+        if not self.motion_gating:
+            return self.detect_cached(frame_count, frame)
+        speed = None
+        if self.speed_source is not None:
+            speed = self.speed_source(frame_count)
+        detections = self.motion_gate.check(frame, speed)
+        if detections is None:
+            detections = self.detect_cached(frame_count, frame)
+            self.motion_gate.update(detections)
+        return detections
+
+    def detect_cached(self, frame_count, frame):
+        '''
+        캐시에 저장된 프레임이면 저장된 후보를, 아니면 검출 후 저장하여 반환
+        후보는 detect_thresh 이상의 NMS 전 (class_id, score, cx, cy, w, h) 배열
+        '''
+        candidates = None
+        if self.cache is not None:
+            candidates = self.cache.get(frame_count)
+        if candidates is None:
+            candidates = self.detector.detectArrays(
+                [frame], self.detect_thresh, nms=0)[0]
+            if self.cache is not None:
+                self.cache.put(frame_count, candidates)
+        return candidates
+
+    def filter_candidates(self, frame_count):
+        '''
+        저장된 후보에 현재 임계값, NMS, 클래스 필터를 적용한 검출 결과 반환
+        '''
+        return self.detector.toDetections(self.candidates.filter(
+            frame_count, max(self.th, self.detect_thresh), self.nms,
+            self.classes))
+
+    def refilter(self):
+        '''
+        임계값 등이 바뀌었을 때 추론 없이 처리한 모든 프레임의 결과를 다시 계산하여
+        검출 수를 갱신하고, 일시 정지 중이면 현재 프레임을 다시 그림
+        '''
+        if getattr(self, 'candidates', None) is None:
+            return
+        results = self.candidates.filterAll(
+            max(self.th, self.detect_thresh), self.nms, self.classes)
+        total = sum(len(detections) for detections in results.values())
+        ui.detection_cnt.setText('Detections : %d (%d frames)' %
+                                 (total, len(results)))
+
+        frame_count = self.frame_count
+        if not self.enable_pause or frame_count not in results:
+            return
+        frame = self.reader.read(frame_count - 1)
+        if frame is None:
+            return
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        detections = self.detector.toDetections(results[frame_count])
+        self.show_frame(self.render_frame(
+            (frame_count, frame, detections, None)))
+
+    def track_frame(self, item):
+        '''
+        추적 단계
+        추적기는 상태를 가지므로 프레임 순서대로 한 스레드에서만 실행
+        (프레임 번호, 프레임, 검출 결과) -> (..., 추적 결과 스냅샷)
+        '''
+        frame_count, frame, detections, keyframe = item
+        tracks = None
+        if not keyframe and ui.tk_chk.isChecked():
+            # 검출을 건너뛴 프레임은 보완 알고리즘으로 추적 유지
+            self.tracker.predict(frame_count)
+            tracks = self.tracker.snapshotTracks()
+        elif detections is not None and ui.tk_chk.isChecked():
+            '''
+            Darknet compilation required
+            검출된 객체 수만큼 detections와 track_infos 반환.
+            track_infos[n][0]이 tracking ID (같은 tracking ID면 같은 객체)
+            '''
+            detection_infos = self.tracker.convertDetection2Tracking(
+                detections, frame_count)
+            track_infos = self.tracker.tracking(
+                detection_infos, frame_count)
+            tracks = self.tracker.snapshotTracks()
+            for track in tracks:
+                if not track.id in self.tracked_id:
+                    self.tracked_id.append(track.id)
+                # 새로운 tracking 대상이 들어오면 list에 추가, 지도에 추가 요청 코드 작성 필요
+                # 현재 프레임 카운트 정보 frame_count
+        return (frame_count, frame, detections, tracks)
+
+    def render_frame(self, item):
+        '''
+        그리기 단계
+        검출 및 추적 결과를 그리고 Qt 이미지로 변환
+        '''
+        frame_count, frame, detections, tracks = item
 
         rst_frame = np.zeros([100,100,3],dtype=np.uint8)
         rst_frame.fill(240)
 
+        if detections is not None:
+            rst_frame = self.detector.cvDrawBoxes(detections, frame, self.th)
+        if tracks is not None:
+            rst_frame = self.tracker.cvDrawBoxes(tracks, frame)
+
+        with stage('qimage'):
+            img4Qt = QImage(frame, frame.shape[1], frame.shape[0], QImage.Format_RGB888)
+            rst_img4Qt = QImage(rst_frame, rst_frame.shape[1], rst_frame.shape[0], QImage.Format_RGB888)
+
+        # QImage는 numpy 버퍼를 참조하므로 프레임도 함께 넘김
+        return (frame_count, frame, rst_frame, img4Qt, rst_img4Qt)
 
+    def show_frame(self, item):
         '''
-        Darknet compilation required
-        검출된 객체 수만큼 detections와 track_infos 반환.
-        track_infos[n][0]이 tracking ID (같은 tracking ID면 같은 객체)
+        표시 단계
+        변환된 이미지를 화면에 표시하고 진행 상태 갱신
         '''
-        if ui.dt_chk.isChecked():
-            detections = self.detector.detector(frame)
-            rst_frame = self.detector.cvDrawBoxes(detections, frame, self.th)
-            if ui.tk_chk.isChecked():
-                detection_infos = self.tracker.convertDetection2Tracking(
-                    detections, self.frame_count)
-                track_infos = self.tracker.tracking(
-                    detection_infos, self.frame_count)
-                rst_frame = self.tracker.cvDrawBoxes(
-                    self.tracker.track_infos, frame)
-                for i in range(0,len(self.tracker.track_infos-1)):
-                    if not self.tracker.track_infos[i].id in self.tracked_id:
-                        self.tracked_id.append(self.tracker.track_infos[i].id)
-                    # 새로운 tracking 대상이 들어오면 list에 추가, 지도에 추가 요청 코드 작성 필요
-                    # 현재 프레임 카운트 정보 self.frame_count
-
-
-        img4Qt = QImage(frame, frame.shape[1], frame.shape[0], QImage.Format_RGB888)
-
-        ui.pixmap = QPixmap(img4Qt)
-        ui.p = ui.pixmap.scaled(720,405,QtCore.Qt.IgnoreAspectRatio)
+        frame_count, frame, rst_frame, img4Qt, rst_img4Qt = item
+        self.frame_count = frame_count
+
+        with stage('qpixmap'):
+            ui.pixmap = QPixmap(img4Qt)
+            ui.p = ui.pixmap.scaled(720,405,QtCore.Qt.IgnoreAspectRatio)
+            ui.rst_pixmap = QPixmap(rst_img4Qt)
+            ui.rst_p = ui.rst_pixmap.scaled(720,405,QtCore.Qt.IgnoreAspectRatio)
         ui.leftView.setPixmap(ui.p)
         ui.leftView.update()
 
-        rst_img4Qt = QImage(rst_frame, rst_frame.shape[1], rst_frame.shape[0], QImage.Format_RGB888)
-
-        ui.rst_pixmap = QPixmap(rst_img4Qt)
-        ui.rst_p = ui.rst_pixmap.scaled(720,405,QtCore.Qt.IgnoreAspectRatio)
         ui.rightView.setPixmap(ui.rst_p)
         ui.rightView.update()
 
         ui.videoProgress.setValue(self.frame_count)
         ui.frame_cnt_rate.setText(str(self.frame_count) + '/' + str(self.num_of_frame))
 
+        if not self.first_frame_shown:
+            self.first_frame_shown = True
+            now = time.perf_counter()
+            print('first frame : %.3fs after launch, %.3fs after load' %
+                  (now - STARTUP_TIME, now - self.load_time))
+
+    def play_pipeline(self):
+        '''
+        디코딩, 검출, 추적, 그리기를 각각의 스레드에서 실행하며 재생
+        일시 정지되면 새 프레임을 읽지 않고, 이미 검출/추적한 프레임까지
+        모두 표시한 뒤 멈춤. 추적기 등의 상태가 마지막으로 표시한 프레임과
+        같으므로 다음 재생은 그 다음 프레임부터 이어서 진행
+        '''
+        with self.play_lock:
+            video_pipeline = pipeline.Pipeline(self.read_frames(), [
+                pipeline.Stage('detect', self.detect_frame),
+                pipeline.Stage('track', self.track_frame),
+                pipeline.Stage('render', self.render_frame),
+            ], maxsize=4).start()
+            try:
+                for item in video_pipeline.results():
+                    self.show_frame(item)
+                    if self.enable_pause:
+                        video_pipeline.drain()
+                        continue
+                    sleep(0.01)
+            finally:
+                video_pipeline.stop()
+        self.enable_pause = True
+        if self.motion_gating:
+            print('motion gate : skipped %d/%d frames' %
+                  (self.motion_gate.skipped, self.motion_gate.frames))
+        self.write_metrics()
+
+    def write_metrics(self):
+        '''
+        단계별 소요 시간을 JSON 스냅샷과 Prometheus 텍스트 파일로 기록
+        '''
+        if self.metrics_path is None:
+            return
+        try:
+            profiler.PROFILER.writeJSON(self.metrics_path + '.json')
+            profiler.PROFILER.writePrometheus(self.metrics_path + '.prom')
+        except OSError as e:
+            print("Writing metrics failed: " + str(e))
+
     def Video_to_frame(self, MainWindow):
         self.enable_pause = True
         while True:
-            while not self.enable_pause:
-                self.play_once()
+            if self.enable_pause:
                 sleep(0.01)
+                continue
+            self.play_pipeline()
     
     def video_thread(self,MainWindow):
         thread = threading.Thread(target=self.Video_to_frame, args=(self,))
@@ -293,6 +560,11 @@ class Ui_MainWindow(object):
         self.trsh.setText("0.1")
         self.trsh.setGeometry(QtCore.QRect(740,650,60,16))
         self.trsh.setObjectName("threshold")
+        self.trsh.editingFinished.connect(self.trsh_btn_clicked)
+
+        self.detection_cnt = QtWidgets.QLabel(self.centralwidget)
+        self.detection_cnt.setGeometry(QtCore.QRect(620,675,200,16))
+        self.detection_cnt.setObjectName("detectionCount")
 
         self.dt_chk = QtWidgets.QCheckBox(self.centralwidget)
         self.dt_chk.setGeometry(QtCore.QRect(740, 545, 91, 16))
@@ -327,7 +599,27 @@ class Ui_MainWindow(object):
         weight_path = "C:\\anno_ws\AutoAnnotation_option\yolov4-tiny.weights"
         data_path = "C:\\anno_ws\AutoAnnotation_option\yolov4-tiny.data"
 
-        b_video.load_video(self.file_name, cfg_path, weight_path, data_path)
+        # 추론 백엔드 선택 ('darknet', 'opencv', 'stub')
+        backend = os.environ.get('DEFECT_DETECTOR_BACKEND', 'darknet')
+
+        # 프로젝트가 있으면 프로젝트 안에, 없으면 사용자 폴더에 검출 캐시 저장
+        if self.dir_flag:
+            cache_dir = os.path.join(self.workspace, 'cache')
+        else:
+            cache_dir = os.path.join(os.path.expanduser('~'),
+                                     '.defect_detector', 'cache')
+
+        # 프로젝트의 roi.json에서 카메라(비디오 파일명 또는 default)별 관심 영역 읽기
+        roi = None
+        roi_path = os.path.join(self.workspace, 'roi.json') \
+            if self.dir_flag else None
+        if roi_path is not None and os.path.exists(roi_path):
+            camera = os.path.splitext(os.path.basename(self.file_name))[0]
+            roi = utils.RegionOfInterest.fromConfig(roi_path, camera) or \
+                utils.RegionOfInterest.fromConfig(roi_path, 'default')
+
+        b_video.load_video(self.file_name, cfg_path, weight_path, data_path,
+                           backend, cache_dir, roi)
 
     def retranslateUi(self, MainWindow):
         _translate = QtCore.QCoreApplication.translate
@@ -349,11 +641,21 @@ class Ui_MainWindow(object):
             print(self.path)
 
     def trsh_btn_clicked(self):
-        input_num = float(self.trsh.text())
-        if 0< input_num < 1:
+        try:
+            input_num = float(self.trsh.text())
+        except ValueError:
+            self.disp_error('Error Message', 'Input threshold is not a number')
+            return
+        # 저장된 후보는 detect_thresh 이상만 있으므로 그보다 낮은 임계값은 적용 불가
+        candidates = getattr(b_video, 'candidates', None)
+        floor = candidates.floor if candidates is not None else b_video.detect_thresh
+        if floor <= input_num < 1:
             b_video.th = input_num
+            # 저장된 후보만 다시 필터링
+            b_video.refilter()
         else:
-            self.disp_error('Error Message', 'Input threshold is out of range')
+            self.disp_error('Error Message',
+                            'Input threshold is out of range (%g ~ 1)' % floor)
         
     def dt_chk_change(self):
         if self.dt_chk.isChecked():
@@ -442,4 +744,6 @@ if __name__ == "__main__":
     ui.setupUi(MainWindow,b_video)
     b_video.video_thread(MainWindow)
     MainWindow.show()
+    print('window shown : %.3fs after launch' %
+          (time.perf_counter() - STARTUP_TIME))
     sys.exit(app.exec_())
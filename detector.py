@@ -1,17 +1,24 @@
 """
 다크넷 검출기를 이용하여 입력된 이미지에서
 모든 차량 객체를 검출한다.
+추론은 backend 모듈의 백엔드(darknet, OpenCV DNN, stub)를 선택하여 수행한다.
+DetectorPool은 독립된 네트워크를 가진 검출기 여러개로 프레임을 병렬 검출한다.
 """
 
 
-from ctypes import *
 import math
 import random
 import os
 import cv2
 import numpy as np
 import time
-import darknet
+import threading
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import Backend, createBackend
+from profiler import stage, timed
 
 from tracker import *
 from utils import *
@@ -21,20 +28,46 @@ class Detector():
     """
     객체를 검출하기 위한 클래스
     """
-    def __init__(self):
+    def __init__(self, backend='darknet'):
         '''
         객체 검출을 위한 멤버 변수 선언
+        backend : 추론 백엔드 이름('darknet', 'opencv', 'stub') 또는 Backend 객체
         '''
-        self.netMain = None
-        self.metaMain = None
-        self.altNames = None
+        if isinstance(backend, Backend):
+            self.backend = backend
+        else:
+            self.backend = createBackend(backend)
 
-        self.darknet_width = None
-        self.darknet_height = None
-        self.darknet_image = None
+        self.network_width = None
+        self.network_height = None
 
         self.scale_width = None
         self.scale_height = None
+
+        # preprocessing buffer reused for each frame
+        self.resized_frame = None
+
+        self.batch_size = 1
+
+        # region of interest (utils.RegionOfInterest)
+        self.roi = None
+
+        # per tile cost of the last detect_tiled call
+        self.tile_report = []
+
+        # two stage cascade (setCascade)
+        self.cascade = None
+        self.cascade_report = {}
+        self.cascade_stats = {'frames': 0, 'candidates': 0, 'accepted': 0,
+                              'escalated': 0, 'verified': 0,
+                              'scan_ms': 0.0, 'verify_ms': 0.0}
+
+        # lazy loading state
+        self.load_args = None
+        self.loaded = False
+        self.load_error = None
+        self.load_time = None
+        self.load_lock = threading.Lock()
         
         self.frame_num = 0
 
@@ -50,6 +83,7 @@ class Detector():
         return xmin, ymin, xmax, ymax
 
 
+    @timed('draw_detections')
     def cvDrawBoxes(self, detections, img, thresh=0.5):
         '''
         검출 결과와 이미지를 입력받아
@@ -94,6 +128,16 @@ class Detector():
         return new_detections
 
 
+    def convertScaleArray(self, detections):
+        '''
+        (class_id, score, cx, cy, w, h) 형태의 검출 배열을 입력받아
+        yolo 입력 크기의 좌표를 이미지 좌표로 변환하여 반환
+        '''
+        detections[:, 2:6:2] *= self.scale_width
+        detections[:, 3:6:2] *= self.scale_height
+        return detections
+
+
     def drawResults(self, writer, tracks, frame_num):
         '''
         파일 기술자와 검출 정보를 입력받아
@@ -114,52 +158,85 @@ class Detector():
                                                   pt2[1]))
 
 
-    def initialize(self, configPath, weightPath, metaPath):
+    def toDetections(self, detections):
+        '''
+        (class_id, score, cx, cy, w, h) 형태의 검출 배열을
+        [('class name', confidence, (cx, cy, w, h)), ...] 형태로 변환하여 반환
+        '''
+        self.ensureLoaded()
+        names = self.backend.names
+        return [(names[int(row[0])], row[1], (row[2], row[3], row[4], row[5]))
+                for row in detections.tolist()]
+
+
+    def initialize(self, configPath, weightPath, metaPath, batch_size=1,
+                   lazy=False):
         '''
         검출기를 초기화 하는 함수
+        batch_size : 한번의 추론에 입력할 프레임 수
+        lazy : True이면 네트워크를 첫 검출 시점(또는 warmup)에 불러옴
+        '''
+        self.load_args = (configPath, weightPath, metaPath, batch_size)
+        self.loaded = False
+        self.load_error = None
+        if not lazy:
+            self.ensureLoaded()
+
+
+    def ensureLoaded(self):
         '''
-        if not os.path.exists(configPath):
-            raise ValueError("Invalid config path `" +
-                             os.path.abspath(configPath)+"`")
-        if not os.path.exists(weightPath):
-            raise ValueError("Invalid weight path `" +
-                             os.path.abspath(weightPath)+"`")
-        if not os.path.exists(metaPath):
-            raise ValueError("Invalid data file path `" +
-                             os.path.abspath(metaPath)+"`")
-
-        if self.netMain is None:
-            self.netMain = darknet.load_net_custom(configPath.encode(
-                # batch size = 1
-                "ascii"), weightPath.encode("ascii"), 0, 1)  
-        if self.metaMain is None:
-            self.metaMain = darknet.load_meta(metaPath.encode("ascii"))
-        if self.altNames is None:
+        네트워크가 아직 불러와지지 않았다면 불러오는 함수
+        여러 스레드에서 호출해도 한번만 불러옴
+        '''
+        if self.loaded:
+            return
+        with self.load_lock:
+            if self.loaded:
+                return
+            if self.load_error is not None:
+                raise self.load_error
+            start = time.perf_counter()
             try:
-                with open(metaPath) as metaFH:
-                    metaContents = metaFH.read()
-                    import re
-                    match = re.search("names *= *(.*)$", metaContents,
-                                      re.IGNORECASE | re.MULTILINE)
-                    if match:
-                        result = match.group(1)
-                    else:
-                        result = None
-                    try:
-                        if os.path.exists(result):
-                            with open(result) as namesFH:
-                                namesList = namesFH.read().strip().split("\n")
-                                altNames = [x.strip() for x in namesList]
-                    except TypeError:
-                        pass
-            except TypeError:
-                pass
-        
-        # Create an image we reuse for each detect
-        self.darknet_width = darknet.network_width(self.netMain)
-        self.darknet_height = darknet.network_height(self.netMain)
-        self.darknet_image = darknet.make_image(darknet.network_width(self.netMain),
-                                        darknet.network_height(self.netMain), 3)
+                self.backend.load(*self.load_args)
+            except Exception as e:
+                self.load_error = e
+                raise
+            self.batch_size = self.backend.batch_size
+            self.network_width = self.backend.width
+            self.network_height = self.backend.height
+            self.resized_frame = np.empty(
+                (self.network_height, self.network_width, 3), dtype=np.uint8)
+            self.load_time = time.perf_counter() - start
+            self.loaded = True
+
+
+    def release(self):
+        '''
+        백엔드의 네트워크 참조를 반환하는 함수
+        같은 네트워크를 사용하는 다른 검출기가 없으면 네트워크가 해제됨
+        '''
+        with self.load_lock:
+            if self.loaded:
+                self.backend.release()
+            self.loaded = False
+            self.load_error = None
+
+
+    def warmup(self):
+        '''
+        백그라운드 스레드에서 네트워크를 미리 불러오는 함수
+        실패하면 첫 검출 시점에 예외가 다시 발생함
+        '''
+        def load():
+            try:
+                self.ensureLoaded()
+            except Exception as e:
+                print("Detector warmup failed: " + str(e))
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+        return thread
 
 
     def getDetectionImage(self, image):
@@ -168,12 +245,38 @@ class Detector():
         '''
         frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         frame_resized = cv2.resize(frame_rgb,
-                                    (darknet.network_width(self.netMain),
-                                    darknet.network_height(self.netMain)),
+                                    (self.network_width,
+                                    self.network_height),
                                     interpolation=cv2.INTER_LINEAR)
         return frame_resized
 
 
+    def preprocess(self, image, out):
+        '''
+        BGR 이미지를 네트워크 입력 크기로 조정하여
+        RGB 순서의 정규화된 (c, h, w) float 버퍼 out에 직접 기록하는 함수
+        resized_frame 버퍼를 재사용하므로 프레임마다 메모리를 할당하지 않음
+        '''
+        with stage('resize'):
+            cv2.resize(image, (self.network_width, self.network_height),
+                       dst=self.resized_frame, interpolation=cv2.INTER_LINEAR)
+        # HWC BGR -> CHW RGB, 0~255 -> 0.0~1.0
+        # (copy_image_from_bytes를 대신하여 입력 버퍼에 직접 기록)
+        with stage('normalize'):
+            np.multiply(self.resized_frame.transpose(2, 0, 1)[::-1],
+                        np.float32(1.0 / 255.0), out=out)
+        return out
+
+
+    def setScale(self, image):
+        '''
+        입력 이미지와 네트워크 입력 크기의 비율 계산
+        '''
+        height, width, _ = image.shape
+        self.scale_width = float(width) / float(self.network_width)
+        self.scale_height = float(height) / float(self.network_height)
+
+
     def detector(self, image, thresh=0.25):
         '''
         이미지와 임계값을 전달 받아 검출하는 함수
@@ -185,24 +288,391 @@ class Detector():
                          [('class name', confidence, (cx, cy, w, h)), ...]
         '''
         #prev_time = time.time()
-        frame_read = image
-        height, width, _ = frame_read.shape
-        self.scale_width = float(width) / float(self.darknet_width)
-        self.scale_height = float(height) / float(self.darknet_height)
+        detections = self.detectArrays([image], thresh)[0]
 
-        frame_rgb = cv2.cvtColor(frame_read, cv2.COLOR_BGR2RGB)
-        frame_resized = cv2.resize(frame_rgb,
-                                (self.darknet_width,
-                                    self.darknet_height),
-                                interpolation=cv2.INTER_LINEAR)
+        detections = self.toDetections(detections)
 
-        darknet.copy_image_from_bytes(self.darknet_image, frame_resized.tobytes())
+        #fps = 1/(time.time()-prev_time)
 
-        detections = darknet.detect_image(self.netMain, self.metaMain, self.darknet_image, thresh)
+        #return detections, fps
+        return detections
 
-        detections = self.convertScale(detections)
 
-        #fps = 1/(time.time()-prev_time)
+    def inferArrays(self, frames, thresh=0.25, nms=.45):
+        '''
+        여러 이미지를 배치 단위로 묶어 추론하는 함수 (관심 영역 미적용)
+        입력 :
+            frames : numpy BGR 이미지 리스트
+            thresh : 검출 신뢰도 임계값(0.0~1.0)
+            nms : NMS IOU 임계값, 0이면 NMS 전 후보를 모두 반환
+        출력 :
+            batch_detections : 이미지별 (class_id, score, cx, cy, w, h) 배열
+                               리스트 (이미지 좌표)
+        '''
+        self.ensureLoaded()
+        batch_detections = []
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            for idx, frame in enumerate(chunk):
+                self.preprocess(frame, self.backend.input_data[idx])
 
-        #return detections, fps
-        return detections
\ No newline at end of file
+            results = self.backend.predict(len(chunk), thresh, nms=nms)
+            for frame, detections in zip(chunk, results):
+                self.setScale(frame)
+                batch_detections.append(self.convertScaleArray(detections))
+        return batch_detections
+
+
+    def inferRaw(self, frames, thresh=.005, hier_thresh=.5):
+        '''
+        여러 이미지를 배치 단위로 묶어 NMS 전 네트워크 출력을 반환하는 함수
+        (관심 영역 미적용)
+        출력 :
+            batch_raw : 이미지별 (cx, cy, w, h, objectness, prob_0, ..., prob_n)
+                        배열 리스트 (이미지 좌표)
+        '''
+        self.ensureLoaded()
+        batch_raw = []
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            for idx, frame in enumerate(chunk):
+                self.preprocess(frame, self.backend.input_data[idx])
+
+            results = self.backend.predictRaw(len(chunk), thresh, hier_thresh)
+            for frame, raw in zip(chunk, results):
+                self.setScale(frame)
+                raw[:, 0:4:2] *= self.scale_width
+                raw[:, 1:4:2] *= self.scale_height
+                batch_raw.append(raw)
+        return batch_raw
+
+
+    def setROI(self, roi):
+        '''
+        검출 관심 영역(utils.RegionOfInterest)을 설정, None이면 전체 프레임 사용
+        '''
+        self.roi = roi
+        if self.cascade is not None:
+            self.cascade['scan'].setROI(roi)
+
+
+    def detectArrays(self, frames, thresh=0.25, nms=.45):
+        '''
+        여러 프레임을 배치 단위로 묶어 검출하는 함수
+        관심 영역이 설정되어 있으면 외접 사각형만 잘라 추론하고
+        결과를 프레임 좌표로 되돌린 뒤 영역 밖의 결과를 제거
+        입력 :
+            frames : numpy BGR 이미지 리스트
+            thresh : 검출 신뢰도 임계값(0.0~1.0)
+            nms : NMS IOU 임계값, 0이면 NMS 전 후보를 모두 반환
+        출력 :
+            batch_detections : 프레임별 (class_id, score, cx, cy, w, h) 배열
+                               리스트 (프레임 좌표)
+        '''
+        if self.roi is None:
+            return self.inferArrays(frames, thresh, nms)
+
+        crops = [self.roi.crop(frame) for frame in frames]
+        results = self.inferArrays([crop for crop, _ in crops], thresh, nms)
+        batch_detections = []
+        for (_, (x0, y0)), detections in zip(crops, results):
+            detections[:, 2] += x0
+            detections[:, 3] += y0
+            batch_detections.append(self.roi.filter(detections))
+        return batch_detections
+
+
+    def detect_batch(self, frames, thresh=0.25):
+        '''
+        여러 프레임을 배치 단위로 묶어 한번에 검출하는 함수
+        입력 :
+            frames : numpy BGR 이미지 리스트
+            thresh : 검출 신뢰도 임계값(0.0~1.0)
+        출력 :
+            batch_detections : 프레임별 검출 결과 리스트
+                               [[('class name', confidence, (cx, cy, w, h)), ...], ...]
+        '''
+        return [self.toDetections(detections)
+                for detections in self.detectArrays(frames, thresh)]
+
+
+    def tileLayout(self, width, height, tiles=None, overlap=0.2):
+        '''
+        이미지 크기와 타일 배치(열, 행), 겹침 비율을 입력받아
+        타일 영역 [(x, y, w, h), ...] 반환
+        tiles가 None이면 네트워크 입력 크기의 타일로 이미지를 덮도록 배치
+        '''
+        self.ensureLoaded()
+        if tiles is None:
+            tile_w = min(width, self.network_width)
+            tile_h = min(height, self.network_height)
+            step_w = max(1.0, tile_w * (1 - overlap))
+            step_h = max(1.0, tile_h * (1 - overlap))
+            cols = max(1, int(math.ceil((width - tile_w) / step_w)) + 1)
+            rows = max(1, int(math.ceil((height - tile_h) / step_h)) + 1)
+        else:
+            cols, rows = tiles
+            tile_w = min(width, int(math.ceil(
+                width / (cols - (cols - 1) * overlap))))
+            tile_h = min(height, int(math.ceil(
+                height / (rows - (rows - 1) * overlap))))
+
+        xs = np.linspace(0, width - tile_w, cols).round().astype(int) \
+            if cols > 1 else [0]
+        ys = np.linspace(0, height - tile_h, rows).round().astype(int) \
+            if rows > 1 else [0]
+        return [(int(x), int(y), tile_w, tile_h) for y in ys for x in xs]
+
+
+    def detect_tiled(self, image, thresh=0.25, tiles=None, overlap=0.2,
+                     nms=0.45, merge='ios'):
+        '''
+        고해상도 이미지를 겹치는 타일로 나누어 배치로 검출한 뒤
+        이미지 좌표로 변환하고 타일 사이의 중복 박스를 NMS로 병합
+        입력 :
+            image : numpy BGR 이미지
+            thresh : 검출 신뢰도 임계값(0.0~1.0)
+            tiles : 타일 배치 (열, 행), None이면 네트워크 입력 크기로 자동 배치
+            overlap : 인접 타일의 겹침 비율(0.0~1.0)
+            nms : 타일 병합시 사용할 IOU 임계값
+            merge : 병합 기준 ('iou' 또는 'ios', utils.boxIOUMatrix 참고)
+        출력 :
+            detections : [('class name', confidence, (cx, cy, w, h)), ...]
+        타일별 비용은 self.tile_report에 저장
+            [{'tile': (x, y, w, h), 'detections': n, 'ms': 추론 시간}, ...]
+        '''
+        self.ensureLoaded()
+        # 관심 영역이 있으면 외접 사각형 안에서만 타일 배치
+        roi_x, roi_y = 0, 0
+        if self.roi is not None:
+            image, (roi_x, roi_y) = self.roi.crop(image)
+        height, width, _ = image.shape
+        layout = self.tileLayout(width, height, tiles, overlap)
+        crops = [image[y:y + h, x:x + w] for x, y, w, h in layout]
+
+        self.tile_report = []
+        merged = []
+        for start in range(0, len(crops), self.batch_size):
+            chunk = crops[start:start + self.batch_size]
+            begin = time.perf_counter()
+            results = self.inferArrays(chunk, thresh)
+            cost = (time.perf_counter() - begin) * 1000 / len(chunk)
+            for (x, y, w, h), detections in \
+                    zip(layout[start:start + len(chunk)], results):
+                detections[:, 2] += x + roi_x
+                detections[:, 3] += y + roi_y
+                merged.append(detections)
+                self.tile_report.append({'tile': (x + roi_x, y + roi_y, w, h),
+                                         'detections': len(detections),
+                                         'ms': cost})
+
+        detections = np.concatenate(merged) if merged else \
+            np.zeros((0, 6), dtype=np.float32)
+        detections = nonMaxSuppression(detections, nms, mode=merge)
+        if self.roi is not None:
+            detections = self.roi.filter(detections)
+        return self.toDetections(detections)
+
+
+    def setCascade(self, scan, low=0.1, high=0.5, context=0.5,
+                   min_crop=None):
+        '''
+        작은 입력 크기의 검출기로 전체 프레임을 먼저 검출하고
+        애매한 후보만 원본 해상도에서 이 검출기로 다시 검출하는 cascade 설정
+            scan : 작은 입력 크기 cfg로 초기화한 Detector, None이면 해제
+            low, high : 신뢰도가 [low, high) 구간인 후보만 재검출
+                        high 이상은 그대로 채택, low 미만은 버림
+            context : 후보 박스 주변으로 함께 잘라낼 비율 (박스 크기 대비, 한쪽)
+            min_crop : 잘라낼 최소 크기 (w, h), None이면 이 검출기의 입력 크기
+        '''
+        if scan is None:
+            self.cascade = None
+            return
+        scan.setROI(self.roi)
+        self.cascade = {'scan': scan, 'low': low, 'high': high,
+                        'context': context, 'min_crop': min_crop}
+
+
+    def cascadeCrops(self, image, candidates):
+        '''
+        후보 박스(프레임 좌표)를 주변 영역과 함께 원본 이미지에서 잘라낸
+        영역 [(x, y, w, h), ...] 반환
+        '''
+        height, width, _ = image.shape
+        min_w, min_h = self.cascade['min_crop'] or \
+            (self.network_width, self.network_height)
+        scale = 1 + 2 * self.cascade['context']
+        regions = []
+        for _, _, cx, cy, w, h in candidates:
+            crop_w = int(min(width, max(w * scale, min_w)))
+            crop_h = int(min(height, max(h * scale, min_h)))
+            x = int(min(max(cx - crop_w / 2, 0), width - crop_w))
+            y = int(min(max(cy - crop_h / 2, 0), height - crop_h))
+            regions.append((x, y, crop_w, crop_h))
+        return regions
+
+
+    def detect_cascade(self, image, thresh=0.25, nms=0.45, merge='ios'):
+        '''
+        cascade 모드로 이미지를 검출하는 함수 (setCascade 필요)
+        1단계 : 작은 입력 크기로 전체 프레임 검출
+        2단계 : 신뢰도가 애매한 후보만 원본 해상도에서 잘라 배치로 재검출
+        입력 :
+            image : numpy BGR 이미지
+            thresh : 2단계 검출 신뢰도 임계값(0.0~1.0)
+            nms : 채택된 결과와 재검출 결과를 병합할 때 사용할 임계값
+            merge : 병합 기준 ('iou' 또는 'ios', utils.boxIOUMatrix 참고)
+        출력 :
+            detections : [('class name', confidence, (cx, cy, w, h)), ...]
+        단계별 개수와 시간은 self.cascade_report(마지막 프레임)와
+        self.cascade_stats(누적)에 저장
+        '''
+        if self.cascade is None:
+            raise ValueError("Cascade is not configured, call setCascade first")
+        self.ensureLoaded()
+        low, high = self.cascade['low'], self.cascade['high']
+
+        begin = time.perf_counter()
+        candidates = self.cascade['scan'].detectArrays([image], low)[0]
+        scan_ms = (time.perf_counter() - begin) * 1000
+
+        accepted = candidates[candidates[:, 1] >= high]
+        uncertain = candidates[candidates[:, 1] < high]
+
+        begin = time.perf_counter()
+        merged = [accepted]
+        regions = self.cascadeCrops(image, uncertain)
+        crops = [image[y:y + h, x:x + w] for x, y, w, h in regions]
+        verified = 0
+        for (x, y, _, _), detections in \
+                zip(regions, self.inferArrays(crops, thresh)):
+            detections[:, 2] += x
+            detections[:, 3] += y
+            verified += len(detections)
+            merged.append(detections)
+        verify_ms = (time.perf_counter() - begin) * 1000
+
+        detections = nonMaxSuppression(np.concatenate(merged), nms,
+                                        mode=merge)
+        if self.roi is not None:
+            detections = self.roi.filter(detections)
+
+        self.cascade_report = {'candidates': len(candidates),
+                               'accepted': len(accepted),
+                               'escalated': len(uncertain),
+                               'verified': verified,
+                               'scan_ms': scan_ms, 'verify_ms': verify_ms}
+        self.cascade_stats['frames'] += 1
+        for key, value in self.cascade_report.items():
+            self.cascade_stats[key] += value
+        return self.toDetections(detections)
+
+
+def defaultPoolSize(threads_per_network=4):
+    '''
+    CPU 코어 수를 네트워크 하나가 사용하는 스레드 수로 나눈 검출기 수
+    '''
+    return max(1, (os.cpu_count() or 1) // threads_per_network)
+
+
+class DetectorPool():
+    """
+    독립된 네트워크와 입력 버퍼를 가진 검출기 여러개에
+    스레드 풀로 프레임을 나누어 검출하는 클래스
+    darknet ctypes 호출은 GIL을 놓으므로 검출기 수만큼 동시에 추론된다.
+    """
+    def __init__(self, size=None, backend='darknet', **backend_args):
+        '''
+        size : 검출기(네트워크) 수, None이면 defaultPoolSize()
+        backend : 추론 백엔드 이름, backend_args는 백엔드 생성 인자
+        '''
+        self.size = size or defaultPoolSize()
+        self.detectors = []
+        for _ in range(self.size):
+            instance = createBackend(backend, **backend_args)
+            # 각 검출기가 자신만의 네트워크를 불러오도록 공유하지 않음
+            instance.shared = False
+            self.detectors.append(Detector(instance))
+
+        self.idle = queue.Queue()
+        for det in self.detectors:
+            self.idle.put(det)
+        self.executor = ThreadPoolExecutor(max_workers=self.size,
+                                           thread_name_prefix='detector')
+
+
+    def initialize(self, configPath, weightPath, metaPath, batch_size=1):
+        '''
+        모든 검출기의 네트워크를 병렬로 불러오는 함수
+        '''
+        for det in self.detectors:
+            det.initialize(configPath, weightPath, metaPath, batch_size,
+                           lazy=True)
+        for future in [self.executor.submit(det.ensureLoaded)
+                       for det in self.detectors]:
+            future.result()
+
+
+    def setROI(self, roi):
+        '''
+        모든 검출기의 관심 영역 설정
+        '''
+        for det in self.detectors:
+            det.setROI(roi)
+
+
+    def run(self, frame, thresh, nms):
+        '''
+        쉬고 있는 검출기 하나로 프레임을 검출 (작업 스레드에서 실행)
+        '''
+        det = self.idle.get()
+        try:
+            return det.detectArrays([frame], thresh, nms)[0]
+        finally:
+            self.idle.put(det)
+
+
+    def submit(self, frame, thresh=0.25, nms=.45):
+        '''
+        프레임 검출을 요청하고 (class_id, score, cx, cy, w, h) 배열의 Future 반환
+        '''
+        return self.executor.submit(self.run, frame, thresh, nms)
+
+
+    def detectArrays(self, frames, thresh=0.25, nms=.45):
+        '''
+        여러 프레임을 병렬로 검출하여 입력 순서대로 배열 리스트 반환
+        '''
+        futures = [self.submit(frame, thresh, nms) for frame in frames]
+        return [future.result() for future in futures]
+
+
+    def imap(self, frames, thresh=0.25, nms=.45, ahead=None):
+        '''
+        프레임 iterable을 병렬로 검출하여 입력 순서대로 배열을 반환하는 generator
+        ahead : 동시에 요청해 둘 최대 프레임 수, None이면 검출기 수의 두배
+        '''
+        ahead = ahead or self.size * 2
+        pending = collections.deque()
+        for frame in frames:
+            pending.append(self.submit(frame, thresh, nms))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+    def toDetections(self, detections):
+        '''
+        검출 배열을 [('class name', confidence, (cx, cy, w, h)), ...] 형태로 변환
+        '''
+        return self.detectors[0].toDetections(detections)
+
+
+    def release(self):
+        '''
+        작업 스레드를 종료하고 모든 검출기의 네트워크 해제
+        '''
+        self.executor.shutdown(wait=True)
+        for det in self.detectors:
+            det.release()
@@ -0,0 +1,253 @@
+"""
+비디오 프레임 접근 계층을 제공한다.
+커서 주변의 디코딩된 프레임을 LRU로 보관하고, 처음 열 때 키프레임/타임스탬프
+색인을 만들며, 재생 위치 앞쪽 프레임을 백그라운드에서 미리 디코딩한다.
+앞뒤 한 프레임 이동은 대부분 캐시에서 바로 반환된다.
+
+키프레임 색인은 OpenCV의 raw stream 모드(CAP_PROP_FORMAT=-1)로 패킷만 읽어
+만들고, 이를 지원하지 않는 OpenCV에서는 PyAV(av 패키지)를 사용한다.
+둘 다 사용할 수 없으면 고정 크기 구간을 뒤로 채우는 방식으로 동작한다.
+"""
+
+
+import collections
+import threading
+
+import cv2
+
+
+def buildKeyframeIndex(file_name, fps):
+    '''
+    패킷만 읽어(디코딩 없이) 키프레임의 프레임 번호 리스트 반환
+    OpenCV, PyAV 모두 사용할 수 없으면 None 반환
+    '''
+    keyframes = buildKeyframeIndexCV(file_name)
+    if keyframes is None:
+        keyframes = buildKeyframeIndexAV(file_name, fps)
+    return keyframes
+
+
+def buildKeyframeIndexCV(file_name):
+    '''
+    OpenCV raw stream 모드로 패킷을 읽어 키프레임의 프레임 번호 리스트 반환
+    raw stream 모드를 지원하지 않는 OpenCV이면 None 반환
+    '''
+    has_key_frame = getattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME', None)
+    if has_key_frame is None:
+        return None
+    cap = cv2.VideoCapture(file_name)
+    try:
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return None
+        keyframes = []
+        index = 0
+        while cap.grab():
+            if cap.get(has_key_frame):
+                keyframes.append(index)
+            index += 1
+    finally:
+        cap.release()
+    return keyframes or None
+
+
+def buildKeyframeIndexAV(file_name, fps):
+    '''
+    PyAV로 패킷을 읽어 키프레임의 프레임 번호 리스트 반환
+    PyAV가 없거나 읽을 수 없으면 None 반환
+    '''
+    try:
+        import av
+    except ImportError:
+        return None
+    try:
+        with av.open(file_name) as container:
+            stream = container.streams.video[0]
+            start = stream.start_time or 0
+            keyframes = []
+            for packet in container.demux(stream):
+                if packet.pts is None or not packet.is_keyframe:
+                    continue
+                seconds = float((packet.pts - start) * stream.time_base)
+                keyframes.append(int(round(seconds * fps)))
+    except Exception as e:
+        print("Keyframe index failed: " + str(e))
+        return None
+    return sorted(set(keyframes))
+
+
+class FrameReader:
+    """
+    프레임 번호로 디코딩된 프레임을 반환하는 클래스
+    """
+    def __init__(self, file_name, capacity=240, prefetch=60, window=30):
+        '''
+        파일명과 캐시 설정을 입력받아 비디오를 열고 백그라운드 작업 시작
+            capacity : 메모리에 보관할 최대 프레임 수
+            prefetch : 커서 앞쪽으로 미리 디코딩할 프레임 수
+            window : 키프레임 색인이 없을 때 뒤로 이동시 한번에 채울 프레임 수
+        '''
+        self.file_name = file_name
+        self.capacity = capacity
+        self.prefetch = min(prefetch, capacity // 2)
+        self.window = min(window, capacity // 2)
+
+        self.cap = cv2.VideoCapture(file_name)
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.num_of_frame = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        # index -> BGR frame
+        self.frames = collections.OrderedDict()
+        # index -> timestamp(ms), 최근 디코딩한 capacity개 프레임에 대해 기록
+        self.timestamps = collections.OrderedDict()
+        self.keyframes = None
+
+        # 다음 read()가 반환할 프레임 번호
+        self.position = 0
+        self.cursor = 0
+
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.running = True
+
+        self.seeks = 0
+        self.decoded = 0
+
+        self.thread = threading.Thread(target=self.background)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def isOpened(self):
+        '''
+        비디오가 열려 있는지 반환
+        '''
+        return self.cap.isOpened()
+
+    def store(self, index, frame):
+        '''
+        디코딩한 프레임을 캐시에 저장하고 오래된 프레임 제거
+        '''
+        self.frames[index] = frame
+        self.frames.move_to_end(index)
+        while len(self.frames) > self.capacity:
+            self.frames.popitem(last=False)
+
+    def decodeNext(self, keep=True):
+        '''
+        현재 위치의 프레임 하나를 디코딩
+        keep이 False이면 디코딩만 하고 이미지 변환과 저장은 생략
+        디코딩에 실패하면 위치를 그대로 두고 None 반환
+        '''
+        index = self.position
+        if not keep:
+            ret = self.cap.grab()
+            frame = None
+        else:
+            ret, frame = self.cap.read()
+        if not ret:
+            # 프레임 수가 실제보다 크게 기록되었거나 스트림이 잘린 경우
+            # 실패한 프레임 앞까지만 사용 (이어서 디코딩하다 실패하면 실제 끝과 같음)
+            self.num_of_frame = min(self.num_of_frame, index)
+            return None
+        self.timestamps[index] = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        self.timestamps.move_to_end(index)
+        while len(self.timestamps) > self.capacity:
+            self.timestamps.popitem(last=False)
+        self.position += 1
+        self.decoded += 1
+        if keep:
+            self.store(index, frame)
+        return frame
+
+    def seekStart(self, index):
+        '''
+        index를 디코딩하기 위해 이동할 시작 프레임 계산
+        뒤로 이동할 때는 다음 이동이 캐시에서 처리되도록 앞쪽 구간도 함께 디코딩
+        '''
+        if self.keyframes:
+            # 어차피 키프레임부터 디코딩하므로 그 구간을 모두 보관
+            pos = 0
+            for keyframe in self.keyframes:
+                if keyframe > index:
+                    break
+                pos = keyframe
+            return pos
+        if index < self.position:
+            return max(0, index - self.window + 1)
+        return index
+
+    def decodeTo(self, index):
+        '''
+        index 프레임까지 디코딩하여 반환
+        '''
+        if not (self.position <= index <= self.position + self.window):
+            start = self.seekStart(index)
+            if start != self.position:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                self.position = start
+                self.seeks += 1
+        frame = None
+        while self.position <= index:
+            # 캐시 용량을 넘는 앞부분은 이미지 변환 없이 건너뜀
+            keep = index - self.position < self.capacity
+            position = self.position
+            frame = self.decodeNext(keep)
+            if self.position == position:
+                # 디코딩 실패
+                return None
+        return frame
+
+    def read(self, index):
+        '''
+        index 프레임(BGR)을 반환, 범위를 벗어나면 None
+        '''
+        if index < 0 or index >= self.num_of_frame:
+            return None
+        with self.lock:
+            self.cursor = index
+            frame = self.frames.get(index)
+            if frame is not None:
+                self.frames.move_to_end(index)
+            else:
+                frame = self.decodeTo(index)
+        self.wakeup.set()
+        return frame
+
+    def timestamp(self, index):
+        '''
+        디코딩한 프레임의 타임스탬프(ms) 반환, 없으면 fps로 추정
+        '''
+        if index in self.timestamps:
+            return self.timestamps[index]
+        return index * 1000.0 / self.fps if self.fps else None
+
+    def background(self):
+        '''
+        키프레임 색인을 만든 뒤 커서 앞쪽 프레임을 미리 디코딩
+        '''
+        keyframes = buildKeyframeIndex(self.file_name, self.fps)
+        with self.lock:
+            self.keyframes = keyframes
+
+        while self.running:
+            with self.lock:
+                ahead = self.position - self.cursor
+                busy = 0 <= ahead < self.prefetch and \
+                    self.position < self.num_of_frame
+                if busy:
+                    busy = self.decodeNext() is not None
+            if not busy:
+                self.wakeup.wait(0.05)
+                self.wakeup.clear()
+
+    def release(self):
+        '''
+        백그라운드 작업을 멈추고 비디오를 닫음
+        '''
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        with self.lock:
+            self.cap.release()
+            self.frames.clear()
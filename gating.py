@@ -0,0 +1,241 @@
+"""
+프레임마다 검출기를 실행할지 결정한다.
+검출은 N 프레임마다(키프레임) 또는 신뢰도가 떨어졌을 때만 수행하고
+그 사이 프레임은 추적기의 보완 알고리즘으로 객체를 이어간다.
+또한 차량이 정지해 있어 장면이 바뀌지 않으면 이전 검출 결과를 재사용한다.
+"""
+
+
+import time
+
+import cv2
+import numpy as np
+
+import tracker
+from utils import boxIOUMatrix
+
+
+class KeyframeScheduler:
+    """
+    키프레임(검출을 수행할 프레임)을 결정하는 클래스
+    """
+    def __init__(self, interval=1, min_confidence=None):
+        '''
+        interval : 검출을 수행할 프레임 간격 (1이면 모든 프레임)
+        min_confidence : 마지막 검출의 평균 신뢰도가 이 값보다 낮으면
+                         간격과 관계없이 다음 프레임에서 검출 (None이면 사용 안함)
+        '''
+        self.interval = max(1, int(interval))
+        self.min_confidence = min_confidence
+
+        self.since_keyframe = None
+        self.low_confidence = False
+
+        self.frames = 0
+        self.keyframes = 0
+
+    def reset(self):
+        '''
+        탐색 등으로 프레임이 끊겼을 때 다음 프레임을 키프레임으로 지정
+        '''
+        self.since_keyframe = None
+        self.low_confidence = False
+
+    def isKeyframe(self):
+        '''
+        현재 프레임에서 검출을 수행해야 하는지 반환
+        '''
+        self.frames += 1
+        if self.since_keyframe is None or self.low_confidence or \
+                self.since_keyframe + 1 >= self.interval:
+            self.since_keyframe = 0
+            self.keyframes += 1
+            return True
+        self.since_keyframe += 1
+        return False
+
+    def update(self, detections):
+        '''
+        키프레임의 검출 결과를 입력받아 신뢰도 저하 여부 갱신
+        '''
+        if self.min_confidence is None:
+            return
+        if len(detections) == 0:
+            self.low_confidence = False
+            return
+        confidence = np.mean([detection[1] for detection in detections])
+        self.low_confidence = confidence < self.min_confidence
+
+    def speedup(self):
+        '''
+        모든 프레임을 검출할 때 대비 검출 횟수 감소 비율
+        '''
+        if self.keyframes == 0:
+            return 1.0
+        return self.frames / self.keyframes
+
+
+class MotionGate:
+    """
+    축소한 프레임의 차이(와 GPS 속도)로 장면 변화 여부를 판단하는 클래스
+    장면이 바뀌지 않았으면 마지막으로 검출한 결과를 재사용한다.
+    """
+    def __init__(self, size=(64, 36), pixel_thresh=12, changed_ratio=0.01,
+                 stopped_speed=None, max_static=150):
+        '''
+        size : 비교할 축소 영상 크기 (width, height)
+        pixel_thresh : 밝기 차이가 이 값보다 큰 화소를 바뀐 화소로 판단
+        changed_ratio : 바뀐 화소 비율이 이 값 이하이면 정지 장면으로 판단
+        stopped_speed : GPS 속도(km/h)가 이 값 이하이면 정지로 판단 (None이면 사용 안함)
+        max_static : 정지 장면에서도 이 프레임 수마다 한번은 검출 (None이면 사용 안함)
+        '''
+        self.size = size
+        self.pixel_thresh = pixel_thresh
+        self.changed_ratio = changed_ratio
+        self.stopped_speed = stopped_speed
+        self.max_static = max_static
+
+        # 마지막으로 검출한 프레임의 축소 영상과 검출 결과
+        self.current = None
+        self.reference = None
+        self.detections = None
+        self.static_count = 0
+
+        self.frames = 0
+        self.skipped = 0
+
+    def reset(self):
+        '''
+        탐색 등으로 프레임이 끊겼을 때 기준 프레임 제거
+        '''
+        self.reference = None
+        self.detections = None
+        self.static_count = 0
+
+    def thumbnail(self, frame):
+        '''
+        프레임을 비교용 흑백 축소 영상으로 변환
+        INTER_AREA로 원본을 바로 줄이면 느리므로 선형 보간으로 먼저 줄인 뒤 평균
+        '''
+        width, height = self.size
+        small = cv2.resize(frame, (width * 4, height * 4),
+                           interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_AREA)
+
+    def check(self, frame, speed=None):
+        '''
+        프레임을 입력받아 이전 검출 결과를 재사용할 수 있으면 그 결과를,
+        검출이 필요하면 None 반환
+        검출이 필요한 경우 검출 후 update()로 결과를 알려주어야 함
+        speed : 현재 GPS 속도(km/h), 없으면 None
+        '''
+        self.frames += 1
+        self.current = self.thumbnail(frame)
+        if self.reference is None or self.detections is None:
+            return None
+        if self.max_static is not None and \
+                self.static_count + 1 >= self.max_static:
+            return None
+        if self.stopped_speed is not None and speed is not None and \
+                speed > self.stopped_speed:
+            return None
+
+        changed = np.count_nonzero(
+            cv2.absdiff(self.current, self.reference) > self.pixel_thresh)
+        if changed > self.changed_ratio * self.current.size:
+            return None
+
+        self.static_count += 1
+        self.skipped += 1
+        return self.detections
+
+    def update(self, detections):
+        '''
+        check()가 None을 반환한 프레임의 검출 결과를 기록
+        비교 기준은 마지막으로 검출한 프레임이므로 느린 변화도 누적되어 감지됨
+        '''
+        self.reference = self.current
+        self.detections = detections
+        self.static_count = 0
+
+    def skipRatio(self):
+        '''
+        검출을 건너뛴 프레임의 비율
+        '''
+        if self.frames == 0:
+            return 0.0
+        return self.skipped / self.frames
+
+
+def runTracking(video_path, det, scheduler, thresh=0.25, max_frames=None):
+    '''
+    비디오를 검출 및 추적하여 프레임별 추적 결과와 소요 시간을 반환
+    scheduler가 키프레임이 아니라고 판단한 프레임은 추적기 예측으로 대체
+    '''
+    cap = cv2.VideoCapture(video_path)
+    track = tracker.Tracker()
+    results = []
+    elapsed = 0.0
+    while max_frames is None or len(results) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_count = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        start = time.perf_counter()
+        if scheduler.isKeyframe():
+            detections = det.detector(frame, thresh)
+            scheduler.update(detections)
+            detection_infos = track.convertDetection2Tracking(
+                detections, frame_count)
+            track_infos = track.tracking(detection_infos, frame_count)
+        else:
+            track_infos = track.predict(frame_count)
+        elapsed += time.perf_counter() - start
+        results.append(track_infos)
+    cap.release()
+    return results, elapsed
+
+
+def evaluateKeyframes(video_path, det, interval, min_confidence=None,
+                      thresh=0.25, max_frames=None, iou_thresh=0.5):
+    '''
+    모든 프레임을 검출한 결과와 키프레임 모드 결과를 비교하여
+    속도 향상과 추적 연속성 손실을 반환
+        speedup : 검출+추적 소요 시간 비율
+        detector_speedup : 검출 횟수 비율
+        continuity_loss : 전체 검출 모드의 추적 박스 중
+                          키프레임 모드에서 IOU iou_thresh 이상으로
+                          찾지 못한 박스의 비율
+        fragmentation : 키프레임 모드 추적 ID 수 / 전체 검출 모드 추적 ID 수
+    '''
+    full, full_time = runTracking(video_path, det, KeyframeScheduler(1),
+                                  thresh, max_frames)
+    scheduler = KeyframeScheduler(interval, min_confidence)
+    keyed, keyed_time = runTracking(video_path, det, scheduler,
+                                    thresh, max_frames)
+
+    total, matched = 0, 0
+    full_ids, keyed_ids = set(), set()
+    for full_tracks, keyed_tracks in zip(full, keyed):
+        full_ids.update(track[0] for track in full_tracks)
+        keyed_ids.update(track[0] for track in keyed_tracks)
+        total += len(full_tracks)
+        if not full_tracks or not keyed_tracks:
+            continue
+        # 추적 박스는 (cx, cy, w, h)
+        iou_matrix = boxIOUMatrix([track[2] for track in full_tracks],
+                                  [track[2] for track in keyed_tracks])
+        matched += int(np.count_nonzero(iou_matrix.max(axis=1) >= iou_thresh))
+
+    report = {
+        'frames': len(full),
+        'interval': interval,
+        'keyframes': scheduler.keyframes,
+        'speedup': full_time / keyed_time if keyed_time > 0 else 1.0,
+        'detector_speedup': scheduler.speedup(),
+        'continuity_loss': 1.0 - matched / total if total else 0.0,
+        'fragmentation': len(keyed_ids) / len(full_ids) if full_ids else 1.0,
+    }
+    return report
@@ -0,0 +1,203 @@
+"""
+프레임 처리 단계(디코딩, 검출, 추적, 그리기 등)를 각각의 스레드에서 실행하는
+파이프라인을 제공한다.
+단계 사이에는 크기가 제한된 큐를 두어 앞 단계가 너무 앞서 나가지 않도록 하고
+(backpressure) 각 단계의 출력은 입력 순서대로 다음 단계로 전달된다.
+"""
+
+
+import heapq
+import queue
+import threading
+
+
+# 입력이 끝났음을 알리는 표시
+STOP = object()
+
+
+class Stage:
+    """
+    파이프라인의 한 단계
+    """
+    def __init__(self, name, func, workers=1):
+        '''
+        단계 이름, 처리 함수, 작업 스레드 수를 입력받아 단계 생성
+        func는 이전 단계의 출력 하나를 입력받아 다음 단계로 넘길 값을 반환
+        상태를 가지는 단계(추적 등)는 workers를 1로 유지해야 함
+        '''
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class OrderedReader:
+    """
+    (순번, 값) 항목을 받는 큐에서 순번 순서대로 값을 꺼내는 클래스
+    여러 작업 스레드가 순서를 바꿔 넣은 항목을 다시 정렬한다.
+    """
+    def __init__(self, input_queue, stop_event):
+        '''
+        입력 큐와 중지 이벤트를 입력받아 생성
+        '''
+        self.input_queue = input_queue
+        self.stop_event = stop_event
+        self.next_seq = 0
+        self.pending = []
+        self.finished = False
+        # 여러 작업 스레드가 함께 읽을 때 사용
+        self.lock = threading.Lock()
+
+    def get(self):
+        '''
+        다음 순번의 (순번, 값)을 반환
+        입력이 끝났거나 중지되면 STOP 반환
+        '''
+        while True:
+            if self.pending and self.pending[0][0] == self.next_seq:
+                item = heapq.heappop(self.pending)
+                self.next_seq += 1
+                return item
+            if self.finished or self.stop_event.is_set():
+                return STOP
+            try:
+                item = self.input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is STOP:
+                self.finished = True
+            else:
+                heapq.heappush(self.pending, item)
+
+
+class Pipeline:
+    """
+    소스와 여러 단계를 각각의 스레드에서 실행하는 파이프라인
+    """
+    def __init__(self, source, stages, maxsize=4):
+        '''
+        source : 첫 단계에 넘길 값을 생성하는 iterable (디코딩 등)
+        stages : Stage 리스트
+        maxsize : 단계 사이 큐의 최대 크기
+        '''
+        self.source = source
+        self.stages = stages
+        self.maxsize = maxsize
+
+        self.stop_event = threading.Event()
+        # 소스에서 더 읽지 않고 이미 들어간 값만 끝까지 처리
+        self.drain_event = threading.Event()
+        self.queues = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+        self.threads = []
+        self.error = None
+
+        # 단계별로 남아있는 작업 스레드 수
+        self.alive = [stage.workers for stage in stages]
+        self.alive_lock = threading.Lock()
+
+    def put(self, output_queue, item):
+        '''
+        큐가 가득 차 있으면 기다렸다가 넣음
+        중지되면 넣지 않고 False 반환
+        '''
+        while not self.stop_event.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fail(self, error):
+        '''
+        단계에서 발생한 예외를 기록하고 파이프라인 중지
+        '''
+        if self.error is None:
+            self.error = error
+        self.stop_event.set()
+
+    def runSource(self):
+        '''
+        소스에서 값을 읽어 순번을 붙여 첫 큐에 넣음
+        '''
+        try:
+            for seq, value in enumerate(self.source):
+                if self.drain_event.is_set():
+                    break
+                if not self.put(self.queues[0], (seq, value)):
+                    return
+        except Exception as e:
+            self.fail(e)
+        self.put(self.queues[0], STOP)
+
+    def runStage(self, index, reader):
+        '''
+        단계의 작업 스레드
+        입력을 순번 순서대로 읽어 처리하고 다음 큐에 넣음
+        '''
+        stage = self.stages[index]
+        output_queue = self.queues[index + 1]
+        try:
+            while True:
+                with reader.lock:
+                    item = reader.get()
+                if item is STOP:
+                    break
+                seq, value = item
+                if not self.put(output_queue, (seq, stage.func(value))):
+                    break
+        except Exception as e:
+            self.fail(e)
+        with self.alive_lock:
+            self.alive[index] -= 1
+            last = self.alive[index] == 0
+        if last:
+            self.put(output_queue, STOP)
+
+    def start(self):
+        '''
+        소스와 모든 단계의 스레드를 시작
+        '''
+        thread = threading.Thread(target=self.runSource, name='source')
+        thread.daemon = True
+        self.threads.append(thread)
+        for index, stage in enumerate(self.stages):
+            reader = OrderedReader(self.queues[index], self.stop_event)
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self.runStage,
+                                          args=(index, reader),
+                                          name='%s-%d' % (stage.name, worker))
+                thread.daemon = True
+                self.threads.append(thread)
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def results(self):
+        '''
+        마지막 단계의 출력을 입력 순서대로 반환하는 generator
+        단계에서 예외가 발생하면 그 예외를 다시 발생시킴
+        '''
+        reader = OrderedReader(self.queues[-1], self.stop_event)
+        while True:
+            item = reader.get()
+            if item is STOP:
+                break
+            yield item[1]
+        if self.error is not None:
+            raise self.error
+
+    def drain(self):
+        '''
+        소스에서 새 값을 읽지 않도록 하고, 이미 단계에 들어간 값은
+        모두 처리되어 results()로 나온 뒤 끝나도록 함
+        상태를 가지는 단계(추적 등)가 처리한 값을 버리지 않고 멈출 때 사용
+        '''
+        self.drain_event.set()
+
+    def stop(self):
+        '''
+        파이프라인을 중지하고 모든 스레드가 끝날 때까지 대기
+        '''
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
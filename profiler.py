@@ -0,0 +1,242 @@
+"""
+프레임 처리 단계별 소요 시간을 측정한다.
+단계마다 최근 N개의 측정값을 고리형 배열에 보관하여 p50/p95/p99를 계산하고
+JSON 스냅샷과 Prometheus 텍스트 형식 파일로 내보낸다.
+측정 비용은 단계당 수 마이크로초이므로 항상 켜 두고 사용할 수 있다.
+
+사용법 :
+    import profiler
+
+    with profiler.stage('detect'):
+        ...
+
+    @profiler.timed('tracking')
+    def tracking(...):
+        ...
+
+    profiler.PROFILER.writeJSON('metrics.json')
+    profiler.PROFILER.writePrometheus('metrics.prom')
+"""
+
+
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    한 단계의 최근 측정값(초)을 고리형 배열에 보관하는 클래스
+    """
+    def __init__(self, size=1024):
+        '''
+        size : 분위수 계산에 사용할 최근 측정값 수
+        '''
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        '''
+        측정값 하나를 기록
+        '''
+        with self.lock:
+            self.samples[self.index] = seconds
+            self.index = (self.index + 1) % len(self.samples)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def summary(self):
+        '''
+        누적 횟수, 합계, 평균, 최대와 최근 측정값의 분위수(초) 반환
+        '''
+        with self.lock:
+            samples = self.samples[:min(self.count, len(self.samples))].copy()
+            count, total, maximum = self.count, self.total, self.max
+        result = {'count': count, 'sum': total,
+                  'mean': total / count if count else 0.0, 'max': maximum}
+        values = np.quantile(samples, QUANTILES) if len(samples) else \
+            [0.0] * len(QUANTILES)
+        for quantile, value in zip(QUANTILES, values):
+            result['p%d' % round(quantile * 100)] = float(value)
+        return result
+
+
+class Stage:
+    """
+    with 문으로 단계의 소요 시간을 측정하는 클래스
+    """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class NullStage:
+    """
+    측정을 끈 경우 사용하는 아무것도 하지 않는 단계
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    """
+    단계 이름별 LatencyHistogram을 관리하는 클래스
+    """
+    def __init__(self, size=1024, prefix='defect_detector'):
+        '''
+        size : 단계별로 보관할 최근 측정값 수
+        prefix : Prometheus 지표 이름 앞에 붙일 이름
+        '''
+        self.size = size
+        self.prefix = prefix
+        self.enabled = True
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        '''
+        단계 이름의 LatencyHistogram 반환, 없으면 생성
+        '''
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(
+                    name, LatencyHistogram(self.size))
+        return histogram
+
+    def stage(self, name):
+        '''
+        with 문에서 사용할 단계 측정 객체 반환
+        '''
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self.histogram(name))
+
+    def record(self, name, seconds):
+        '''
+        직접 측정한 소요 시간(초) 기록
+        '''
+        if self.enabled:
+            self.histogram(name).record(seconds)
+
+    def reset(self):
+        '''
+        모든 측정값 제거
+        '''
+        with self.lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        '''
+        {단계 이름: 요약} 반환, 시간은 밀리초
+        '''
+        result = {}
+        for name, histogram in sorted(self.histograms.items()):
+            summary = histogram.summary()
+            result[name] = {key: value * 1000 if key != 'count' else value
+                            for key, value in summary.items()}
+        return result
+
+    def writeJSON(self, path):
+        '''
+        스냅샷을 JSON 파일로 기록
+        '''
+        writeAtomic(path, json.dumps({'time': time.time(),
+                                      'stages_ms': self.snapshot()},
+                                     indent=2))
+
+    def writePrometheus(self, path):
+        '''
+        스냅샷을 Prometheus 텍스트 형식(summary, 초 단위) 파일로 기록
+        node_exporter textfile collector 등에서 읽을 수 있음
+        '''
+        metric = self.prefix + '_stage_seconds'
+        lines = ['# HELP %s Frame path stage latency.' % metric,
+                 '# TYPE %s summary' % metric]
+        for name, histogram in sorted(self.histograms.items()):
+            summary = histogram.summary()
+            for quantile in QUANTILES:
+                lines.append('%s{stage="%s",quantile="%g"} %.9f' % (
+                    metric, name, quantile,
+                    summary['p%d' % round(quantile * 100)]))
+            lines.append('%s_sum{stage="%s"} %.9f' % (metric, name,
+                                                      summary['sum']))
+            lines.append('%s_count{stage="%s"} %d' % (metric, name,
+                                                      summary['count']))
+        writeAtomic(path, '\n'.join(lines) + '\n')
+
+    def report(self):
+        '''
+        단계별 요약을 출력
+        '''
+        for name, summary in self.snapshot().items():
+            print('%-20s n=%-7d mean %7.2f ms  p50 %7.2f  p95 %7.2f  '
+                  'p99 %7.2f' % (name, summary['count'], summary['mean'],
+                                 summary['p50'], summary['p95'],
+                                 summary['p99']))
+
+
+def writeAtomic(path, text):
+    '''
+    임시 파일에 기록한 뒤 교체하여 읽는 쪽이 쓰다 만 파일을 보지 않도록 함
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+# process wide profiler used by the frame path
+PROFILER = Profiler()
+
+
+def stage(name):
+    '''
+    PROFILER의 단계 측정 객체 반환
+    '''
+    return PROFILER.stage(name)
+
+
+def timed(name):
+    '''
+    함수 호출 전체를 name 단계로 측정하는 decorator
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
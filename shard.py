@@ -0,0 +1,249 @@
+"""
+긴 비디오를 프레임 구간(shard)으로 나누어 각 구간을 별도의 프로세스에서
+검출 및 추적하고, 구간 경계의 겹치는 프레임에서 추적 박스의 IOU로
+구간 사이의 추적 ID를 이어 붙인다.
+
+각 구간은 앞 구간과 overlap 프레임만큼 겹쳐서 처리하며 (추적기가 객체를
+확정하는 데 필요한 프레임), 겹친 프레임의 결과는 앞 구간의 것을 사용한다.
+프레임 번호는 cv2.CAP_PROP_POS_FRAMES와 같이 1부터 시작한다.
+
+사용법 :
+    python shard.py video.mp4 --cfg ... --weights ... --data ... --workers 8
+"""
+
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+import utils
+
+
+def shardRanges(num_frames, shards, overlap=15):
+    '''
+    전체 프레임 수, 구간 수, 겹침 프레임 수를 입력받아
+    구간별 (read_start, start, end) 프레임 인덱스(0부터) 리스트 반환
+    [start, end) 구간의 결과를 사용하고 [read_start, start)는 앞 구간과 겹치는 구간
+    '''
+    shards = max(1, min(shards, num_frames))
+    bounds = np.linspace(0, num_frames, shards + 1).round().astype(int)
+    return [(max(0, start - overlap), int(start), int(end))
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def processShard(job):
+    '''
+    한 구간을 검출 및 추적하는 작업 프로세스 함수
+    job : (video_path, (read_start, start, end), model, thresh, threads)
+          model은 (backend, cfg, weights, data)
+          threads는 프로세스당 OpenCV 스레드 수 (코어를 프로세스들이 나누어 사용)
+    반환 : 구간 정보와 프레임 번호별 검출 결과, 추적 결과, 소요 시간
+    '''
+    import detector
+    import tracker
+
+    video_path, (read_start, start, end), model, thresh, threads = job
+    backend, configPath, weightPath, metaPath = model
+    cv2.setNumThreads(threads)
+
+    det = detector.Detector(backend)
+    det.initialize(configPath, weightPath, metaPath)
+    track = tracker.Tracker()
+
+    cap = cv2.VideoCapture(video_path)
+    if read_start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, read_start)
+
+    detections, tracks = {}, {}
+    begin = time.perf_counter()
+    for index in range(read_start, end):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_num = index + 1
+        frame_detections = det.detector(frame, thresh)
+        detection_infos = track.convertDetection2Tracking(frame_detections,
+                                                          frame_num)
+        tracks[frame_num] = track.tracking(detection_infos, frame_num)
+        detections[frame_num] = frame_detections
+    elapsed = time.perf_counter() - begin
+    cap.release()
+    det.release()
+
+    return {'read_start': read_start, 'start': start, 'end': end,
+            'detections': detections, 'tracks': tracks, 'elapsed': elapsed,
+            'load_time': det.load_time}
+
+
+def trackBoxes(result, frames):
+    '''
+    구간 결과에서 주어진 프레임들의 {track id: {frame: (cx, cy, w, h)}} 반환
+    '''
+    boxes = {}
+    for frame in frames:
+        for track_id, _, box in result['tracks'].get(frame, []):
+            boxes.setdefault(track_id, {})[frame] = box
+    return boxes
+
+
+def matchTracks(previous, current, frames, iou_thresh=0.5, min_frames=3):
+    '''
+    겹치는 프레임에서 앞 구간과 현재 구간의 추적 ID를 매칭
+    두 추적이 함께 나타난 프레임이 min_frames 이상이고
+    평균 IOU가 iou_thresh 이상인 쌍을 평균 IOU가 높은 순으로 매칭
+    반환 : {현재 구간 id: 앞 구간 id}
+    '''
+    previous_boxes = trackBoxes(previous, frames)
+    current_boxes = trackBoxes(current, frames)
+
+    pairs = []
+    for current_id, current_track in current_boxes.items():
+        for previous_id, previous_track in previous_boxes.items():
+            common = sorted(set(current_track) & set(previous_track))
+            if len(common) < min_frames:
+                continue
+            ious = utils.boxIOUMatrix(
+                [current_track[frame] for frame in common],
+                [previous_track[frame] for frame in common]).diagonal()
+            pairs.append((float(ious.mean()), current_id, previous_id))
+
+    matches = {}
+    used = set()
+    for iou, current_id, previous_id in sorted(pairs, reverse=True):
+        if iou < iou_thresh:
+            break
+        if current_id in matches or previous_id in used:
+            continue
+        matches[current_id] = previous_id
+        used.add(previous_id)
+    return matches
+
+
+def stitchShards(results, iou_thresh=0.5, min_frames=3):
+    '''
+    구간별 결과를 프레임 순서대로 합치고 추적 ID를 전체 비디오 기준으로 다시 부여
+    반환 : {'detections': {frame: 검출 결과},
+            'tracks': {frame: [(id, confidence, (cx, cy, w, h)), ...]},
+            'stitched': 구간 경계에서 이어 붙인 추적 수}
+    '''
+    detections, tracks = {}, {}
+    next_id = 0
+    stitched = 0
+    previous, previous_ids = None, {}
+    for result in sorted(results, key=lambda result: result['start']):
+        # 구간 id -> 전체 id
+        global_ids = {}
+        if previous is not None:
+            overlap = range(result['read_start'] + 1, result['start'] + 1)
+            for current_id, previous_id in matchTracks(
+                    previous, result, overlap, iou_thresh,
+                    min_frames).items():
+                if previous_id in previous_ids:
+                    global_ids[current_id] = previous_ids[previous_id]
+                    stitched += 1
+
+        for frame in range(result['start'] + 1, result['end'] + 1):
+            if frame not in result['tracks']:
+                continue
+            frame_tracks = []
+            for track_id, confidence, box in result['tracks'][frame]:
+                if track_id not in global_ids:
+                    global_ids[track_id] = next_id
+                    next_id += 1
+                frame_tracks.append((global_ids[track_id], confidence, box))
+            tracks[frame] = frame_tracks
+            detections[frame] = result['detections'][frame]
+        previous, previous_ids = result, global_ids
+
+    return {'detections': detections, 'tracks': tracks, 'stitched': stitched}
+
+
+def processVideo(video_path, model, workers=None, shards=None, overlap=15,
+                 thresh=0.25, iou_thresh=0.5):
+    '''
+    비디오를 구간으로 나누어 workers개의 프로세스에서 처리한 뒤 결과를 이어 붙임
+    model : (backend, cfg, weights, data)
+    shards : 구간 수, None이면 workers와 같음
+    '''
+    workers = workers or os.cpu_count() or 1
+    cap = cv2.VideoCapture(video_path)
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    jobs = [(video_path, frame_range, model, thresh, threads)
+            for frame_range in shardRanges(num_frames, shards or workers,
+                                           overlap)]
+    begin = time.perf_counter()
+    if workers == 1:
+        results = [processShard(job) for job in jobs]
+    else:
+        # darknet(CUDA) 상태를 자식 프로세스에 복사하지 않도록 spawn 사용
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(min(workers, len(jobs))) as pool:
+            results = pool.map(processShard, jobs)
+    elapsed = time.perf_counter() - begin
+
+    stitched = stitchShards(results, iou_thresh)
+    stitched['elapsed'] = elapsed
+    stitched['shards'] = [(result['start'], result['end'], result['elapsed'])
+                          for result in results]
+    return stitched
+
+
+class TrackRecord:
+    """
+    utils.drawTrackResults에 넘기기 위한 추적 결과 한 개
+    """
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.bboxes = [utils.Rect(*box)]
+
+
+def writeResults(stitched, prefix):
+    '''
+    이어 붙인 결과를 utils.drawDetectionResults, drawTrackResults 형식으로 기록
+    <prefix>_detections.txt, <prefix>_tracks.txt
+    '''
+    with open(prefix + '_detections.txt', 'w') as writer:
+        for frame in sorted(stitched['detections']):
+            utils.drawDetectionResults(writer, stitched['detections'][frame],
+                                       frame)
+    with open(prefix + '_tracks.txt', 'w') as writer:
+        for frame in sorted(stitched['tracks']):
+            utils.drawTrackResults(writer, [
+                TrackRecord(track_id, box)
+                for track_id, _, box in stitched['tracks'][frame]], frame)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video')
+    parser.add_argument('--cfg')
+    parser.add_argument('--weights')
+    parser.add_argument('--data')
+    parser.add_argument('--backend', default='darknet')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shards', type=int,
+                        help='number of frame ranges (default: workers)')
+    parser.add_argument('--overlap', type=int, default=15,
+                        help='frames shared by neighbouring shards')
+    parser.add_argument('--thresh', type=float, default=0.25)
+    parser.add_argument('--out', help='output prefix (default: video name)')
+    args = parser.parse_args()
+
+    stitched = processVideo(args.video, (args.backend, args.cfg, args.weights,
+                                         args.data),
+                            args.workers, args.shards, args.overlap,
+                            args.thresh)
+    writeResults(stitched, args.out or os.path.splitext(args.video)[0])
+    frames = len(stitched['tracks'])
+    print('%d frames in %.1fs (%.1f fps), %d shards, %d tracks stitched' % (
+        frames, stitched['elapsed'], frames / stitched['elapsed'],
+        len(stitched['shards']), stitched['stitched']))
@@ -13,7 +13,9 @@ import math
 import cv2
 import numpy as np
 
+import association
 import utils
+from profiler import timed
 
 import time
 
@@ -58,13 +60,137 @@ class AdditionalInfo:
         self.tracking_confidence = confidence
 
 
+class History:
+    """
+    최근 capacity개의 행만 보관하는 고정 크기 고리형 배열
+    len()과 인덱스는 list와 같이 지금까지 추가된 전체 행 수 기준이며
+    보관 범위를 벗어난 오래된 행에 접근하면 IndexError가 발생한다.
+    """
+    __slots__ = ('data', 'capacity', 'total', 'latest')
+
+    def __init__(self, capacity=64, columns=1, dtype=np.float64):
+        '''
+        capacity : 보관할 최근 행의 수
+        columns : 행 하나의 값 수
+        '''
+        self.data = np.zeros((capacity, columns), dtype=dtype)
+        self.capacity = capacity
+        self.total = 0
+        # 가장 자주 읽는 마지막 행은 배열을 거치지 않도록 그대로 보관
+        self.latest = None
+
+    def __len__(self):
+        return self.total
+
+    def position(self, index):
+        '''
+        list 기준 인덱스를 고리형 배열의 위치로 변환
+        '''
+        total = self.total
+        if index < 0:
+            index += total
+        if index < 0 or index >= total or index < total - self.capacity:
+            raise IndexError('history index out of range')
+        return index % self.capacity
+
+    def __getitem__(self, index):
+        if index == -1 and self.latest is not None:
+            return self.latest
+        return self.data[self.position(index), 0].item()
+
+    def __iter__(self):
+        for index in range(max(0, self.total - self.capacity), self.total):
+            yield self[index]
+
+    def append(self, row):
+        '''
+        행 하나를 추가, 가득 차면 가장 오래된 행을 덮어씀
+        '''
+        self.data[self.total % self.capacity] = row
+        self.total += 1
+        self.latest = row
+
+    def last(self, count):
+        '''
+        최근 count개 행을 오래된 순서의 배열로 반환
+        '''
+        count = min(count, self.total, self.capacity)
+        end = self.total % self.capacity
+        if count <= end:
+            return self.data[end - count:end]
+        return np.concatenate([self.data[end - count:], self.data[:end]])
+
+
+class HistoryField:
+    """
+    History의 연속된 열을 한 항목으로 읽는 list 형태의 view
+    factory가 있으면 열 값들로 객체(utils.Rect 등)를 만들어 반환한다.
+    """
+    __slots__ = ('history', 'start', 'stop', 'factory')
+
+    def __init__(self, history, start, stop=None, factory=None):
+        self.history = history
+        self.start = start
+        self.stop = start + 1 if stop is None else stop
+        self.factory = factory
+
+    def __len__(self):
+        return self.history.total
+
+    def __getitem__(self, index):
+        history = self.history
+        if index == -1 and history.latest is not None:
+            values = history.latest[self.start:self.stop]
+        else:
+            values = history.data[history.position(index),
+                                  self.start:self.stop].tolist()
+        if self.factory is None:
+            return values[0]
+        return self.factory(*values)
+
+    def __iter__(self):
+        history = self.history
+        for index in range(max(0, history.total - history.capacity),
+                           history.total):
+            yield self[index]
+
+    def last(self, count):
+        '''
+        최근 count개 값을 오래된 순서의 배열로 반환
+        '''
+        values = self.history.last(count)[:, self.start:self.stop]
+        return values[:, 0] if self.factory is None else values
+
+
+# History 열 배치, 추적된 프레임마다 한 행
+(FRAME, BOX_X, BOX_Y, BOX_W, BOX_H, CENTER_X, CENTER_Y, DETECTION_CONFIDENCE,
+ TRACK_CONFIDENCE, DISTANCE, SPEED, SCALE, DIRECTION, HISTORY_COLUMNS) = \
+    range(14)
+
+
 class TrackerInfo:
     """
     추적 정보를 저장하기 위한 클래스
+    프레임마다 쌓이는 정보는 최근 capacity 프레임만 History에 보관하므로
+    추적 기간과 관계없이 객체당 메모리 사용량이 일정하다.
+    bboxes, centers 등은 History의 열을 읽는 view이며
+    list와 같이 len()과 인덱스([-1] 등)로 사용한다.
     """
-    def __init__(self):
+    __slots__ = ('id', 'flag', 'history',
+                 'tracked_frames', 'tracked_frames_count',
+                 'continuous_tracking_count',
+                 'detected_frames', 'detected_frames_count',
+                 'continuous_detection_count',
+                 'undetected_frames', 'undetected_frames_count',
+                 'continuous_undetection_count',
+                 'bboxes', 'centers', 'color',
+                 'detection_confidences', 'track_confidences',
+                 'distances', 'speeds', 'scales', 'directions')
+
+    def __init__(self, capacity=64):
         '''
         객체 추적 정보를 저장하기 위한 멤버 변수 선언
+        capacity : 보관할 최근 프레임 수
         '''
         # object id as integer num
         self.id = None
@@ -72,103 +198,118 @@ class TrackerInfo:
         # tracking flag
         self.flag = False
 
+        # per frame tracking history
+        self.history = History(capacity, HISTORY_COLUMNS)
+
         # tracking information
-        self.tracked_frames = []
+        self.tracked_frames = HistoryField(self.history, FRAME, factory=int)
         self.tracked_frames_count = 0
         self.continuous_tracking_count = 0
 
         # detection information
-        self.detected_frames = []
+        self.detected_frames = History(capacity, dtype=np.int64)
         self.detected_frames_count = 0
         self.continuous_detection_count = 0
 
         # undetected information
-        self.undetected_frames = []
+        self.undetected_frames = History(capacity, dtype=np.int64)
         self.undetected_frames_count = 0
         self.continuous_undetection_count = 0
 
         # tracked bboxes
-        self.bboxes = []
-        self.centers = []
+        self.bboxes = HistoryField(self.history, BOX_X, BOX_H + 1, utils.Rect)
+        self.centers = HistoryField(self.history, CENTER_X, CENTER_Y + 1,
+                                    utils.Point)
 
         # drawing box color as (b, g, r)
         self.color = None
 
         # total confidence
-        self.detection_confidences = []
-        self.track_confidences = []
+        self.detection_confidences = HistoryField(self.history,
+                                                  DETECTION_CONFIDENCE)
+        self.track_confidences = HistoryField(self.history, TRACK_CONFIDENCE)
 
         # euclidean distance between first box and last box
-        self.distances = []
+        self.distances = HistoryField(self.history, DISTANCE)
 
         # if current frame is n, distance is between n-1 and n-2
-        self.speeds = []
+        self.speeds = HistoryField(self.history, SPEED)
 
         # if current frame is n, scale is between n-1 and n-2
-        self.scales = []
+        self.scales = HistoryField(self.history, SCALE)
 
         # direction
-        self.directions = []
+        self.directions = HistoryField(self.history, DIRECTION)
+
+    def record(self, frame_number, bbox, center, detection_confidence,
+               info=None, track_confidence=0.5):
+        '''
+        추적된 프레임 하나의 정보를 History에 한 행으로 추가
+        info : 거리, 속도, 크기 변화율, 방향을 가진 AdditionalInfo, 없으면 0
+        '''
+        if info is None:
+            motion = (0, 0, 0, 0)
+        else:
+            motion = (info.distance, info.speed, info.scale, info.direction)
+        self.history.append((frame_number, bbox.x, bbox.y, bbox.width,
+                             bbox.height, center.x, center.y,
+                             detection_confidence, track_confidence) + motion)
 
     def initialize(self, track_id, frame_number, color, detection_info):
         '''
         새로운 객체 발생시 추적 정보를 새로 생성하는 함수
         '''
         self.id = track_id
-        self.tracked_frames.append(frame_number)
+        self.record(frame_number, detection_info.bbox, detection_info.center,
+                    detection_info.confidence)
         self.tracked_frames_count += 1
 
         self.detected_frames.append(detection_info.frame_number)
         self.detected_frames_count += 1
-        self.bboxes.append(detection_info.bbox)
-        self.centers.append(detection_info.center)
-        self.detection_confidences.append(detection_info.confidence)
-        self.track_confidences.append(0.5)
 
         self.color = color
 
         self.continuous_tracking_count += 1
 
-        self.distances.append(0)
-        self.speeds.append(0)
-        self.scales.append(0)
-        self.directions.append(0)
-
     def update(self, frame_number, additional_info, detection_info=None):
         '''
         개체가 지속적으로 추적될 시 추적 정보를 업데이트 하는 함수
         '''
-        self.tracked_frames.append(frame_number)
         self.tracked_frames_count += 1
-        self.track_confidences.append(additional_info.tracking_confidence)
         self.continuous_tracking_count += 1
 
-        self.distances.append(additional_info.distance)
-        self.speeds.append(additional_info.speed)
-        self.scales.append(additional_info.scale)
-        self.directions.append(additional_info.direction)
-        
         if detection_info != None:
+            self.record(frame_number, detection_info.bbox,
+                        detection_info.center, detection_info.confidence,
+                        additional_info, additional_info.tracking_confidence)
+
             self.detected_frames.append(detection_info.frame_number)
             self.detected_frames_count += 1
             self.continuous_detection_count += 1
 
-            self.bboxes.append(detection_info.bbox)
-            self.centers.append(detection_info.center)
-            self.detection_confidences.append(detection_info.confidence)
-
             self.continuous_undetection_count = 0
         else:
+            self.record(frame_number, additional_info.bbox,
+                        additional_info.center, 0, additional_info,
+                        additional_info.tracking_confidence)
+
             self.undetected_frames.append(frame_number)
             self.undetected_frames_count += 1
             self.continuous_undetection_count += 1
 
-            self.bboxes.append(additional_info.bbox)
-            self.centers.append(additional_info.center)
-            self.detection_confidences.append(0)
-
             self.continuous_detection_count =- 1
 
+    def predict(self, frame_number, additional_info):
+        '''
+        검출을 수행하지 않은 프레임에서 보완 정보로 추적 정보를 이어가는 함수
+        검출 실패가 아니므로 검출/미검출 횟수는 변경하지 않음
+        '''
+        self.record(frame_number, additional_info.bbox, additional_info.center,
+                    self.detection_confidences[-1], additional_info,
+                    additional_info.tracking_confidence)
+        self.tracked_frames_count += 1
+        self.continuous_tracking_count += 1
+
     def remove(self):
         '''
         추적 완료 및 실패시 추적 정보를 소멸하는 함수
@@ -176,14 +317,48 @@ class TrackerInfo:
         pass
 
 
+class TrackSnapshot:
+    """
+    그리기를 위해 추적 객체의 현재 상태를 복사한 클래스
+    추적이 다음 프레임으로 진행되어도 값이 바뀌지 않는다.
+    """
+    def __init__(self, tracker_info):
+        '''
+        추적 정보를 입력받아 아이디, 색상, 마지막 박스와 신뢰도를 복사
+        '''
+        bbox = tracker_info.bboxes[-1]
+        self.id = tracker_info.id
+        self.color = tracker_info.color
+        self.bboxes = [utils.Rect(bbox.x, bbox.y, bbox.width, bbox.height)]
+        self.detection_confidences = \
+            [tracker_info.detection_confidences[-1]]
+
+
 class Tracker:
     """
     다중 객체를 추적하여 관리하는 추적기 클래스
     """
-    def __init__(self):
+    def __init__(self, assignment='greedy', min_iou=0.1, grid_size=128,
+                 history=64):
         '''
         다중 추적을 위해 필요한 멤버 변수 선언
-        '''
+        assignment : 추적 객체와 검출 결과의 할당 방법
+                     association.ASSIGNMENTS의 이름 ('greedy', 'hungarian')
+        min_iou : 같은 객체로 볼 최소 IOU
+        grid_size : 겹칠 수 있는 추적-검출 쌍만 고르는 격자 칸 크기 (픽셀)
+                    None이면 모든 쌍의 IOU 행렬 계산
+        history : 추적 객체별로 보관할 최근 프레임 수
+                  (궤적 그리기에 30 프레임 사용)
+        '''
+        if assignment not in association.ASSIGNMENTS:
+            raise ValueError("Invalid assignment `" + str(assignment) + "`")
+        if history < 30:
+            raise ValueError("Invalid history `" + str(history) + "`")
+        self.assignment = assignment
+        self.min_iou = min_iou
+        self.grid = association.SpatialGrid(grid_size) \
+            if grid_size is not None else None
+        self.history = history
         self.track_num = 0
         self.track_cnt = 0
         self.frame_num = 0
@@ -200,9 +375,8 @@ class Tracker:
         '''
         새로운 추적 정보 발생시 새로운 추적 정보를 생성하여 등록
         '''
-        track = TrackerInfo()
+        track = TrackerInfo(self.history)
         track.initialize(-1, self.frame_num, self.color, detection_info)
-        track.centers.append(self.calculate_center(track.bboxes[-1]))
         self.color = random.sample(self.color_list, 3)
         self.track_candidate_infos.append(track)
         self.track_candidate_num -= 1
@@ -250,22 +424,14 @@ class Tracker:
         '''
         bbox = tracker_info.bboxes[-1]
         center = tracker_info.centers[-1]
-        speed = tracker_info.speeds[-1]
-        distance = tracker_info.distances[-1]
-        scale = tracker_info.scales[-1]
-        direction = tracker_info.directions[-1]
+        distance, speed, scale, direction = \
+            tracker_info.history.latest[DISTANCE:DIRECTION + 1]
         
         if tracker_info.tracked_frames_count > 3:
-            for i in range(-2, -5, -1):
-                speed += tracker_info.speeds[i]
-                distance += tracker_info.distances[i]
-                scale += tracker_info.scales[i]
-                direction += tracker_info.directions[i]
-
-            speed /= 3
-            distance /= 3
-            scale /= 3
-            direction /= 3
+            # 최근 4 프레임 값의 합을 3으로 나눔
+            distance, speed, scale, direction = (
+                tracker_info.history.last(4)[:, DISTANCE:DIRECTION + 1].sum(
+                    axis=0) / 3).tolist()
         
             #angle = self.radian(direction)
 
@@ -317,6 +483,18 @@ class Tracker:
                 self.remove(self.track_infos[idx])
         
 
+    def predict(self, frame_num):
+        '''
+        검출을 건너뛴 프레임에서 보완 알고리즘(compensation_box)으로
+        모든 추적 객체와 후보를 다음 프레임으로 이어감
+        '''
+        self.frame_num = frame_num
+        for tracker_info in self.track_infos + self.track_candidate_infos:
+            additional_info = self.additionalInfo(tracker_info)
+            tracker_info.predict(self.frame_num, additional_info)
+        return self.getTrackInfos()
+
+
     def remove(self, tracker_info):
         '''
         추적 실패 및 완료 객체에 대한 후처리
@@ -333,22 +511,62 @@ class Tracker:
             self.track_cnt -= 1
 
 
+    def boxArray(self, rects):
+        '''
+        utils.Rect 리스트를 [x, y, x + w, y + h] 형태의 N×4 배열로 변환
+        '''
+        boxes = np.array([(rect.x, rect.y, rect.width, rect.height)
+                          for rect in rects], dtype=float).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes
+
+
     def calculateIOUMap(self, track_infos, detection_infos):
         '''
         추적 객체와 검출된 정보를 비교하여 IOU 행렬 계산
+        추적 객체의 마지막 박스(N×4)와 검출 박스(M×4)를 broadcast하여
+        N×M 행렬을 한 번에 계산
         '''
         # calculate iou between last bbox of track_info and 
         # current bbox of detection_info
-        iou_matrix = []
-        for info in track_infos:
-            iou_list = []
-            for detection_info in detection_infos:
-                intersection_rect = \
-                    info.bboxes[-1].intersection(detection_info.bbox)
-                union_rect = info.bboxes[-1].union(detection_info.bbox)
-                iou_list.append(intersection_rect.area() / union_rect.area())
-            iou_matrix.append(iou_list)
-        return np.array(iou_matrix, dtype=float)
+        tracks = self.boxArray([info.bboxes[-1] for info in track_infos])
+        detections = self.boxArray([detection_info.bbox
+                                    for detection_info in detection_infos])
+
+        top_left = np.maximum(tracks[:, None, :2], detections[None, :, :2])
+        bottom_right = np.minimum(tracks[:, None, 2:], detections[None, :, 2:])
+        size = np.clip(bottom_right - top_left, 0, None)
+        intersection = size[..., 0] * size[..., 1]
+
+        track_area = np.prod(tracks[:, 2:] - tracks[:, :2], axis=1)
+        detection_area = np.prod(detections[:, 2:] - detections[:, :2], axis=1)
+        union = track_area[:, None] + detection_area[None, :] - intersection
+        return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+    def calculateIOUPairs(self, track_infos, detection_infos):
+        '''
+        격자에서 칸을 공유하는 추적-검출 쌍만 IOU를 계산하여
+        min_iou 이상인 (rows, cols, values) 희소 후보 목록 반환
+        격자는 추적 객체의 마지막 박스로 갱신하며 칸이 바뀐 객체만 다시 등록
+        '''
+        tracks = self.boxArray([info.bboxes[-1] for info in track_infos])
+        detections = self.boxArray([detection_info.bbox
+                                    for detection_info in detection_infos])
+        self.grid.sync(track_infos, tracks)
+        rows, cols = self.grid.candidatePairs(track_infos, detections)
+
+        a, b = tracks[rows], detections[cols]
+        size = np.clip(np.minimum(a[:, 2:], b[:, 2:]) -
+                       np.maximum(a[:, :2], b[:, :2]), 0, None)
+        intersection = size[:, 0] * size[:, 1]
+        union = np.prod(a[:, 2:] - a[:, :2], axis=1) + \
+            np.prod(b[:, 2:] - b[:, :2], axis=1) - intersection
+        values = np.where(union > 0,
+                          intersection / np.maximum(union, 1e-9), 0.0)
+
+        keep = values >= self.min_iou
+        return rows[keep], cols[keep], values[keep]
 
 
     def calculateColorMap(self, detection_infos):
@@ -452,6 +670,7 @@ class Tracker:
         return xmin, ymin, xmax, ymax
     
     
+    @timed('draw_tracks')
     def cvDrawBoxes(self, tracks, img):
         '''
         검출 결과와 이미지를 입력받아
@@ -476,6 +695,14 @@ class Tracker:
         return img
 
     
+    def snapshotTracks(self):
+        '''
+        현재 추적 객체들의 상태를 복사하여 반환
+        다른 스레드에서 그릴 때 사용
+        '''
+        return [TrackSnapshot(track) for track in self.track_infos]
+
+
     def getTrackInfos(self):
         '''
         추적 결과를 반환
@@ -483,10 +710,8 @@ class Tracker:
         '''
         rst = []
         for track in self.track_infos:
-            x, y, w, h = track.bboxes[-1].x,\
-                track.bboxes[-1].y,\
-                track.bboxes[-1].width ,\
-                track.bboxes[-1].height
+            bbox = track.bboxes[-1]
+            x, y, w, h = bbox.x, bbox.y, bbox.width, bbox.height
             rst.append([track.id, track.detection_confidences[-1], (x, y, w, h)])
         return rst
 
@@ -511,6 +736,7 @@ class Tracker:
         return detection_infos
 
 
+    @timed('tracking')
     def tracking(self, detection_infos, frame_num):
         '''
         검출 결과들을 입력 받아 현재 추적 정보들과 비교하여 추적 수행
@@ -530,19 +756,17 @@ class Tracker:
         tracker_idx_list = list(range(len(tracker_infos)))
 
         # calculate iou
-        iou_matrix = self.calculateIOUMap(tracker_infos, detection_infos)
-
-        iou_indexes = []
-        if iou_matrix.size != 0:
-            for _ in range(iou_matrix.shape[0]):    # pylint: disable=E1136  # pylint/issues/3139
-                idx = \
-                    np.unravel_index(np.argmax(iou_matrix), iou_matrix.shape)
-                value = np.max(iou_matrix)
-                if value < 0.1:
-                    break
-                iou_indexes.append([idx, value])
-                iou_matrix[idx[0], :] = 0
-                iou_matrix[:, idx[1]] = 0
+        if self.grid is not None:
+            rows, cols, values = self.calculateIOUPairs(tracker_infos,
+                                                        detection_infos)
+        else:
+            iou_matrix = self.calculateIOUMap(tracker_infos, detection_infos)
+            rows, cols, values = association.gatePairs(iou_matrix,
+                                                       self.min_iou)
+
+        # [[(track index, detection index), iou], ...]
+        iou_indexes = association.ASSIGNMENTS[self.assignment](rows, cols,
+                                                               values)
 
         # update for confidence pairs
         for iou_index in iou_indexes:
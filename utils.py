@@ -5,10 +5,13 @@
 
 import os
 import enum
+import json
 
 import cv2
 import numpy as np
 
+from profiler import timed
+
 
 class TRACK_END_STATE(enum.Enum):
     """
@@ -134,6 +137,91 @@ class Pair:
         return self.second_type
 
 
+class RegionOfInterest:
+    """
+    카메라별 검출 관심 영역(사각형 또는 다각형)
+    검출은 영역의 외접 사각형만 잘라서 수행하고
+    영역 밖의 검출 결과는 미리 만든 마스크를 조회하여 제거한다.
+    """
+    def __init__(self, points=None, rect=None, normalized=False):
+        '''
+        다각형 꼭지점 [(x, y), ...] 또는 사각형 (x, y, w, h)를 입력받아 생성
+        normalized가 True이면 좌표를 이미지 크기에 대한 비율(0.0~1.0)로 해석
+        '''
+        if points is None and rect is None:
+            raise ValueError("RegionOfInterest needs points or rect")
+        if points is None:
+            x, y, w, h = rect
+            points = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.normalized = normalized
+
+        # 이미지 크기별로 계산한 마스크와 외접 사각형
+        self.size = None
+        self.mask = None
+        self.bounds = None
+
+    @staticmethod
+    def fromConfig(path, camera):
+        '''
+        JSON 설정 파일에서 카메라의 관심 영역을 읽어 반환, 없으면 None
+        {"camera": {"polygon": [[x, y], ...]} 또는 {"rect": [x, y, w, h]},
+                    "normalized": true}
+        '''
+        with open(path) as f:
+            config = json.load(f)
+        if camera not in config:
+            return None
+        entry = config[camera]
+        return RegionOfInterest(points=entry.get('polygon'),
+                                rect=entry.get('rect'),
+                                normalized=entry.get('normalized', False))
+
+    def prepare(self, width, height):
+        '''
+        이미지 크기에 맞는 마스크와 외접 사각형 (x0, y0, x1, y1) 계산
+        같은 크기에 대해서는 한번만 계산
+        '''
+        if self.size == (width, height):
+            return
+        points = self.points
+        if self.normalized:
+            points = points * (width, height)
+        points = np.round(points).astype(np.int32)
+
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [points], 1)
+        x, y, w, h = cv2.boundingRect(points)
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("RegionOfInterest is outside of the image")
+        self.bounds = (x0, y0, x1, y1)
+        self.size = (width, height)
+
+    def crop(self, image):
+        '''
+        이미지에서 관심 영역의 외접 사각형을 복사 없이 잘라
+        (잘린 이미지, (x0, y0)) 반환
+        '''
+        height, width = image.shape[:2]
+        self.prepare(width, height)
+        x0, y0, x1, y1 = self.bounds
+        return image[y0:y1, x0:x1], (x0, y0)
+
+    def filter(self, detections):
+        '''
+        이미지 좌표의 (class_id, score, cx, cy, w, h) 검출 배열에서
+        중심점이 관심 영역 밖에 있는 검출 결과 제거
+        '''
+        if len(detections) == 0:
+            return detections
+        height, width = self.mask.shape
+        cx = np.clip(detections[:, 2].astype(np.int64), 0, width - 1)
+        cy = np.clip(detections[:, 3].astype(np.int64), 0, height - 1)
+        return detections[self.mask[cy, cx] > 0]
+
+
 def convertBack(x, y, w, h):
     '''
     x, y, width, height 정보를 입력받아 좌상단 및 우하단 좌표 계산
@@ -146,6 +234,7 @@ def convertBack(x, y, w, h):
     return xmin, ymin, xmax, ymax
 
 
+@timed('draw_detections')
 def cvDrawBoxes(detections, img):
     '''
     검출 결과와 이미지를 입력 받아
@@ -168,6 +257,7 @@ def cvDrawBoxes(detections, img):
     return img
 
 
+@timed('draw_tracks')
 def cvDrawTracks(tracks, img):
     '''
     추적 결과와 이미지를 입력 받아
@@ -252,6 +342,7 @@ def cvDrawCounters(counters, img):
     return img
 
 
+@timed('write_detections')
 def drawDetectionResults(writer, detections, frame_num):
     '''
     파일 discriptor, 추적 결과, 현재 프레임 번호를 입력받아
@@ -272,6 +363,7 @@ def drawDetectionResults(writer, detections, frame_num):
                      (frame_num, pt1[0], pt1[1], pt2[0], pt2[1]))
 
 
+@timed('write_tracks')
 def drawTrackResults(writer, tracks, frame_num):
     '''
     파일 discriptor, 추적 결과, 현재 프레임 번호를 입력받아
@@ -353,7 +445,6 @@ def writeAnnotations(file_name, detections, width, height, thresh=0.5):
     path = file_name
     f = open(path, 'w')
     for det in detections:
-        print(det[0])
         if det[1] < thresh:
             continue
         w = det[2][2] / width
@@ -372,7 +463,6 @@ def writeAnnotations_(file_name, detections, width, height, thresh=0.5):
     path = file_name
     f = open(path, 'w')
     for det in detections:
-        print(det[0])
         if det[1] < thresh:
             continue
         w = det[2][2] / width
@@ -380,4 +470,53 @@ def writeAnnotations_(file_name, detections, width, height, thresh=0.5):
         x = det[2][0] / width
         y = det[2][1] / height
         f.write("%s %f %f %f %f %f\n" % (det[0].decode(), det[1], x, y, w, h))
-    f.close()
\ No newline at end of file
+    f.close()
+
+def boxIOUMatrix(boxes_a, boxes_b, mode='iou'):
+    '''
+    (cx, cy, w, h) 박스 배열 두개를 입력받아 모든 쌍의 IOU 행렬 계산
+    mode가 'ios'이면 교집합을 두 박스 중 작은 넓이로 나눈 값 계산
+    (타일 경계에서 잘린 박스가 전체 박스에 포함되는 경우 사용)
+    '''
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    a_min = boxes_a[:, None, :2] - boxes_a[:, None, 2:] / 2
+    a_max = boxes_a[:, None, :2] + boxes_a[:, None, 2:] / 2
+    b_min = boxes_b[None, :, :2] - boxes_b[None, :, 2:] / 2
+    b_max = boxes_b[None, :, :2] + boxes_b[None, :, 2:] / 2
+    size = np.clip(np.minimum(a_max, b_max) - np.maximum(a_min, b_min),
+                   0, None)
+    intersection = size[..., 0] * size[..., 1]
+    area_a = boxes_a[:, None, 2] * boxes_a[:, None, 3]
+    area_b = boxes_b[None, :, 2] * boxes_b[None, :, 3]
+    if mode == 'ios':
+        union = np.minimum(area_a, area_b)
+    else:
+        union = area_a + area_b - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0)
+
+
+def nonMaxSuppression(detections, iou_thresh=0.45, class_aware=True,
+                      mode='iou'):
+    '''
+    (class_id, score, cx, cy, w, h) 검출 배열을 입력받아
+    IOU가 iou_thresh보다 큰 중복 박스를 신뢰도가 높은 박스만 남기고 제거
+    IOU 행렬은 한번에 계산하고 신뢰도 순으로 억제 여부만 갱신
+    mode는 boxIOUMatrix 참고
+    '''
+    if len(detections) == 0:
+        return detections
+    # 신뢰도가 같으면 넓은 박스 우선 (타일 경계에서 잘린 박스보다 전체 박스)
+    order = np.lexsort((-detections[:, 4] * detections[:, 5],
+                        -detections[:, 1]))
+    detections = detections[order]
+    iou = boxIOUMatrix(detections[:, 2:6], detections[:, 2:6], mode)
+    overlap = iou > iou_thresh
+    if class_aware:
+        overlap &= detections[:, None, 0] == detections[None, :, 0]
+    keep = np.ones(len(detections), dtype=bool)
+    for i in range(len(detections)):
+        if keep[i]:
+            # 자신보다 신뢰도가 낮은 중복 박스 제거
+            keep[i + 1:] &= ~overlap[i, i + 1:]
+    return detections[keep]